@@ -9,13 +9,32 @@ files.  At this time it has cache helpers and understands the
 if-modified-since request header.
 """
 
-import os, time, mimetypes, zipfile, tarfile
+import os, time, struct, mimetypes, zipfile, tarfile
 from paste.httpexceptions import *
 from paste.httpheaders import *
+from paste.util.lrucache import LRUCache
 
+# Files up to this size are kept in memory by ArchiveStore, and by
+# FileApp when the server can send files itself:
 CACHE_SIZE = 4096
 BLOCK_SIZE = 4096 * 16
 
+# The contents of all FileApps together are limited to this many bytes
+# (change content_cache.max_bytes to adjust it at runtime):
+CONTENT_CACHE_BYTES = 16 * 1024 * 1024
+content_cache = LRUCache(max_bytes=CONTENT_CACHE_BYTES)
+
+# Files up to this size are kept in memory by FileApp when there is no
+# wsgi.file_wrapper, as long as they fit in content_cache (FileApp's
+# cache_size overrides it):
+FILE_CACHE_SIZE = CONTENT_CACHE_BYTES // 16
+
+# Default limits for the applications DirectoryApp and ArchiveStore
+# keep:
+DIRECTORY_CACHE_ENTRIES = 1000
+ARCHIVE_CACHE_ENTRIES = 1000
+ARCHIVE_CACHE_BYTES = 16 * 1024 * 1024
+
 __all__ = ['DataApp', 'FileApp', 'DirectoryApp', 'ArchiveStore']
 
 class DataApp(object):
@@ -122,7 +141,7 @@ class DataApp(object):
                         for head in list_headers(entity=True):
                             head.delete(headers)
                         start_response('304 Not Modified', headers)
-                        return ['']
+                        return [b'']
         except HTTPBadRequest as exce:
             return exce.wsgi_application(environ, start_response)
 
@@ -133,12 +152,13 @@ class DataApp(object):
         if not client_etags:
             try:
                 client_clock = IF_MODIFIED_SINCE.parse(environ)
-                if client_clock >= int(self.last_modified):
+                if (client_clock is not None
+                    and client_clock >= int(self.last_modified)):
                     # horribly inefficient, n^2 performance, yuck!
                     for head in list_headers(entity=True):
                         head.delete(headers)
                     start_response('304 Not Modified', headers)
-                    return [''] # empty body
+                    return [b''] # empty body
             except HTTPBadRequest as exce:
                 return exce.wsgi_application(environ, start_response)
 
@@ -171,10 +191,24 @@ class FileApp(DataApp):
     Returns an application that will send the file at the given
     filename.  Adds a mime type based on ``mimetypes.guess_type()``.
     See DataApp for the arguments beyond ``filename``.
+
+    Files smaller than ``cache_size`` bytes (by default
+    ``FILE_CACHE_SIZE``) are kept in memory, in the module-wide
+    ``content_cache``; when that is full the least recently used
+    contents are dropped, and read from disk again as needed.  Larger
+    files are read from disk for each request.  When the server gives
+    a ``wsgi.file_wrapper`` (``paste.httpserver``'s uses ``sendfile``)
+    only files smaller than ``CACHE_SIZE`` are kept in memory, and the
+    rest are sent by the file wrapper.
     """
 
-    def __init__(self, filename, headers=None, **kwargs):
+    _content_key = None
+    cache_size = FILE_CACHE_SIZE
+
+    def __init__(self, filename, headers=None, cache_size=None, **kwargs):
         self.filename = filename
+        if cache_size is not None:
+            self.cache_size = cache_size
         content_type, content_encoding = self.guess_type()
         if content_type and 'content_type' not in kwargs:
             kwargs['content_type'] = content_type
@@ -185,12 +219,38 @@ class FileApp(DataApp):
     def guess_type(self):
         return mimetypes.guess_type(self.filename)
 
-    def update(self, force=False):
+    def content__get(self):
+        if self._content_key is None:
+            return None
+        return content_cache.peek(self._content_key)
+
+    def content__set(self, content):
+        if self._content_key is not None:
+            content_cache.pop(self._content_key)
+            self._content_key = None
+        if content is not None:
+            key = (self.filename, self.last_modified)
+            if content_cache.set(key, content, len(content)):
+                self._content_key = key
+
+    content = property(content__get, content__set)
+
+    def update(self, force=False, cache_size=None):
+        if cache_size is None:
+            cache_size = self.cache_size
         stat = os.stat(self.filename)
+        cache = stat.st_size < cache_size and (
+            content_cache.max_bytes is None
+            or stat.st_size <= content_cache.max_bytes)
         if not force and stat.st_mtime == self.last_modified:
-            return
+            if not cache:
+                return
+            if (self._content_key is not None
+                and content_cache.get(self._content_key) is not None):
+                return
+            # The content was dropped from the cache; read it again
         self.last_modified = stat.st_mtime
-        if stat.st_size < CACHE_SIZE:
+        if cache:
             fh = open(self.filename,"rb")
             self.set_content(fh.read(), stat.st_mtime)
             fh.close()
@@ -203,10 +263,16 @@ class FileApp(DataApp):
 
     def get(self, environ, start_response):
         is_head = environ['REQUEST_METHOD'].upper() == 'HEAD'
+        cache_size = self.cache_size
+        if environ.get('wsgi.file_wrapper') is not None:
+            # Sending the file from disk (with sendfile, if the server
+            # can) beats copying it out of memory
+            cache_size = min(cache_size, CACHE_SIZE)
         if 'max-age=0' in CACHE_CONTROL(environ).lower():
-            self.update(force=True) # RFC 2616 13.2.6
+            self.update(force=True, cache_size=cache_size) # RFC 2616 13.2.6
         else:
-            self.update()
+            self.update(cache_size=cache_size)
+        file = None
         if not self.content:
             if not os.path.exists(self.filename):
                 exc = HTTPNotFound(
@@ -221,14 +287,17 @@ class FileApp(DataApp):
                 return exc.wsgi_application(
                     environ, start_response)
         retval = DataApp.get(self, environ, start_response)
-        if isinstance(retval, list):
+        if isinstance(retval, list) or is_head:
             # cached content, exception, or not-modified
+            if file is not None:
+                file.close()
             if is_head:
-                return ['']
+                return [b'']
             return retval
         (lower, content_length) = retval
-        if is_head:
-            return ['']
+        if file is None:
+            # The content was dropped from the cache since we checked
+            file = open(self.filename, 'rb')
         file.seek(lower)
         file_wrapper = environ.get('wsgi.file_wrapper', None)
         if file_wrapper:
@@ -266,27 +335,34 @@ class DirectoryApp(object):
     Returns an application that dispatches requests to corresponding FileApps based on PATH_INFO.
     FileApp instances are cached. This app makes sure not to serve any files that are not in a subdirectory.
     To customize FileApp creation override ``DirectoryApp.make_fileapp``
+
+    The FileApps are kept in ``cache``, a ``paste.util.lrucache.LRUCache``
+    (by default one holding ``DIRECTORY_CACHE_ENTRIES`` apps); a cache
+    can be shared between several DirectoryApps.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, cache=None):
         self.path = os.path.abspath(path)
         if not self.path.endswith(os.path.sep):
             self.path += os.path.sep
         assert os.path.isdir(self.path)
-        self.cached_apps = {}
+        if cache is None:
+            cache = LRUCache(max_entries=DIRECTORY_CACHE_ENTRIES)
+        self.cached_apps = cache
 
     make_fileapp = FileApp
 
     def __call__(self, environ, start_response):
         path_info = environ['PATH_INFO']
-        app = self.cached_apps.get(path_info)
+        key = (self.path, path_info)
+        app = self.cached_apps.get(key)
         if app is None:
             path = os.path.join(self.path, path_info.lstrip('/'))
             if not os.path.normpath(path).startswith(self.path):
                 app = HTTPForbidden()
             elif os.path.isfile(path):
                 app = self.make_fileapp(path)
-                self.cached_apps[path_info] = app
+                self.cached_apps[key] = app
             else:
                 app = HTTPNotFound(comment=path)
         return app(environ, start_response)
@@ -301,54 +377,217 @@ class ArchiveStore(object):
 
         ``filepath``    the path to the archive being served
 
+        ``cache``       a ``paste.util.lrucache.LRUCache`` to keep the
+                        applications for the files in (by default one
+                        limited to ``ARCHIVE_CACHE_ENTRIES`` files and
+                        ``ARCHIVE_CACHE_BYTES`` bytes)
+
     ``cache_control()``
 
         This method provides validated construction of the ``Cache-Control``
         header as well as providing for automated filling out of the
         ``EXPIRES`` header for HTTP/1.0 clients.
+
+    Files smaller than ``CACHE_SIZE`` are extracted and kept in memory.
+    Larger files are read from the archive for each request, in blocks,
+    starting at the requested range: files stored uncompressed (in a
+    zip, or in an uncompressed tar) are read directly from their offset
+    in the archive, and compressed zip members are decompressed as they
+    are sent.  The ``ZipFile`` is shared by all requests (it can open
+    several members at once).
+
+    A compressed tar can only be read from the start, so its files are
+    extracted once and kept in ``cache`` like small files, as long as
+    they fit in its byte limit.  Files too large for that are
+    decompressed for each request through a separate handle on the
+    archive.
     """
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, cache=None):
+        self.filepath = filepath
         if zipfile.is_zipfile(filepath):
             self.archive = zipfile.ZipFile(filepath,"r")
+            self.members = None
         elif tarfile.is_tarfile(filepath):
-            self.archive = tarfile.TarFileCompat(filepath,"r")
+            try:
+                self.archive = tarfile.open(filepath, "r:")
+                self.compressed = False
+            except tarfile.ReadError:
+                self.archive = tarfile.open(filepath, "r:*")
+                self.compressed = True
+            self.members = dict((member.name, member)
+                                for member in self.archive.getmembers())
         else:
             raise AssertionError("filepath '%s' is not a zip or tar " % filepath)
         self.expires = None
         self.last_modified = time.time()
-        self.cache = {}
+        if cache is None:
+            cache = LRUCache(max_entries=ARCHIVE_CACHE_ENTRIES,
+                             max_bytes=ARCHIVE_CACHE_BYTES)
+        self.cache = cache
 
     def cache_control(self, **kwargs):
         self.expires = CACHE_CONTROL.apply(self.headers, **kwargs) or None
         return self
 
+    def get_member(self, path):
+        """
+        Returns ``(size, last_modified, offset)`` for the file at `path`
+        in the archive, where `offset` is the position of its data in
+        the archive file if it is stored uncompressed (otherwise None).
+        Returns None for directories, and raises KeyError if there is
+        nothing at `path`.
+        """
+        if self.members is None:
+            info = self.archive.getinfo(path)
+            if info.filename.endswith("/"):
+                return None
+            offset = None
+            if (info.compress_type == zipfile.ZIP_STORED
+                and not info.flag_bits & 0x1):
+                # The data follows the local file header:
+                fp = open(self.filepath, 'rb')
+                try:
+                    fp.seek(info.header_offset)
+                    header = fp.read(zipfile.sizeFileHeader)
+                finally:
+                    fp.close()
+                header = struct.unpack(zipfile.structFileHeader, header)
+                if header[0] == zipfile.stringFileHeader:
+                    offset = (info.header_offset + zipfile.sizeFileHeader
+                              + header[10] + header[11])
+            return (info.file_size, time.mktime(info.date_time + (0,0,0)),
+                    offset)
+        member = self.members[path]
+        if not member.isfile():
+            return None
+        if self.compressed:
+            offset = None
+        else:
+            offset = member.offset_data
+        return member.size, member.mtime, offset
+
+    def keep_member(self, size, offset):
+        """
+        Returns true if a file of `size` bytes (with `offset` as
+        returned by ``get_member()``) should be kept in memory even
+        though it isn't smaller than ``CACHE_SIZE``.
+        """
+        if self.members is None or offset is not None:
+            # It can be read from any position
+            return False
+        max_bytes = getattr(self.cache, 'max_bytes', None)
+        return max_bytes is None or size <= max_bytes
+
+    def open_member(self, path, offset=None, start=0):
+        """
+        Returns a file object for the file at `path` in the archive,
+        positioned `start` bytes into the file.  `offset` is as
+        returned by ``get_member()``.
+        """
+        if offset is not None:
+            fp = open(self.filepath, 'rb')
+            fp.seek(offset + start)
+            return fp
+        if self.members is None:
+            fp = self.archive.open(path)
+        else:
+            fp = _TarMemberFile(self.filepath, self.members[path])
+        if start:
+            fp.seek(start)
+        return fp
+
     def __call__(self, environ, start_response):
         path = environ.get("PATH_INFO","")
         if path.startswith("/"):
             path = path[1:]
-        application = self.cache.get(path)
+        key = (self.filepath, path)
+        application = self.cache.get(key)
         if application:
             return application(environ, start_response)
         try:
-            info = self.archive.getinfo(path)
+            member = self.get_member(path)
         except KeyError:
             exc = HTTPNotFound("The file requested, '%s', was not found." % path)
             return exc.wsgi_application(environ, start_response)
-        if info.filename.endswith("/"):
+        if member is None:
             exc = HTTPNotFound("Path requested, '%s', is not a file." % path)
             return exc.wsgi_application(environ, start_response)
-        content_type, content_encoding = mimetypes.guess_type(info.filename)
+        size, last_modified, offset = member
+        content_type, content_encoding = mimetypes.guess_type(path)
         # 'None' is not a valid content-encoding, so don't set the header if
         # mimetypes.guess_type returns None
+        kwargs = {'content_type': content_type}
         if content_encoding is not None:
-            app = DataApp(None, content_type = content_type,
-                                content_encoding = content_encoding)
+            kwargs['content_encoding'] = content_encoding
+        if size < CACHE_SIZE or self.keep_member(size, offset):
+            app = DataApp(None, **kwargs)
+            fp = self.open_member(path, offset)
+            try:
+                app.set_content(fp.read(size), last_modified)
+            finally:
+                fp.close()
+            self.cache.set(key, app, app.content_length)
         else:
-            app = DataApp(None, content_type = content_type)
-        app.set_content(self.archive.read(path),
-                time.mktime(info.date_time + (0,0,0)))
-        self.cache[path] = app
+            app = _ArchiveMemberApp(self, path, size, last_modified,
+                                    offset, **kwargs)
+            self.cache.set(key, app)
         app.expires = self.expires
         return app(environ, start_response)
 
+
+class _TarMemberFile(object):
+    """
+    A file in a compressed tar, read through its own ``TarFile`` so
+    that requests don't share (and have to take turns with) one
+    decompressor.
+    """
+
+    def __init__(self, filepath, member):
+        self.archive = tarfile.open(filepath, "r:*")
+        try:
+            self.file = self.archive.extractfile(member)
+        except:
+            self.archive.close()
+            raise
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, pos):
+        self.file.seek(pos)
+
+    def close(self):
+        self.file.close()
+        self.archive.close()
+
+
+class _ArchiveMemberApp(DataApp):
+    """
+    Sends a file from an ``ArchiveStore``, reading it from the archive
+    on each request.
+    """
+
+    def __init__(self, store, path, size, last_modified, offset,
+                 **kwargs):
+        DataApp.__init__(self, None, **kwargs)
+        self.store = store
+        self.path = path
+        self.offset = offset
+        self.content_length = size
+        self.last_modified = last_modified
+        LAST_MODIFIED.update(self.headers, time=last_modified)
+
+    def get(self, environ, start_response):
+        is_head = environ['REQUEST_METHOD'].upper() == 'HEAD'
+        retval = DataApp.get(self, environ, start_response)
+        if isinstance(retval, list):
+            # exception, or not-modified
+            if is_head:
+                return [b'']
+            return retval
+        (lower, content_length) = retval
+        if is_head:
+            return [b'']
+        return _FileIter(self.store.open_member(self.path, self.offset, lower),
+                         size=content_length)
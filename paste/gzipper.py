@@ -10,87 +10,209 @@ WSGI middleware
 Gzip-encodes the response.
 """
 
-import gzip
+import zlib
 from paste.response import header_value, remove_header
-from paste.httpheaders import CONTENT_LENGTH
-
-try:
-    from io import StringIO
-except ImportError:
-    from io import StringIO
-
-class GzipOutput(object):
-    pass
+from paste.util.converters import aslist
+
+# Content types that are compressed by default; a trailing ``/*``
+# matches any subtype
+DEFAULT_COMPRESS_TYPES = (
+    'text/*',
+    'application/javascript',
+    'application/x-javascript',
+    'application/json',
+    'application/xml',
+    'application/xhtml+xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'image/svg+xml',
+    )
 
 class middleware(object):
 
-    def __init__(self, application, compress_level=6):
+    """
+    Compresses responses for clients that accept gzip.
+
+    Only responses whose content type matches ``compress_types`` are
+    compressed, and only once they reach ``min_size`` bytes; smaller
+    responses are sent as they are.  Compression is done
+    incrementally, so the response is passed on as the application
+    produces it instead of being held in memory: the compressed data
+    is flushed after each chunk the application returns.  Responses to
+    ``HEAD`` requests are passed on as they are.
+    """
+
+    def __init__(self, application, compress_level=6, min_size=200,
+                 compress_types=DEFAULT_COMPRESS_TYPES):
         self.application = application
         self.compress_level = int(compress_level)
+        self.min_size = int(min_size)
+        self.compress_types = tuple(compress_types)
 
     def __call__(self, environ, start_response):
-        if 'gzip' not in environ.get('HTTP_ACCEPT_ENCODING', ''):
-            # nothing for us to do, so this middleware will
-            # be a no-op:
-            return self.application(environ, start_response)
-        response = GzipResponse(start_response, self.compress_level)
+        if ('gzip' not in environ.get('HTTP_ACCEPT_ENCODING', '')
+            or environ.get('REQUEST_METHOD') == 'HEAD'):
+            # nothing to compress (a HEAD response has no body), but
+            # caches still need to know the response depends on
+            # Accept-Encoding
+            def vary_start_response(status, headers, exc_info=None):
+                if compressible_type(header_value(headers, 'content-type'),
+                                     self.compress_types):
+                    add_vary(headers)
+                return start_response(status, headers, exc_info)
+            return self.application(environ, vary_start_response)
+        response = GzipResponse(start_response, self.compress_level,
+                                self.min_size, self.compress_types)
         app_iter = self.application(environ,
                                     response.gzip_start_response)
-        if app_iter is not None:
-            response.finish_response(app_iter)
+        if app_iter is None:
+            app_iter = []
+        return response.finish_response(app_iter)
 
-        return response.write()
+def compressible_type(content_type, compress_types):
+    """
+    Returns true if ``content_type`` matches one of ``compress_types``.
+    """
+    if not content_type:
+        return False
+    content_type = content_type.split(';', 1)[0].strip().lower()
+    for pattern in compress_types:
+        if pattern.endswith('/*'):
+            if content_type.startswith(pattern[:-1]):
+                return True
+        elif content_type == pattern:
+            return True
+    return False
+
+def add_vary(headers, name='Accept-Encoding'):
+    """
+    Adds ``name`` to the ``Vary`` header, unless it's already there.
+    """
+    vary = header_value(headers, 'vary')
+    if not vary:
+        headers.append(('Vary', name))
+        return
+    values = [v.strip().lower() for v in vary.split(',')]
+    if name.lower() not in values and '*' not in values:
+        remove_header(headers, 'vary')
+        headers.append(('Vary', '%s, %s' % (vary, name)))
 
 class GzipResponse(object):
 
-    def __init__(self, start_response, compress_level):
+    def __init__(self, start_response, compress_level, min_size=200,
+                 compress_types=DEFAULT_COMPRESS_TYPES):
         self.start_response = start_response
         self.compress_level = compress_level
-        self.buffer = StringIO()
+        self.min_size = min_size
+        self.compress_types = compress_types
+        # Output given to the write callable
+        self.pending = []
+        self.started = False
         self.compressible = False
-        self.content_length = None
+        self.status = None
 
     def gzip_start_response(self, status, headers, exc_info=None):
-        self.headers = headers
-        ct = header_value(headers,'content-type')
-        ce = header_value(headers,'content-encoding')
+        if exc_info:
+            try:
+                if self.started:
+                    raise exc_info[0](exc_info[1]).with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError("Headers already set!")
+        ct = header_value(headers, 'content-type')
+        ce = header_value(headers, 'content-encoding')
+        cl = header_value(headers, 'content-length')
         self.compressible = False
-        if ct and (ct.startswith('text/') or ct.startswith('application/')) \
-            and 'zip' not in ct:
+        if compressible_type(ct, self.compress_types):
+            add_vary(headers)
             self.compressible = True
-        if ce:
+        if ce or int(status.split()[0]) in (204, 304):
+            self.compressible = False
+        if cl is not None and int(cl) < self.min_size:
             self.compressible = False
-        if self.compressible:
-            headers.append(('content-encoding', 'gzip'))
-        remove_header(headers, 'content-length')
         self.headers = headers
         self.status = status
-        return self.buffer.write
-
-    def write(self):
-        out = self.buffer
-        out.seek(0)
-        s = out.getvalue()
-        out.close()
-        return [s]
+        return self.write
+
+    def write(self, data):
+        self.pending.append(data)
+
+    def body_chunks(self, body):
+        """
+        Yields the chunks of ``body``, and the output given to
+        ``write`` while they were produced (which comes first).
+        """
+        for chunk in body:
+            if self.pending:
+                pending, self.pending = self.pending, []
+                for data in pending:
+                    yield data
+            yield chunk
+        if self.pending:
+            pending, self.pending = self.pending, []
+            for data in pending:
+                yield data
 
     def finish_response(self, app_iter):
-        if self.compressible:
-            output = gzip.GzipFile(mode='wb', compresslevel=self.compress_level,
-                fileobj=self.buffer)
-        else:
-            output = self.buffer
+        """
+        Generates the response body, calling ``start_response`` once
+        it is known whether the body will be compressed.
+        """
         try:
-            for s in app_iter:
-                output.write(s)
-            if self.compressible:
-                output.close()
+            body = self.body_chunks(app_iter)
+            buffered = []
+            size = 0
+            finished = False
+            # The application may only call start_response once it is
+            # iterated; after that, hold on to the start of the body
+            # until we know if it's worth compressing
+            while (self.status is None
+                   or (self.compressible and size < self.min_size)):
+                try:
+                    chunk = next(body)
+                except StopIteration:
+                    finished = True
+                    break
+                buffered.append(chunk)
+                size += len(chunk)
+            if self.status is None:
+                raise AssertionError(
+                    "The application did not call start_response")
+            if finished:
+                self.compressible = False
+            if not self.compressible:
+                if (finished
+                    and header_value(self.headers, 'content-length') is None
+                    and int(self.status.split()[0]) not in (204, 304)):
+                    self.headers.append(('Content-Length', str(size)))
+                self.started = True
+                self.start_response(self.status, self.headers)
+                for chunk in buffered:
+                    yield chunk
+                for chunk in body:
+                    yield chunk
+                return
+            remove_header(self.headers, 'content-length')
+            self.headers.append(('Content-Encoding', 'gzip'))
+            self.started = True
+            self.start_response(self.status, self.headers)
+            # wbits of 16 + MAX_WBITS gives the gzip header and trailer
+            compressor = zlib.compressobj(
+                self.compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            # Flush after each chunk, so output the application streams
+            # isn't held back waiting for a full deflate block
+            yield (compressor.compress(b''.join(buffered))
+                   + compressor.flush(zlib.Z_SYNC_FLUSH))
+            del buffered
+            for chunk in body:
+                if chunk:
+                    yield (compressor.compress(chunk)
+                           + compressor.flush(zlib.Z_SYNC_FLUSH))
+            yield compressor.flush()
         finally:
             if hasattr(app_iter, 'close'):
                 app_iter.close()
-        content_length = self.buffer.tell()
-        CONTENT_LENGTH.update(self.headers, content_length)
-        self.start_response(self.status, self.headers)
 
 def filter_factory(application, **conf):
     import warnings
@@ -101,11 +223,20 @@ def filter_factory(application, **conf):
         return middleware(application)
     return filter
 
-def make_gzip_middleware(app, global_conf, compress_level=6):
+def make_gzip_middleware(app, global_conf, compress_level=6, min_size=200,
+                         compress_types=None):
     """
     Wrap the middleware, so that it applies gzipping to a response
-    when it is supported by the browser and the content is of
-    type ``text/*`` or ``application/*``
+    when it is supported by the browser, the content is of one of
+    the ``compress_types`` (by default ``text/*`` and the common
+    JavaScript, JSON and XML types) and at least ``min_size`` bytes
+    long.
     """
     compress_level = int(compress_level)
-    return middleware(app, compress_level=compress_level)
+    if compress_types is None:
+        compress_types = DEFAULT_COMPRESS_TYPES
+    else:
+        compress_types = aslist(compress_types)
+    return middleware(app, compress_level=compress_level,
+                      min_size=int(min_size),
+                      compress_types=compress_types)
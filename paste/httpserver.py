@@ -14,16 +14,18 @@ if pyOpenSSL is installed, it also provides SSL capabilities.
 # @@: add in protection against HTTP/1.0 clients who claim to
 #     be 1.1 but do not send a Content-Length
 
-# @@: add support for chunked encoding, this is not a 1.1 server
-#     till this is completed.
-
 import atexit
+import collections
+import selectors
 import traceback
 import socket, sys, threading, urllib.parse, queue, urllib.request, urllib.parse, urllib.error
 import posixpath
+import random
+import stat
 import time
 import _thread
 import os
+import signal
 from itertools import count
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from socketserver import ThreadingMixIn
@@ -82,6 +84,31 @@ class ContinueHook(object):
         self._ContinueFile_send()
         return self._ContinueFile_rfile.readlines(sizehint)
 
+class FileWrapper(object):
+    """
+    The ``wsgi.file_wrapper`` given to applications.
+
+    Iterating it reads the file in ``block_size`` blocks, but
+    `WSGIHandlerMixin` recognizes it and sends regular files with
+    ``socket.sendfile()`` (``os.sendfile``) instead, starting at the
+    current file position and stopping after ``Content-Length`` bytes.
+    """
+
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+        self.block_size = block_size
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.block_size)
+        if data:
+            return data
+        raise StopIteration
+
 class WSGIHandlerMixin:
     """
     WSGI mix-in for HTTPRequestHandler
@@ -91,6 +118,10 @@ class WSGIHandlerMixin:
     This assumes a ``wsgi_application`` handler on ``self.server``.
     """
     lookup_addresses = True
+    # Response output is collected until this many bytes are pending,
+    # then written with a single (gather) write; 0 writes every chunk
+    # straight through:
+    wsgi_output_buffer_size = 8192
 
     def log_request(self, *args, **kwargs):
         """ disable success request logging
@@ -129,8 +160,9 @@ class WSGIHandlerMixin:
             code, message = status.split(" ", 1)
             self.send_response(int(code), message)
             #
-            # HTTP/1.1 compliance; either send Content-Length or
-            # signal that the connection is being closed.
+            # HTTP/1.1 compliance; either send Content-Length, use
+            # chunked encoding or signal that the connection is being
+            # closed.
             #
             send_close = True
             for (k, v) in  headers:
@@ -141,13 +173,162 @@ class WSGIHandlerMixin:
                     if 'close' == v.lower():
                         self.close_connection = 1
                         send_close = False
+                if 'transfer-encoding' == lk:
+                    # The application is doing its own framing
+                    send_close = False
                 self.send_header(k, v)
-            if send_close:
+            if send_close and self.wsgi_can_chunk(code):
+                self.wsgi_chunked = True
+                self.send_header('Transfer-Encoding', 'chunked')
+            elif send_close:
                 self.close_connection = 1
                 self.send_header('Connection', 'close')
 
             self.end_headers()
-        self.wfile.write(chunk)
+        if self.wsgi_chunked:
+            # An empty chunk would end the response, so skip those
+            if chunk:
+                self.wsgi_buffer(b'%x\r\n' % len(chunk))
+                self.wsgi_buffer(chunk)
+                self.wsgi_buffer(b'\r\n')
+        else:
+            self.wsgi_buffer(chunk)
+
+    def wsgi_write(self, chunk):
+        """
+        The ``write`` callable given to the application; unlike the
+        app iterator, output written this way is sent immediately.
+        """
+        self.wsgi_write_chunk(chunk)
+        self.wsgi_flush()
+
+    def wsgi_buffer(self, data):
+        """
+        Add ``data`` to the pending output, flushing once
+        ``wsgi_output_buffer_size`` bytes have been collected.
+        """
+        if not data:
+            return
+        output = self.wsgi_output
+        if len(data) < 1024:
+            # Small pieces are copied together; larger ones are kept
+            # as they are for the gather write
+            if not output or not isinstance(output[-1], bytearray):
+                output.append(bytearray())
+            output[-1] += data
+        else:
+            output.append(data)
+        self.wsgi_output_size += len(data)
+        if self.wsgi_output_size >= self.wsgi_output_buffer_size:
+            self.wsgi_flush()
+
+    def wsgi_flush(self):
+        """
+        Send all pending output.  This is also available to
+        applications as ``environ['paste.httpserver.flush']``.
+        """
+        output = self.wsgi_output
+        if not output:
+            return
+        self.wsgi_output = []
+        self.wsgi_output_size = 0
+        sendmsg = None
+        if len(output) > 1 and not self.wbufsize:
+            # Writes straight to the socket; a gather write saves
+            # joining the pieces
+            sendmsg = getattr(self.connection, 'sendmsg', None)
+        if sendmsg is not None:
+            _sendmsg_all(sendmsg, output)
+        else:
+            self.wfile.write(b''.join(output))
+
+    def flush_headers(self):
+        """
+        Collect the headers with the rest of the output while a WSGI
+        response is being sent, so they go out with the first chunk of
+        the body.
+        """
+        if getattr(self, 'wsgi_output', None) is None:
+            BaseHTTPRequestHandler.flush_headers(self)
+        else:
+            for data in self._headers_buffer:
+                self.wsgi_buffer(data)
+            self._headers_buffer = []
+
+    def wsgi_write_file(self, wrapper):
+        """
+        Send the body from a `FileWrapper`, using ``sendfile`` when the
+        connection is a plain socket and the file a regular file.
+
+        Returns false if the response has no ``Content-Length``; the
+        wrapper should then just be iterated.
+        """
+        if not self.wsgi_curr_headers:
+            return False
+        length = None
+        for (k, v) in self.wsgi_curr_headers[1]:
+            if k.lower() == 'content-length':
+                try:
+                    length = int(v)
+                except ValueError:
+                    return False
+        if length is None:
+            return False
+        if not self.wsgi_headers_sent:
+            self.wsgi_write_chunk(b'')
+        if self.command == 'HEAD' or not length:
+            return True
+        filelike = wrapper.filelike
+        sendfile = None
+        if not hasattr(self.connection, 'get_context'):
+            # SSL connections have to go through the buffered reads
+            sendfile = getattr(self.connection, 'sendfile', None)
+        if sendfile is not None:
+            try:
+                if not stat.S_ISREG(os.fstat(filelike.fileno()).st_mode):
+                    sendfile = None
+            except (AttributeError, ValueError, OSError):
+                # Not a real file
+                sendfile = None
+        if sendfile is not None:
+            self.wsgi_flush()
+            sent = sendfile(filelike, filelike.tell(), length)
+        else:
+            sent = 0
+            while sent < length:
+                data = filelike.read(min(wrapper.block_size, length - sent))
+                if not data:
+                    break
+                sent += len(data)
+                self.wsgi_write_chunk(data)
+        if sent < length:
+            # The file was shorter than promised
+            self.close_connection = 1
+        return True
+
+    def wsgi_can_chunk(self, code):
+        """
+        Returns true if a response with status ``code`` and no
+        Content-Length can be sent with chunked transfer encoding,
+        keeping the connection open.
+        """
+        if (self.request_version != 'HTTP/1.1'
+            or self.protocol_version != 'HTTP/1.1'):
+            return False
+        if self.command == 'HEAD':
+            return False
+        # These responses never have a body:
+        if code.startswith('1') or code in ('204', '304'):
+            return False
+        return True
+
+    def wsgi_finish_chunks(self):
+        """
+        Ends a chunked response, if one is being sent.
+        """
+        if self.wsgi_chunked:
+            self.wsgi_chunked = False
+            self.wsgi_buffer(b'0\r\n\r\n')
 
     def wsgi_start_response(self, status, response_headers, exc_info=None):
         if exc_info:
@@ -165,7 +346,7 @@ class WSGIHandlerMixin:
         elif self.wsgi_curr_headers:
             assert 0, "Attempt to set headers a second time w/o an exc_info"
         self.wsgi_curr_headers = (status, response_headers)
-        return self.wsgi_write_chunk
+        return self.wsgi_write
 
     def wsgi_setup(self, environ=None):
         """
@@ -208,7 +389,7 @@ class WSGIHandlerMixin:
                ,'wsgi.input': rfile
                ,'wsgi.errors': sys.stderr
                ,'wsgi.multithread': True
-               ,'wsgi.multiprocess': False
+               ,'wsgi.multiprocess': getattr(self.server, 'wsgi_multiprocess', False)
                ,'wsgi.run_once': False
                # CGI variables required by PEP-333
                ,'REQUEST_METHOD': self.command
@@ -253,6 +434,9 @@ class WSGIHandlerMixin:
                 continue
             self.wsgi_environ[key] = ','.join(self.headers.getallmatchingheaders(k))
 
+        self.wsgi_environ['paste.httpserver.flush'] = self.wsgi_flush
+        self.wsgi_environ['wsgi.file_wrapper'] = FileWrapper
+
         if hasattr(self.connection,'get_context'):
             self.wsgi_environ['wsgi.url_scheme'] = 'https'
             # @@: extract other SSL parameters from pyOpenSSL at...
@@ -266,6 +450,9 @@ class WSGIHandlerMixin:
 
         self.wsgi_curr_headers = None
         self.wsgi_headers_sent = False
+        self.wsgi_chunked = False
+        self.wsgi_output = []
+        self.wsgi_output_size = 0
 
     def wsgi_connection_drop(self, exce, environ=None):
         """
@@ -285,26 +472,60 @@ class WSGIHandlerMixin:
             result = self.server.wsgi_application(self.wsgi_environ,
                                                   self.wsgi_start_response)
             try:
-                for chunk in result:
-                    self.wsgi_write_chunk(chunk)
-                if not self.wsgi_headers_sent:
-                    self.wsgi_write_chunk('')
+                if not (isinstance(result, FileWrapper)
+                        and self.wsgi_write_file(result)):
+                    for chunk in result:
+                        self.wsgi_write_chunk(chunk)
+                    if not self.wsgi_headers_sent:
+                        self.wsgi_write_chunk(b'')
+                self.wsgi_finish_chunks()
+                self.wsgi_flush()
             finally:
                 if hasattr(result,'close'):
                     result.close()
                 result = None
         except socket.error as exce:
+            self.wsgi_output = None
             self.wsgi_connection_drop(exce, environ)
             return
         except:
-            if not self.wsgi_headers_sent:
-                error_msg = "Internal Server Error\n"
-                self.wsgi_curr_headers = (
-                    '500 Internal Server Error',
-                    [('Content-type', 'text/plain'),
-                     ('Content-length', str(len(error_msg)))])
-                self.wsgi_write_chunk("Internal Server Error\n")
+            try:
+                if not self.wsgi_headers_sent:
+                    error_msg = "Internal Server Error\n"
+                    self.wsgi_curr_headers = (
+                        '500 Internal Server Error',
+                        [('Content-type', 'text/plain'),
+                         ('Content-length', str(len(error_msg)))])
+                    self.wsgi_write_chunk(error_msg.encode('ascii'))
+                else:
+                    # The response has been cut short; the client can
+                    # only tell if the connection is closed (without
+                    # finishing any chunked response).
+                    self.close_connection = 1
+                self.wsgi_flush()
+            finally:
+                self.wsgi_output = None
             raise
+        self.wsgi_output = None
+
+def _sendmsg_all(sendmsg, buffers):
+    """
+    Like ``socket.sendall``, but for a list of buffers written with
+    ``sendmsg``.
+    """
+    # Stay well under IOV_MAX
+    batch = 512
+    buffers = [memoryview(data) for data in buffers]
+    while buffers:
+        sent = sendmsg(buffers[:batch])
+        while sent:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+        while buffers and not len(buffers[0]):
+            buffers.pop(0)
 
 #
 # SSL Functionality
@@ -438,7 +659,14 @@ class WSGIHandler(WSGIHandlerMixin, BaseHTTPRequestHandler):
     def handle(self):
         # don't bother logging disconnects while handling a request
         try:
-            BaseHTTPRequestHandler.handle(self)
+            if getattr(self.server, 'wsgi_handle_keepalive', True):
+                BaseHTTPRequestHandler.handle(self)
+            else:
+                # The server idles the connection between requests
+                # itself (see WSGIEventLoopServer), so only one request
+                # is handled per call.
+                self.close_connection = 1
+                self.handle_one_request()
         except SocketErrors as exce:
             self.wsgi_connection_drop(exce)
 
@@ -552,6 +780,21 @@ class ThreadPool(object):
 
     Each worker thread only processes ``max_requests`` tasks before it
     dies and replaces itself with a new worker thread.
+
+    If ``min_workers`` or ``max_workers`` is given, the pool scales
+    itself between those limits.  When a task is added and more tasks
+    are waiting than there are idle workers, workers are added if
+    ``scale_queue_depth`` tasks are waiting, or if the last task waited
+    longer than ``scale_wait_time`` seconds in the queue.  Workers
+    above ``min_workers`` that have been idle for ``scale_idle_time``
+    seconds (and no sooner than that since the pool last grew) exit.
+    The most recent decisions are listed under the ``scaling`` key of
+    track_threads.
+
+    Tasks can be added with a ``reject`` callable, which is run
+    instead of the task if ``max_queue`` tasks are already waiting, or
+    if the task waited more than ``max_queue_wait`` seconds before a
+    worker got to it.  Tasks without ``reject`` are always run.
     """
 
 
@@ -568,6 +811,13 @@ class ThreadPool(object):
         hung_check_period=100, # every 100 requests check for hung workers
         logger=None, # Place to log messages to
         error_email=None, # Person(s) to notify if serious problem occurs
+        min_workers=None, # autoscaling: never shrink below this
+        max_workers=None, # autoscaling: never grow above this
+        scale_queue_depth=2, # grow when this many tasks are waiting
+        scale_wait_time=0.5, # grow when tasks wait this long (seconds)
+        scale_idle_time=60, # shrink idle workers after this many seconds
+        max_queue=0, # reject tasks when this many are waiting (0: no limit)
+        max_queue_wait=0, # reject tasks that waited this long (0: no limit)
         ):
         """
         Create thread pool with `nworkers` worker threads.
@@ -614,15 +864,50 @@ class ThreadPool(object):
         # we shouldn't cull extra workers until some time has passed
         # (hung_thread_limit) since workers were added:
         self._last_added_new_idle_workers = 0
+        if min_workers is None:
+            min_workers = nworkers
+        if max_workers is None:
+            max_workers = nworkers
+        assert min_workers <= nworkers <= max_workers, (
+            "nworkers (%s) should be between min_workers (%s) and "
+            "max_workers (%s)" % (nworkers, min_workers, max_workers))
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.autoscale = min_workers != max_workers
+        self.scale_queue_depth = scale_queue_depth
+        self.scale_wait_time = scale_wait_time
+        self.scale_idle_time = scale_idle_time
+        # How long the most recently started task waited in the queue:
+        self.last_queue_wait = 0
+        # Workers that have been started but haven't registered yet:
+        self._starting_workers = 0
+        self._last_scaled_up = 0
+        self._scale_lock = threading.Lock()
+        self.scaling_events = collections.deque(maxlen=20)
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.rejected_tasks = 0
         if not daemon:
             atexit.register(self.shutdown)
         for i in range(self.nworkers):
             self.add_worker_thread(message='Initial worker pool')
 
-    def add_task(self, task):
+    def add_task(self, task, reject=None):
         """
         Add a task to the queue
+
+        ``reject`` is called instead of the task if the queue is full
+        (and, when autoscaling, the pool is already at
+        ``max_workers``), or if the task can't be started within
+        ``max_queue_wait`` seconds.
         """
+        if (reject is not None and self.max_queue
+            and self.queue.qsize() >= self.max_queue):
+            # With autoscaling, add workers before turning tasks away
+            if not self.autoscale or not self.scale_up(queue_full=True):
+                self.reject_task(
+                    reject, '%i tasks already queued' % self.queue.qsize())
+                return
         self.logger.debug('Added task (%i tasks queued)', self.queue.qsize())
         if self.hung_check_period:
             self.requests_since_last_hung_check += 1
@@ -654,7 +939,9 @@ class ThreadPool(object):
                 self.logger.debug(
                     'No extra workers needed (%s busy workers)',
                     busy)
-        if (len(self.workers) > self.nworkers
+        if self.autoscale:
+            self.scale_up()
+        elif (len(self.workers) > self.nworkers
             and len(self.idle_workers) > 3
             and time.time()-self._last_added_new_idle_workers > self.hung_thread_limit):
             # We've spawned worers in the past, but they aren't needed
@@ -666,14 +953,98 @@ class ThreadPool(object):
                 'Idle workers: %s', self.idle_workers)
             for i in range(len(self.workers) - self.nworkers):
                 self.queue.put(self.SHUTDOWN)
-        self.queue.put(task)
+        self.queue.put((time.time(), task, reject))
+
+    def reject_task(self, reject, reason):
+        """
+        Run the ``reject`` callable of a task that won't be run.
+        """
+        self.rejected_tasks += 1
+        self.logger.info('Rejected task (%s; %i rejected so far)',
+                         reason, self.rejected_tasks)
+        try:
+            reject()
+        except:
+            print('Unexpected exception rejecting task %r' % reject,
+                  file=sys.stderr)
+            traceback.print_exc()
+
+    def scale_up(self, queue_full=False):
+        """
+        Add workers if tasks are queueing up (and we are below
+        ``max_workers``); ``queue_full`` adds one whether or not the
+        thresholds are reached.  Returns the number of workers added.
+        """
+        # Waiting tasks that idle workers are about to pick up don't
+        # count
+        depth = self.queue.qsize() - len(self.idle_workers)
+        if queue_full:
+            depth = max(depth, 1)
+            reason = 'queue full (%s tasks queued)' % self.queue.qsize()
+        elif depth <= 0:
+            return 0
+        elif depth >= self.scale_queue_depth:
+            reason = '%s tasks queued' % depth
+        elif self.last_queue_wait >= self.scale_wait_time:
+            reason = 'last task waited %.2fsec' % self.last_queue_wait
+        else:
+            return 0
+        self._scale_lock.acquire()
+        try:
+            current = len(self.workers) + self._starting_workers
+            add = min(depth, self.max_workers - current)
+            if add <= 0:
+                return 0
+            self._last_scaled_up = self._last_added_new_idle_workers = time.time()
+            self.last_queue_wait = 0
+            self.record_scaling('grow', current + add, reason)
+        finally:
+            self._scale_lock.release()
+        for i in range(add):
+            self.add_worker_thread(message='Autoscaling (%s)' % reason)
+        return add
+
+    def scale_down(self, thread_obj):
+        """
+        Called by an idle worker; returns true (and removes the
+        worker from the pool) if it should exit.
+        """
+        self._scale_lock.acquire()
+        try:
+            now = time.time()
+            if len(self.workers) <= self.min_workers:
+                return False
+            if now - self._last_scaled_up < self.scale_idle_time:
+                # Cool-down after growing
+                return False
+            try:
+                self.workers.remove(thread_obj)
+            except ValueError:
+                pass
+            self.record_scaling(
+                'shrink', len(self.workers) + self._starting_workers,
+                'worker idle for %ssec' % self.scale_idle_time)
+            return True
+        finally:
+            self._scale_lock.release()
+
+    def record_scaling(self, action, workers, reason):
+        """
+        Log an autoscaling decision and keep it for track_threads.
+        """
+        self.logger.info('Autoscaling: %s to %s workers (%s)',
+                         action, workers, reason)
+        self.scaling_events.append(dict(
+            time=time.time(), action=action, workers=workers,
+            reason=reason))
 
     def track_threads(self):
         """
         Return a dict summarizing the threads in the pool (as
         described in the ThreadPool docstring).
         """
-        result = dict(idle=[], busy=[], hung=[], dying=[], zombie=[])
+        result = dict(idle=[], busy=[], hung=[], dying=[], zombie=[],
+                      scaling=list(self.scaling_events))
         now = time.time()
         for worker in self.workers:
             if not hasattr(worker, 'thread_id'):
@@ -734,6 +1105,11 @@ class ThreadPool(object):
         return thread_id in threading._active
 
     def add_worker_thread(self, *args, **kwargs):
+        self._scale_lock.acquire()
+        try:
+            self._starting_workers += 1
+        finally:
+            self._scale_lock.release()
         index = next(self._worker_count)
         worker = threading.Thread(target=self.worker_thread_callback,
                                   args=args, kwargs=kwargs,
@@ -849,7 +1225,12 @@ class ThreadPool(object):
         """
         thread_obj = threading.currentThread()
         thread_id = thread_obj.thread_id = _thread.get_ident()
-        self.workers.append(thread_obj)
+        self._scale_lock.acquire()
+        try:
+            self._starting_workers -= 1
+            self.workers.append(thread_obj)
+        finally:
+            self._scale_lock.release()
         self.idle_workers.append(thread_id)
         requests_processed = 0
         add_replacement_worker = False
@@ -862,10 +1243,26 @@ class ThreadPool(object):
                                       % (thread_id, requests_processed, self.max_requests))
                     add_replacement_worker = True
                     break
-                runnable = self.queue.get()
+                if self.autoscale:
+                    try:
+                        runnable = self.queue.get(
+                            timeout=self.scale_idle_time)
+                    except queue.Empty:
+                        if self.scale_down(thread_obj):
+                            break
+                        continue
+                else:
+                    runnable = self.queue.get()
                 if runnable is ThreadPool.SHUTDOWN:
                     self.logger.debug('Worker %s asked to SHUTDOWN', thread_id)
                     break
+                time_queued, runnable, reject = runnable
+                self.last_queue_wait = time.time() - time_queued
+                if (reject is not None and self.max_queue_wait
+                    and self.last_queue_wait > self.max_queue_wait):
+                    self.reject_task(
+                        reject, 'waited %.2fsec' % self.last_queue_wait)
+                    continue
                 try:
                     self.idle_workers.remove(thread_id)
                 except ValueError:
@@ -912,6 +1309,18 @@ class ThreadPool(object):
             if add_replacement_worker:
                 self.add_worker_thread(message='Voluntary replacement for thread %s' % thread_id)
 
+    def drain(self, timeout):
+        """
+        Wait (up to ``timeout`` seconds) until no tasks are queued or
+        being worked on.  Returns true if the pool is idle.
+        """
+        end = time.time() + timeout
+        while self.queue.qsize() or self.worker_tracker:
+            if time.time() >= end:
+                return False
+            time.sleep(0.1)
+        return True
+
     def shutdown(self, force_quit_timeout=0):
         """
         Shutdown the queue (after finishing any pending requests).
@@ -924,7 +1333,7 @@ class ThreadPool(object):
         hung_workers = []
         for worker in self.workers:
             worker.join(0.5)
-            if worker.isAlive():
+            if worker.is_alive():
                 hung_workers.append(worker)
         zombies = []
         for thread_id in self.dying_threads:
@@ -942,10 +1351,10 @@ class ThreadPool(object):
                 timed_out = False
                 need_force_quit = bool(zombies)
                 for workers in self.workers:
-                    if not timed_out and worker.isAlive():
+                    if not timed_out and worker.is_alive():
                         timed_out = True
                         worker.join(force_quit_timeout)
-                    if worker.isAlive():
+                    if worker.is_alive():
                         print("Worker %s won't die" % worker)
                         need_force_quit = True
                 if need_force_quit:
@@ -1024,7 +1433,17 @@ class ThreadPool(object):
 class ThreadPoolMixIn(object):
     """
     Mix-in class to process requests from a thread pool
+
+    When the thread pool rejects a request (see ``max_queue`` and
+    ``max_queue_wait`` in ThreadPool) the server answers it directly
+    with ``503 Service Unavailable``, asking the client to come back in
+    ``retry_after`` seconds.
     """
+
+    retry_after = 5
+    # Seconds to let queued and running requests finish when the server
+    # loop stops, before the pool is shut down:
+    drain_timeout = 0
     def __init__(self, nworkers, daemon=False, **threadpool_options):
         # Create and start the workers
         self.running = True
@@ -1047,7 +1466,40 @@ class ThreadPoolMixIn(object):
         request.setblocking(1)
         # Queue processing of the request
         self.thread_pool.add_task(
-             lambda: self.process_request_in_thread(request, client_address))
+             lambda: self.process_request_in_thread(request, client_address),
+             lambda: self.reject_request(request, client_address))
+
+    def reject_request(self, request, client_address):
+        """
+        Answer the request with a 503 (without involving the
+        application) and close the connection.
+        """
+        body = (b'Service Unavailable\n'
+                b'The server is overloaded; please try again later.\n')
+        response = (
+            'HTTP/1.0 503 Service Unavailable\r\n'
+            'Retry-After: %s\r\n'
+            'Content-Type: text/plain\r\n'
+            'Content-Length: %s\r\n'
+            'Connection: close\r\n\r\n'
+            % (self.retry_after, len(body))).encode('ascii') + body
+        try:
+            # This is called from the thread accepting connections, so
+            # nothing here may block: the response fits in the send
+            # buffer of a new connection, and a client that won't take
+            # it just doesn't get it.
+            request.setblocking(0)
+            # Read what the client has sent so far, so closing the
+            # socket doesn't reset the connection before it reads our
+            # response
+            try:
+                request.recv(65536)
+            except socket.error:
+                pass
+            request.send(response)
+        except SocketErrors:
+            pass
+        self.shutdown_request(request)
 
     def handle_error(self, request, client_address):
         exc_class, exc, tb = sys.exc_info()
@@ -1085,6 +1537,8 @@ class ThreadPoolMixIn(object):
                     # propogate, just keep handling
                     pass
         finally:
+            if self.drain_timeout:
+                self.thread_pool.drain(self.drain_timeout)
             self.thread_pool.shutdown()
 
     def server_activate(self):
@@ -1105,12 +1559,27 @@ class ThreadPoolMixIn(object):
 class WSGIServerBase(SecureHTTPServer):
     def __init__(self, wsgi_application, server_address,
                  RequestHandlerClass=None, ssl_context=None,
-                 request_queue_size=None):
+                 request_queue_size=None, listen_socket=None):
+        # An already bound socket (see PreforkServer) is used instead
+        # of binding server_address:
+        self.listen_socket = listen_socket
         SecureHTTPServer.__init__(self, server_address,
                                   RequestHandlerClass, ssl_context,
                                   request_queue_size=request_queue_size)
         self.wsgi_application = wsgi_application
         self.wsgi_socket_timeout = None
+        self.wsgi_multiprocess = False
+
+    def server_bind(self):
+        if self.listen_socket is None:
+            SecureHTTPServer.server_bind(self)
+            return
+        self.socket.close()
+        self.socket = self.listen_socket
+        self.server_address = self.socket.getsockname()
+        host, port = self.server_address[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
 
     def get_request(self):
         # If there is a socket_timeout, set it on the accepted
@@ -1126,15 +1595,514 @@ class WSGIThreadPoolServer(ThreadPoolMixIn, WSGIServerBase):
     def __init__(self, wsgi_application, server_address,
                  RequestHandlerClass=None, ssl_context=None,
                  nworkers=10, daemon_threads=False,
-                 threadpool_options=None, request_queue_size=None):
+                 threadpool_options=None, request_queue_size=None,
+                 listen_socket=None):
         WSGIServerBase.__init__(self, wsgi_application, server_address,
                                 RequestHandlerClass, ssl_context,
-                                request_queue_size=request_queue_size)
+                                request_queue_size=request_queue_size,
+                                listen_socket=listen_socket)
         if threadpool_options is None:
             threadpool_options = {}
         ThreadPoolMixIn.__init__(self, nworkers, daemon_threads,
                                  **threadpool_options)
 
+class _SocketReader(object):
+    """
+    A minimal file-like reader over a socket with its own buffer.
+
+    Unlike ``socket.makefile()``, anything read past the end of a
+    request stays in ``buffer`` where the event loop can see it, so
+    pipelined requests are not lost between the loop and the worker
+    threads.
+    """
+
+    recv_size = 65536
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.closed = False
+
+    def _fill(self):
+        data = self.sock.recv(self.recv_size)
+        if not data:
+            return False
+        self.buffer += data
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            size = len(self.buffer)
+        else:
+            while len(self.buffer) < size and self._fill():
+                pass
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        if size is None:
+            size = -1
+        start = 0
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end != -1:
+                end += 1
+                break
+            if 0 <= size <= len(self.buffer):
+                end = size
+                break
+            start = len(self.buffer)
+            if not self._fill():
+                end = len(self.buffer)
+                break
+        if size >= 0:
+            end = min(end, size)
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    def readlines(self, hint=None):
+        lines = []
+        total = 0
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            total += len(line)
+            if hint and total >= hint:
+                break
+        return lines
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def close(self):
+        # The socket belongs to the connection, not to this reader
+        self.closed = True
+
+class _EventLoopConnection(object):
+    """
+    A client connection owned by a `WSGIEventLoopServer`.
+
+    This is passed to the request handler in place of the socket (in
+    the manner of ``_ConnFixer``); ``makefile`` hands out the shared
+    reader so buffered input survives from one request to the next.
+    """
+
+    def __init__(self, sock, client_address):
+        self.sock = sock
+        self.client_address = client_address
+        self.reader = _SocketReader(sock)
+        self.last_active = time.time()
+        self.requests = 0
+
+    def makefile(self, mode='r', bufsize=-1):
+        if 'r' in mode:
+            return self.reader
+        return self.sock.makefile(mode, bufsize)
+
+    def headers_complete(self):
+        buf = self.reader.buffer
+        return buf.find(b'\r\n\r\n') != -1 or buf.find(b'\n\n') != -1
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def __getattr__(self, attrib):
+        return getattr(self.sock, attrib)
+
+class WSGIEventLoopServer(ThreadPoolMixIn, WSGIServerBase):
+    """
+    A server that waits for requests on a ``selectors`` event loop.
+
+    Accepting connections, reading request headers and idling between
+    keep-alive requests all happen in the loop thread; a connection
+    is only handed to the thread pool once a complete request head has
+    arrived, and is given back to the loop when the response is done.
+    Idle connections therefore cost a file descriptor rather than a
+    thread.  This is most useful with ``protocol_version='HTTP/1.1'``,
+    since HTTP/1.0 connections are closed after each request anyway.
+
+    Connections that stay idle longer than ``keepalive_timeout``
+    seconds are closed.  SSL is not supported in this mode.
+    """
+
+    wsgi_handle_keepalive = False
+    # Request heads longer than this are handed to the handler as-is
+    # (which will then answer with an error):
+    max_header_size = 65536
+
+    def __init__(self, wsgi_application, server_address,
+                 RequestHandlerClass=None, ssl_context=None,
+                 nworkers=10, daemon_threads=False,
+                 threadpool_options=None, request_queue_size=None,
+                 keepalive_timeout=60, listen_socket=None):
+        assert not ssl_context, (
+            "WSGIEventLoopServer does not support SSL")
+        WSGIServerBase.__init__(self, wsgi_application, server_address,
+                                RequestHandlerClass, None,
+                                request_queue_size=request_queue_size,
+                                listen_socket=listen_socket)
+        if threadpool_options is None:
+            threadpool_options = {}
+        ThreadPoolMixIn.__init__(self, nworkers, daemon_threads,
+                                 **threadpool_options)
+        self.keepalive_timeout = keepalive_timeout
+        self.selector = selectors.DefaultSelector()
+        self.connections = {}
+        # Connections handed back by worker threads; the loop is woken
+        # up through _wakeup_w so it picks them up immediately.
+        self._resumed = collections.deque()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(0)
+        self._wakeup_w.setblocking(0)
+
+    def server_activate(self):
+        """
+        Overrides server_activate to make the listener non-blocking.
+        """
+        self.socket.setblocking(0)
+
+    def serve_forever(self):
+        """
+        Run the event loop until `server_close` is called.
+        """
+        self.selector.register(self.socket, selectors.EVENT_READ,
+                               self._accept)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ,
+                               self._wakeup)
+        last_sweep = time.time()
+        try:
+            while self.running:
+                # The timeout gives interrupts a chance to propagate
+                self._select(1)
+                now = time.time()
+                if now - last_sweep >= 1:
+                    last_sweep = now
+                    self._close_idle(now)
+            self.selector.unregister(self.socket)
+            if self.drain_timeout:
+                self._drain_connections(self.drain_timeout)
+        finally:
+            for conn in list(self.connections.values()):
+                self._close(conn)
+            self.selector.close()
+            if self.drain_timeout:
+                self.thread_pool.drain(self.drain_timeout)
+            self.thread_pool.shutdown()
+
+    def _select(self, timeout):
+        for key, mask in self.selector.select(timeout):
+            key.data(key.fileobj)
+
+    def _drain_connections(self, timeout):
+        """
+        Once the loop has stopped, wait for the first request on
+        connections that have been accepted but haven't sent one yet;
+        idle keep-alive connections are just closed.
+        """
+        end = time.time() + timeout
+        while time.time() < end:
+            for conn in list(self.connections.values()):
+                if conn.requests:
+                    self._close(conn)
+            if not self.connections:
+                break
+            self._select(0.1)
+
+    def _accept(self, listener):
+        while True:
+            try:
+                sock, client_address = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except socket.error:
+                # e.g., too many open files; try again on the next loop
+                return
+            sock.setblocking(0)
+            conn = _EventLoopConnection(sock, client_address)
+            self._watch(conn)
+
+    def _wakeup(self, wakeup_r):
+        try:
+            while wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._resumed:
+            conn = self._resumed.popleft()
+            if conn.headers_complete():
+                # A pipelined request is already waiting
+                self._dispatch(conn)
+            else:
+                self._watch(conn)
+
+    def _watch(self, conn):
+        conn.last_active = time.time()
+        self.connections[conn.fileno()] = conn
+        self.selector.register(conn.sock, selectors.EVENT_READ,
+                               self._readable)
+
+    def _readable(self, sock):
+        conn = self.connections[sock.fileno()]
+        try:
+            data = sock.recv(conn.reader.recv_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except socket.error:
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        conn.reader.buffer += data
+        conn.last_active = time.time()
+        if (conn.headers_complete()
+            or len(conn.reader.buffer) > self.max_header_size):
+            self.selector.unregister(sock)
+            del self.connections[sock.fileno()]
+            self._dispatch(conn)
+
+    def _dispatch(self, conn):
+        self.thread_pool.add_task(
+            lambda: self.process_connection_in_thread(conn),
+            lambda: self.reject_request(conn.sock, conn.client_address))
+
+    def _close_idle(self, now):
+        if not self.keepalive_timeout:
+            return
+        for conn in list(self.connections.values()):
+            if now - conn.last_active > self.keepalive_timeout:
+                self._close(conn)
+
+    def _close(self, conn):
+        fileno = conn.fileno()
+        if self.connections.get(fileno) is conn:
+            del self.connections[fileno]
+            try:
+                self.selector.unregister(conn.sock)
+            except (KeyError, ValueError):
+                pass
+        self.shutdown_request(conn.sock)
+
+    def process_connection_in_thread(self, conn):
+        """
+        Handle one request from ``conn`` in a worker thread, then give
+        the connection back to the event loop (or close it).
+        """
+        close = True
+        conn.requests += 1
+        try:
+            conn.sock.settimeout(self.wsgi_socket_timeout)
+            handler = self.RequestHandlerClass(
+                conn, conn.client_address, self)
+            close = handler.close_connection or not self.running
+        except:
+            self.handle_error(conn, conn.client_address)
+            exc = sys.exc_info()[1]
+            if isinstance(exc, (MemoryError, KeyboardInterrupt)):
+                self.shutdown_request(conn.sock)
+                raise
+        if close:
+            self.shutdown_request(conn.sock)
+            return
+        conn.sock.setblocking(0)
+        self._resumed.append(conn)
+        try:
+            self._wakeup_w.send(b'x')
+        except (BlockingIOError, InterruptedError):
+            # The loop already has a wakeup pending
+            pass
+
+    def server_close(self):
+        """
+        Stop the event loop, finish pending requests and shutdown the
+        server.
+        """
+        ThreadPoolMixIn.server_close(self)
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+def _stop_server(server):
+    """
+    Ask ``server.serve_forever()`` to return; safe to call from a
+    signal handler or from any thread.
+    """
+    if hasattr(server, 'running'):
+        server.running = False
+    else:
+        # socketserver's shutdown() waits for the loop to finish, so it
+        # can't be called from the thread running the loop
+        threading.Thread(target=server.shutdown).start()
+
+class PreforkServer(object):
+    """
+    Runs servers in several forked worker processes, all accepting
+    connections from one listening socket.
+
+    ``make_server`` is called in each worker process with the
+    listening socket, and returns the server to run (so thread pools
+    are only created after the fork).  The supervisor restarts workers
+    that die, and workers exit (and are replaced) after handling
+    ``max_requests`` requests (plus up to 10% more, chosen at random,
+    so the workers don't all restart at once).  On SIGTERM or SIGINT
+    the supervisor stops accepting, and gives each worker
+    ``shutdown_timeout`` seconds to finish the requests it has already
+    accepted before killing it.
+    """
+
+    def __init__(self, make_server, listen_socket, processes,
+                 max_requests=0, shutdown_timeout=60, logger=None):
+        assert processes > 0, "PreforkServer needs at least one process"
+        self.make_server = make_server
+        self.socket = listen_socket
+        self.server_address = listen_socket.getsockname()
+        self.processes = processes
+        self.max_requests = max_requests
+        self.shutdown_timeout = shutdown_timeout
+        if logger is None:
+            logger = logging.getLogger('paste.httpserver.PreforkServer')
+        if isinstance(logger, str):
+            logger = logging.getLogger(logger)
+        self.logger = logger
+        self.running = False
+        # pid: time started
+        self.children = {}
+
+    def serve_forever(self):
+        """
+        Start the worker processes and supervise them until stopped.
+        """
+        self.running = True
+        old_handlers = {}
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            old_handlers[signum] = signal.signal(signum, self.handle_signal)
+        try:
+            while self.running:
+                while len(self.children) < self.processes:
+                    self.spawn_worker()
+                self.reap_workers()
+                time.sleep(0.1)
+        finally:
+            for signum, handler in old_handlers.items():
+                signal.signal(signum, handler)
+            self.stop_workers()
+
+    def handle_signal(self, signum, frame):
+        self.logger.info('Received signal %s; stopping workers', signum)
+        self.running = False
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            self.logger.info('Started worker process %s', pid)
+            return
+        # In the worker process
+        status = 1
+        try:
+            self.run_worker()
+            status = 0
+        except:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def run_worker(self):
+        """
+        Create and run one server in this (worker) process.
+        """
+        server = self.make_server(self.socket)
+        server.wsgi_multiprocess = True
+        server.drain_timeout = self.shutdown_timeout
+        def stop(signum, frame):
+            _stop_server(server)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        if self.max_requests:
+            app = server.wsgi_application
+            requests = count(1)
+            max_requests = self.max_requests + random.randint(
+                0, self.max_requests // 10)
+            def counting_app(environ, start_response):
+                if next(requests) == max_requests:
+                    # Finish this request (and any queued ones), then
+                    # exit so the supervisor starts a fresh worker
+                    _stop_server(server)
+                return app(environ, start_response)
+            server.wsgi_application = counting_app
+        server.serve_forever()
+        server.server_close()
+
+    def reap_workers(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if not pid:
+                return
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            self.logger.info('Worker process %s exited (status %s)',
+                             pid, status)
+            if self.running and status and time.time() - started < 1:
+                # Don't restart a worker that fails on startup in a
+                # tight loop
+                time.sleep(1)
+
+    def stop_workers(self):
+        """
+        Stop all workers, waiting up to ``shutdown_timeout`` seconds
+        for them to finish.
+        """
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        end = time.time() + self.shutdown_timeout + 1
+        while self.children and time.time() < end:
+            self.reap_workers()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            self.logger.info("Worker process %s didn't stop; killing it",
+                             pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+            del self.children[pid]
+
+    def server_close(self):
+        self.running = False
+        self.socket.close()
+
+def _make_listen_socket(server_address, request_queue_size=None,
+                        reuse_port=False):
+    # The address family comes from the host, so IPv6 hosts like '::'
+    # can be served; an empty host means all IPv4 interfaces, as before
+    host, port = server_address[:2]
+    family, type, proto, canonname, sockaddr = socket.getaddrinfo(
+        host or None, port, 0, socket.SOCK_STREAM, 0, socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        assert hasattr(socket, 'SO_REUSEPORT'), (
+            "SO_REUSEPORT is not available on this platform")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(sockaddr)
+    sock.listen(request_queue_size or 5)
+    return sock
+
 class ServerExit(SystemExit):
     """
     Raised to tell the server to really exit (SystemExit is normally
@@ -1145,7 +2113,10 @@ def serve(application, host=None, port=None, handler=None, ssl_pem=None,
           ssl_context=None, server_version=None, protocol_version=None,
           start_loop=True, daemon_threads=None, socket_timeout=None,
           use_threadpool=None, threadpool_workers=10,
-          threadpool_options=None, request_queue_size=5):
+          threadpool_options=None, request_queue_size=5,
+          use_event_loop=False, keepalive_timeout=60,
+          output_buffer_size=None, retry_after=None, processes=1,
+          reuse_port=False, process_max_requests=0, shutdown_timeout=60):
     """
     Serves your ``application`` over HTTP(S) via WSGI interface
 
@@ -1197,12 +2168,11 @@ def serve(application, host=None, port=None, handler=None, ssl_pem=None,
         This sets the protocol used by the server, by default
         ``HTTP/1.0``. There is some support for ``HTTP/1.1``, which
         defaults to nicer keep-alive connections.  This server supports
-        ``100 Continue``, but does not yet support HTTP/1.1 Chunked
-        Encoding. Hence, if you use HTTP/1.1, you're somewhat in error
-        since chunked coding is a mandatory requirement of a HTTP/1.1
-        server.  If you specify HTTP/1.1, every response *must* have a
-        ``Content-Length`` and you must be careful not to read past the
-        end of the socket.
+        ``100 Continue``, and with ``HTTP/1.1`` responses without a
+        ``Content-Length`` are sent to HTTP/1.1 clients with chunked
+        transfer encoding, so the connection can be kept open.  Chunked
+        request bodies are not supported, so you must be careful not
+        to read past the end of the socket.
 
     ``start_loop``
 
@@ -1247,6 +2217,64 @@ def serve(application, host=None, port=None, handler=None, ssl_pem=None,
         The 'backlog' argument to socket.listen(); specifies the
         maximum number of queued connections.
 
+    ``use_event_loop``
+
+        Wait for requests on a ``selectors`` event loop, and only hand
+        connections to the thread pool (``threadpool_workers`` and
+        ``threadpool_options`` apply) once a request has arrived.
+        Keep-alive connections then don't tie up a thread while they
+        are idle.  Use this with ``protocol_version='HTTP/1.1'``.  SSL
+        is not supported in this mode.
+
+    ``keepalive_timeout``
+
+        With ``use_event_loop``, the number of seconds an idle
+        keep-alive connection is kept open.  Defaults to 60.
+
+    ``output_buffer_size``
+
+        Response headers and body chunks are collected until this many
+        bytes are pending, and then sent with a single write.  Output
+        from the ``write`` callable is always sent immediately, and
+        streaming applications can call
+        ``environ['paste.httpserver.flush']()`` to send what they have
+        so far.  Use 0 to send every chunk as soon as it is produced.
+        Defaults to 8192.
+
+    ``retry_after``
+
+        When the thread pool is overloaded (see the
+        ``threadpool_max_queue`` and ``threadpool_max_queue_wait``
+        options) requests are answered with ``503 Service
+        Unavailable``, asking clients to retry after this many
+        seconds.  Defaults to 5.
+
+    ``processes``
+
+        Fork this many worker processes, each running its own server
+        (and thread pool) on the same listening socket, so that a
+        CPU-bound application can use more than one core.  A
+        supervisor process restarts workers that die.  Defaults to 1,
+        which serves from the current process.  SSL is not supported
+        with more than one process.
+
+    ``reuse_port``
+
+        Set ``SO_REUSEPORT`` on the listening socket (with
+        ``processes``), so other servers can bind the same port, e.g.,
+        while restarting.
+
+    ``process_max_requests``
+
+        With ``processes``, replace each worker process after it has
+        handled this many requests.  Defaults to 0 (never).
+
+    ``shutdown_timeout``
+
+        With ``processes``, the number of seconds worker processes are
+        given to finish the requests they have accepted after the
+        supervisor gets SIGTERM.  Defaults to 60.
+
     """
     is_ssl = False
     if ssl_pem or ssl_context:
@@ -1277,24 +2305,52 @@ def serve(application, host=None, port=None, handler=None, ssl_pem=None,
     if protocol_version:
         assert protocol_version in ('HTTP/0.9', 'HTTP/1.0', 'HTTP/1.1')
         handler.protocol_version = protocol_version
+    if output_buffer_size is not None:
+        handler.wsgi_output_buffer_size = int(output_buffer_size)
 
     if use_threadpool is None:
         use_threadpool = True
 
-    if converters.asbool(use_threadpool):
-        server = WSGIThreadPoolServer(application, server_address, handler,
-                                      ssl_context, int(threadpool_workers),
-                                      daemon_threads,
-                                      threadpool_options=threadpool_options,
-                                      request_queue_size=request_queue_size)
+    def make_server(listen_socket=None):
+        if converters.asbool(use_event_loop):
+            server = WSGIEventLoopServer(
+                application, server_address, handler, ssl_context,
+                int(threadpool_workers), daemon_threads,
+                threadpool_options=threadpool_options,
+                request_queue_size=request_queue_size,
+                keepalive_timeout=int(keepalive_timeout),
+                listen_socket=listen_socket)
+        elif converters.asbool(use_threadpool):
+            server = WSGIThreadPoolServer(
+                application, server_address, handler, ssl_context,
+                int(threadpool_workers), daemon_threads,
+                threadpool_options=threadpool_options,
+                request_queue_size=request_queue_size,
+                listen_socket=listen_socket)
+        else:
+            server = WSGIServer(application, server_address, handler,
+                                ssl_context,
+                                request_queue_size=request_queue_size,
+                                listen_socket=listen_socket)
+            if daemon_threads:
+                server.daemon_threads = daemon_threads
+
+        if socket_timeout:
+            server.wsgi_socket_timeout = int(socket_timeout)
+        if retry_after is not None and hasattr(server, 'thread_pool'):
+            server.retry_after = int(retry_after)
+        return server
+
+    if int(processes) > 1:
+        assert not is_ssl, "SSL is not supported with several processes"
+        server = PreforkServer(
+            make_server,
+            _make_listen_socket(server_address, request_queue_size,
+                                converters.asbool(reuse_port)),
+            int(processes), max_requests=int(process_max_requests),
+            shutdown_timeout=int(shutdown_timeout))
     else:
-        server = WSGIServer(application, server_address, handler, ssl_context,
-                            request_queue_size=request_queue_size)
-        if daemon_threads:
-            server.daemon_threads = daemon_threads
-
-    if socket_timeout:
-        server.wsgi_socket_timeout = int(socket_timeout)
+        server = make_server()
 
     if converters.asbool(start_loop):
         protocol = is_ssl and 'https' or 'http'
@@ -1322,10 +2378,21 @@ def server_runner(wsgi_app, global_conf, **kwargs):
                  'threadpool_dying_limit', 'threadpool_spawn_if_under',
                  'threadpool_max_zombie_threads_before_die',
                  'threadpool_hung_check_period',
-                 'threadpool_max_requests', 'request_queue_size']:
+                 'threadpool_max_requests', 'request_queue_size',
+                 'keepalive_timeout', 'output_buffer_size',
+                 'threadpool_min_workers', 'threadpool_max_workers',
+                 'threadpool_scale_queue_depth',
+                 'threadpool_scale_idle_time', 'threadpool_max_queue',
+                 'retry_after', 'processes', 'process_max_requests',
+                 'shutdown_timeout']:
         if name in kwargs:
             kwargs[name] = int(kwargs[name])
-    for name in ['use_threadpool', 'daemon_threads']:
+    for name in ['threadpool_scale_wait_time',
+                 'threadpool_max_queue_wait']:
+        if name in kwargs:
+            kwargs[name] = float(kwargs[name])
+    for name in ['use_threadpool', 'daemon_threads', 'use_event_loop',
+                 'reuse_port']:
         if name in kwargs:
             kwargs[name] = asbool(kwargs[name])
     threadpool_options = {}
@@ -1390,6 +2457,40 @@ server_runner.__doc__ = (serve.__doc__ or '') + """
         or for zombie threads that should cause a restart.  Default 100
         requests.
 
+    ``threadpool_min_workers``, ``threadpool_max_workers``:
+
+        Let the pool grow and shrink between these limits (both
+        default to ``threadpool_workers``, i.e., a fixed pool).
+
+    ``threadpool_scale_queue_depth``:
+
+        With autoscaling, add workers when this many requests are
+        waiting for a worker.  Default 2.
+
+    ``threadpool_scale_wait_time``:
+
+        With autoscaling, add workers when a request had to wait this
+        many seconds for a worker.  Default 0.5.
+
+    ``threadpool_scale_idle_time``:
+
+        With autoscaling, workers above ``threadpool_min_workers`` exit
+        after being idle this many seconds; this is also the cool-down
+        after the pool grows.  Default 60 seconds.
+
+    ``threadpool_max_queue``:
+
+        If this many requests are already waiting for a worker, new
+        requests are answered right away with ``503 Service
+        Unavailable`` (and a ``Retry-After`` header).  Default 0 (no
+        limit).
+
+    ``threadpool_max_queue_wait``:
+
+        Requests that have waited this many seconds for a worker are
+        answered with ``503 Service Unavailable`` instead of being
+        handled.  Default 0 (no limit).
+
     ``threadpool_logger``:
 
         Logging messages will go the logger named here.
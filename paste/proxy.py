@@ -26,10 +26,19 @@ TODO:
     use = egg:Paste#proxy
     address = http://server3:8680/exist/rest/db/orgs/sch/config/
     allowed_request_methods = GET
+
+Connections to the upstream servers are kept open and reused between
+requests (see `ConnectionPool`); by default all proxies share the
+module-level ``default_connection_pool``.  Request and response
+bodies are streamed in blocks of ``BLOCK_SIZE`` bytes rather than read
+into memory whole.
   
 """
 
 import http.client
+import select
+import threading
+import time
 import urllib.parse
 import urllib.request, urllib.parse, urllib.error
 
@@ -49,10 +58,211 @@ filtered_headers = (
     'upgrade',
 )
 
+BLOCK_SIZE = 4096 * 16
+
+# Requests with these methods can be sent again if the connection
+# breaks before the response arrives (the server may have acted on the
+# first one):
+idempotent_methods = (
+    'GET',
+    'HEAD',
+    'PUT',
+    'DELETE',
+    'OPTIONS',
+    'TRACE',
+)
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive connections to upstream servers,
+    kept per scheme and host.
+
+    At most ``max_size`` idle connections are kept for each host, and
+    connections that have been idle for more than ``idle_timeout``
+    seconds are closed instead of being reused.  An idle connection is
+    checked before it is reused, so connections the server has closed
+    in the meantime are discarded.
+    """
+
+    def __init__(self, max_size=10, idle_timeout=60):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        # (scheme, host): [(connection, time released), ...]
+        self.idle = {}
+
+    def get(self, scheme, host):
+        """
+        Returns ``(connection, reused)``, where ``reused`` is true if
+        the connection has been used for earlier requests.
+        """
+        key = (scheme, host)
+        while True:
+            self.lock.acquire()
+            try:
+                conns = self.idle.get(key)
+                if not conns:
+                    break
+                # The most recently used connection is the most likely
+                # to still be open
+                conn, released = conns.pop()
+            finally:
+                self.lock.release()
+            if (time.time() - released > self.idle_timeout
+                or not _connection_alive(conn)):
+                conn.close()
+                continue
+            return conn, True
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host), False
+        return http.client.HTTPConnection(host), False
+
+    def release(self, scheme, host, conn, response):
+        """
+        Return ``conn`` to the pool once ``response`` has been read,
+        or close it if it can't be reused.
+        """
+        if (conn.sock is None or response.will_close
+            or not response.isclosed()):
+            conn.close()
+            return
+        self.lock.acquire()
+        try:
+            conns = self.idle.setdefault((scheme, host), [])
+            if len(conns) < self.max_size:
+                conns.append((conn, time.time()))
+                return
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        self.lock.acquire()
+        try:
+            idle = self.idle
+            self.idle = {}
+        finally:
+            self.lock.release()
+        for conns in idle.values():
+            for conn, released in conns:
+                conn.close()
+
+    def request(self, scheme, host, method, path, body, headers):
+        """
+        Make a request over a pooled connection, returning
+        ``(connection, response)``.  If a reused connection turns out
+        to be broken the request is retried on a new connection, if
+        its method is idempotent (see ``idempotent_methods``) and the
+        body is not an iterator that may already be partly consumed.
+        """
+        retry = (method.upper() in idempotent_methods
+                 and isinstance(body, (bytes, str)))
+        while True:
+            conn, reused = self.get(scheme, host)
+            try:
+                conn.request(method, path, body, headers)
+                return conn, conn.getresponse()
+            except (ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if not reused or not retry:
+                    raise
+
+def _connection_alive(conn):
+    """
+    Checks that an idle connection is still usable.
+    """
+    if conn.sock is None:
+        return False
+    try:
+        readable = select.select([conn.sock], [], [], 0)[0]
+    except (ValueError, OSError):
+        return False
+    # An idle connection has nothing to read, unless the server has
+    # closed it (or sent something unexpected)
+    return not readable
+
+default_connection_pool = ConnectionPool()
+
+def _input_iter(input, length=None, block_size=BLOCK_SIZE):
+    """
+    Yields the request body from ``input`` in blocks, reading at most
+    ``length`` bytes (or up to the end if ``length`` is None).
+    """
+    while length is None or length > 0:
+        if length is None:
+            chunk = input.read(block_size)
+        else:
+            chunk = input.read(min(block_size, length))
+            length -= len(chunk)
+        if not chunk:
+            break
+        yield chunk
+
+def _request_body(environ, headers):
+    """
+    Returns the request body to send upstream, as an iterator over
+    ``wsgi.input``.  A body of unknown length (``CONTENT_LENGTH`` of
+    ``-1``) is sent with chunked encoding.
+    """
+    content_length = environ.get('CONTENT_LENGTH')
+    if not content_length or content_length == '0':
+        # An empty body can be sent again if the request is retried
+        return ''
+    if content_length == '-1':
+        # This is a special case, where the content length is
+        # basically undetermined; http.client will chunk the body
+        headers.pop('content-length', None)
+        return _input_iter(environ['wsgi.input'])
+    headers['content-length'] = content_length
+    return _input_iter(environ['wsgi.input'], int(content_length))
+
+class _ResponseIter(object):
+    """
+    Copies an upstream response to the client as it arrives, returning
+    the connection to the pool once the whole body has been read.
+    """
+
+    def __init__(self, pool, scheme, host, conn, response,
+                 block_size=BLOCK_SIZE):
+        self.pool = pool
+        self.scheme = scheme
+        self.host = host
+        self.conn = conn
+        self.response = response
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.conn is None:
+            raise StopIteration
+        # read1 returns whatever has arrived, so the first bytes go
+        # out as soon as the upstream server sends them
+        data = self.response.read1(self.block_size)
+        if not data:
+            # read1 doesn't mark the response finished; read does
+            self.response.read()
+            self.pool.release(self.scheme, self.host,
+                              self.conn, self.response)
+            self.conn = None
+            raise StopIteration
+        return data
+
+    def close(self):
+        if self.conn is not None:
+            # The client went away before the whole body was sent
+            self.response.close()
+            self.conn.close()
+            self.conn = None
+
 class Proxy(object):
 
     def __init__(self, address, allowed_request_methods=(),
-                 suppress_http_headers=()):
+                 suppress_http_headers=(), connection_pool=None):
         self.address = address
         self.parsed = urllib.parse.urlsplit(address)
         self.scheme = self.parsed[0].lower()
@@ -63,43 +273,34 @@ class Proxy(object):
         
         self.suppress_http_headers = [
             x.lower() for x in suppress_http_headers if x]
+        if connection_pool is None:
+            connection_pool = default_connection_pool
+        self.connection_pool = connection_pool
 
     def __call__(self, environ, start_response):
         if (self.allowed_request_methods and 
             environ['REQUEST_METHOD'].lower() not in self.allowed_request_methods):
             return httpexceptions.HTTPBadRequest("Disallowed")(environ, start_response)
 
-        if self.scheme == 'http':
-            ConnClass = http.client.HTTPConnection
-        elif self.scheme == 'https':
-            ConnClass = http.client.HTTPSConnection
-        else:
+        if self.scheme not in ('http', 'https'):
             raise ValueError(
                 "Unknown scheme for %r: %r" % (self.address, self.scheme))
-        conn = ConnClass(self.host)
         headers = {}
         for key, value in list(environ.items()):
             if key.startswith('HTTP_'):
                 key = key[5:].lower().replace('_', '-')
                 if key == 'host' or key in self.suppress_http_headers:
                     continue
+                if key in filtered_headers:
+                    # Hop-by-hop headers are for this connection only
+                    continue
                 headers[key] = value
         headers['host'] = self.host
         if 'REMOTE_ADDR' in environ:
             headers['x-forwarded-for'] = environ['REMOTE_ADDR']
         if environ.get('CONTENT_TYPE'):
             headers['content-type'] = environ['CONTENT_TYPE']
-        if environ.get('CONTENT_LENGTH'):
-            if environ['CONTENT_LENGTH'] == '-1':
-                # This is a special case, where the content length is basically undetermined
-                body = environ['wsgi.input'].read(-1)
-                headers['content-length'] = str(len(body))
-            else:
-                headers['content-length'] = environ['CONTENT_LENGTH'] 
-                length = int(environ['CONTENT_LENGTH'])
-                body = environ['wsgi.input'].read(length)
-        else:
-            body = ''
+        body = _request_body(environ, headers)
             
         path_info = urllib.parse.quote(environ['PATH_INFO'])
         if self.path:            
@@ -113,25 +314,19 @@ class Proxy(object):
         if environ.get('QUERY_STRING'):
             path += '?' + environ['QUERY_STRING']
             
-        conn.request(environ['REQUEST_METHOD'],
-                     path,
-                     body, headers)
-        res = conn.getresponse()
+        conn, res = self.connection_pool.request(
+            self.scheme, self.host, environ['REQUEST_METHOD'],
+            path, body, headers)
         headers_out = parse_headers(res.msg)
         
         status = '%s %s' % (res.status, res.reason)
         start_response(status, headers_out)
-        # @@: Default?
-        length = res.getheader('content-length')
-        if length is not None:
-            body = res.read(int(length))
-        else:
-            body = res.read()
-        conn.close()
-        return [body]
+        return _ResponseIter(self.connection_pool, self.scheme,
+                             self.host, conn, res)
 
 def make_proxy(global_conf, address, allowed_request_methods="",
-               suppress_http_headers=""):
+               suppress_http_headers="", pool_size=None,
+               pool_idle_timeout=None):
     """
     Make a WSGI application that proxies to another address:
     
@@ -145,13 +340,30 @@ def make_proxy(global_conf, address, allowed_request_methods="",
         a space seperated list of http headers (lower case, without
         the leading ``http_``) that should not be passed on to target
         host
+
+    ``pool_size``
+        the number of idle connections to keep open to the target
+        host (default 10)
+
+    ``pool_idle_timeout``
+        the number of seconds an idle connection is kept open
+        (default 60)
+
+    If neither ``pool_size`` nor ``pool_idle_timeout`` is given the
+    proxy uses the shared ``default_connection_pool``.
     """
     allowed_request_methods = aslist(allowed_request_methods)
     suppress_http_headers = aslist(suppress_http_headers)
+    connection_pool = None
+    if pool_size is not None or pool_idle_timeout is not None:
+        connection_pool = ConnectionPool(
+            max_size=int(pool_size or 10),
+            idle_timeout=float(pool_idle_timeout or 60))
     return Proxy(
         address,
         allowed_request_methods=allowed_request_methods,
-        suppress_http_headers=suppress_http_headers)
+        suppress_http_headers=suppress_http_headers,
+        connection_pool=connection_pool)
 
 
 class TransparentProxy(object):
@@ -168,12 +380,19 @@ class TransparentProxy(object):
     then HTTP_HOST won't be used to determine where to connect to;
     instead a specific host will be connected to, but the ``Host``
     header in the request will remain intact.
+
+    Hop-by-hop headers (like ``Connection``) are not passed on, as
+    the connection to the upstream server is a separate one (taken
+    from ``connection_pool``).
     """
 
     def __init__(self, force_host=None,
-                 force_scheme='http'):
+                 force_scheme='http', connection_pool=None):
         self.force_host = force_host
         self.force_scheme = force_scheme
+        if connection_pool is None:
+            connection_pool = default_connection_pool
+        self.connection_pool = connection_pool
 
     def __repr__(self):
         return '<%s %s force_host=%r force_scheme=%r>' % (
@@ -187,11 +406,7 @@ class TransparentProxy(object):
             conn_scheme = scheme
         else:
             conn_scheme = self.force_scheme
-        if conn_scheme == 'http':
-            ConnClass = http.client.HTTPConnection
-        elif conn_scheme == 'https':
-            ConnClass = http.client.HTTPSConnection
-        else:
+        if conn_scheme not in ('http', 'https'):
             raise ValueError(
                 "Unknown scheme %r" % scheme)
         if 'HTTP_HOST' not in environ:
@@ -202,75 +417,46 @@ class TransparentProxy(object):
             conn_host = host
         else:
             conn_host = self.force_host
-        conn = ConnClass(conn_host)
         headers = {}
         for key, value in list(environ.items()):
             if key.startswith('HTTP_'):
                 key = key[5:].lower().replace('_', '-')
+                if key in filtered_headers:
+                    continue
                 headers[key] = value
         headers['host'] = host
         if 'REMOTE_ADDR' in environ and 'HTTP_X_FORWARDED_FOR' not in environ:
             headers['x-forwarded-for'] = environ['REMOTE_ADDR']
         if environ.get('CONTENT_TYPE'):
             headers['content-type'] = environ['CONTENT_TYPE']
-        if environ.get('CONTENT_LENGTH'):
-            length = int(environ['CONTENT_LENGTH'])
-            body = environ['wsgi.input'].read(length)
-            if length == -1:
-                environ['CONTENT_LENGTH'] = str(len(body))
-        elif 'CONTENT_LENGTH' not in environ:
-            body = ''
-            length = 0
-        else:
-            body = ''
-            length = 0
+        body = _request_body(environ, headers)
         
         path = (environ.get('SCRIPT_NAME', '')
                 + environ.get('PATH_INFO', ''))
         path = urllib.parse.quote(path)
         if 'QUERY_STRING' in environ:
             path += '?' + environ['QUERY_STRING']
-        conn.request(environ['REQUEST_METHOD'],
-                     path, body, headers)
-        res = conn.getresponse()
+        conn, res = self.connection_pool.request(
+            conn_scheme, conn_host, environ['REQUEST_METHOD'],
+            path, body, headers)
         headers_out = parse_headers(res.msg)
                 
         status = '%s %s' % (res.status, res.reason)
         start_response(status, headers_out)
-        # @@: Default?
-        length = res.getheader('content-length')
-        if length is not None:
-            body = res.read(int(length))
-        else:
-            body = res.read()
-        conn.close()
-        return [body]
+        return _ResponseIter(self.connection_pool, conn_scheme,
+                             conn_host, conn, res)
 
 def parse_headers(message):
     """
     Turn a Message object into a list of WSGI-style headers.
     """
-    headers_out = []        
-    for full_header in message.headers:
-        if not full_header:            
-            # Shouldn't happen, but we'll just ignore
-            continue                     
-        if full_header[0].isspace():
-            # Continuation line, add to the last header
-            if not headers_out:                        
-                raise ValueError(
-                    "First header starts with a space (%r)" % full_header)
-            last_header, last_value = headers_out.pop()                   
-            value = last_value + ' ' + full_header.strip()
-            headers_out.append((last_header, value))      
-            continue                                
-        try:        
-            header, value = full_header.split(':', 1)
-        except:                                      
-            raise ValueError("Invalid header: %r" % full_header)
-        value = value.strip()                                   
-        if header.lower() not in filtered_headers:
-            headers_out.append((header, value))   
+    headers_out = []
+    for header, value in message.items():
+        if header.lower() in filtered_headers:
+            continue
+        # Join continuation lines
+        value = ' '.join([line.strip() for line in value.splitlines()])
+        headers_out.append((header, value))
     return headers_out
 
 def make_transparent_proxy(
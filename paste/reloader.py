@@ -38,16 +38,23 @@ a dynamic set of files that grows over time you can use something like::
 
 Then every time the reloader polls files it will call
 ``watch_config_files`` and check all the filenames it returns.
+
+On Linux the files are watched with inotify (see ``InotifyMonitor``),
+so they are only looked at when they change; elsewhere they are
+checked every ``poll_interval`` seconds.
 """
 
 import os
 import sys
 import time
+import errno
+import select
+import struct
 import threading
 import traceback
 from paste.util.classinstance import classinstancemethod
 
-def install(poll_interval=1):
+def install(poll_interval=1, use_inotify=True):
     """
     Install the reloading monitor.
 
@@ -55,8 +62,14 @@ def install(poll_interval=1):
     thread does, causing ports to remain open/locked.  The
     ``raise_keyboard_interrupt`` option creates a unignorable signal
     which causes the whole application to shut-down (rudely).
+
+    If inotify is available (and ``use_inotify`` is true) files are
+    watched with ``InotifyMonitor`` instead of being polled.
     """
-    mon = Monitor(poll_interval=poll_interval)
+    if use_inotify and _inotify() is not None:
+        mon = InotifyMonitor(poll_interval=poll_interval)
+    else:
+        mon = Monitor(poll_interval=poll_interval)
     t = threading.Thread(target=mon.periodic_reload)
     t.setDaemon(True)
     t.start()
@@ -76,7 +89,7 @@ class Monitor(object):
         self.file_callbacks = list(self.global_file_callbacks)
 
     def periodic_reload(self):
-        while True:
+        while self.keep_running:
             if not self.check_reload():
                 # use os._exit() here and not sys.exit() since within a
                 # thread sys.exit() just closes the given thread and
@@ -85,9 +98,17 @@ class Monitor(object):
                 # flush open files, etc.  In otherwords, it is rude.
                 os._exit(3)
                 break
-            time.sleep(self.poll_interval)
+            self.wait()
 
-    def check_reload(self):
+    def wait(self):
+        time.sleep(self.poll_interval)
+
+    def find_files(self, modules=True):
+        """
+        Returns the filenames to watch: the extra files, the files from
+        the callbacks, and (unless `modules` is false) the files of all
+        the loaded modules.
+        """
         filenames = list(self.extra_files)
         for file_callback in self.file_callbacks:
             try:
@@ -95,6 +116,8 @@ class Monitor(object):
             except:
                 print("Error calling paste.reloader callback %r:" % file_callback, file=sys.stderr)
                 traceback.print_exc()
+        if not modules:
+            return filenames
         for module in list(sys.modules.values()):
             try:
                 filename = module.__file__
@@ -102,25 +125,57 @@ class Monitor(object):
                 continue
             if filename is not None:
                 filenames.append(filename)
-        for filename in filenames:
-            try:
-                stat = os.stat(filename)
-                if stat:
-                    mtime = stat.st_mtime
-                else:
-                    mtime = 0
-            except (OSError, IOError):
-                continue
-            if filename.endswith('.pyc') and os.path.exists(filename[:-1]):
-                mtime = max(os.stat(filename[:-1]).st_mtime, mtime)
-            elif filename.endswith('$py.class') and \
-                    os.path.exists(filename[:-9] + '.py'):
-                mtime = max(os.stat(filename[:-9] + '.py').st_mtime, mtime)
-            if filename not in self.module_mtimes:
-                self.module_mtimes[filename] = mtime
-            elif self.module_mtimes[filename] < mtime:
-                print((
-                    "%s changed; reloading..." % filename), file=sys.stderr)
+        return filenames
+
+    def source_files(self, filename):
+        """
+        Returns the files whose modification means `filename` changed
+        (for compiled files, the source too).
+        """
+        if filename.endswith('.pyc'):
+            return [filename, filename[:-1]]
+        elif filename.endswith('$py.class'):
+            return [filename, filename[:-9] + '.py']
+        return [filename]
+
+    def get_mtime(self, filename):
+        """
+        Returns the modification time of `filename` (or of its source,
+        if that is newer), or None if it doesn't exist.
+        """
+        try:
+            stat = os.stat(filename)
+            if stat:
+                mtime = stat.st_mtime
+            else:
+                mtime = 0
+        except (OSError, IOError):
+            return None
+        if filename.endswith('.pyc') and os.path.exists(filename[:-1]):
+            mtime = max(os.stat(filename[:-1]).st_mtime, mtime)
+        elif filename.endswith('$py.class') and \
+                os.path.exists(filename[:-9] + '.py'):
+            mtime = max(os.stat(filename[:-9] + '.py').st_mtime, mtime)
+        return mtime
+
+    def check_file(self, filename):
+        """
+        Returns False if `filename` changed since it was first seen.
+        """
+        mtime = self.get_mtime(filename)
+        if mtime is None:
+            return True
+        if filename not in self.module_mtimes:
+            self.module_mtimes[filename] = mtime
+        elif self.module_mtimes[filename] < mtime:
+            print((
+                "%s changed; reloading..." % filename), file=sys.stderr)
+            return False
+        return True
+
+    def check_reload(self):
+        for filename in self.find_files():
+            if not self.check_file(filename):
                 return False
         return True
 
@@ -148,6 +203,204 @@ class Monitor(object):
 
     add_file_callback = classinstancemethod(add_file_callback)
 
+# inotify constants, from <sys/inotify.h>:
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_inotify_event = struct.Struct('iIII')
+_libc = None
+
+def _inotify():
+    """
+    Returns libc, if it has the inotify functions, or None.
+    """
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                import ctypes
+                import ctypes.util
+                libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                   use_errno=True)
+                libc.inotify_init1
+                libc.inotify_add_watch
+                libc.inotify_rm_watch
+            except (ImportError, OSError, AttributeError):
+                pass
+            else:
+                _libc = libc
+    return _libc or None
+
+class InotifyMonitor(Monitor):
+
+    """
+    Monitor that uses Linux's inotify to learn about changes, instead
+    of looking at every file every ``poll_interval`` seconds.
+
+    The directory of each file is watched once; the files are only
+    looked at when something happens to them.  Every ``poll_interval``
+    seconds the extra files and the files from the callbacks are
+    collected again, and the loaded modules too if there are more or
+    fewer of them than before (or, to catch modules replaced by others,
+    every ``module_rescan`` times), to watch files that have been added
+    since.  If a watched directory is removed or moved its files are
+    watched again.  Files that can't be watched (e.g., when the limit
+    on watches is reached, or their directory is gone) are polled.
+
+    The inotify file descriptor is closed when ``periodic_reload``
+    stops (once ``keep_running`` is false), or by ``close()``.
+    """
+
+    events = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    module_rescan = 10
+
+    def __init__(self, poll_interval):
+        Monitor.__init__(self, poll_interval)
+        libc = _inotify()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            import ctypes
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.libc = libc
+        # directory: watch descriptor, and the other way around
+        self.watches = {}
+        self.watch_dirs = {}
+        # path: the filenames that change when it changes
+        self.watched_paths = {}
+        # Files we couldn't watch, so poll
+        self.unwatched = set()
+        # Files whose directory's watch went away, to watch again
+        self.rewatch = set()
+        # len(sys.modules) when the modules were last looked through,
+        # and the checks since then
+        self.module_count = None
+        self.checks_since_rescan = 0
+
+    def close(self):
+        """
+        Closes the inotify file descriptor.
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def periodic_reload(self):
+        try:
+            Monitor.periodic_reload(self)
+        finally:
+            self.close()
+
+    def watch(self, filename):
+        for path in self.source_files(filename):
+            directory, name = os.path.split(os.path.abspath(path))
+            if directory not in self.watches:
+                wd = self.libc.inotify_add_watch(
+                    self.fd, os.fsencode(directory), self.events)
+                if wd < 0:
+                    self.watches[directory] = None
+                else:
+                    self.watches[directory] = wd
+                    self.watch_dirs[wd] = directory
+            if self.watches[directory] is None:
+                self.unwatched.add(filename)
+            self.watched_paths.setdefault(
+                os.path.join(directory, name), set()).add(filename)
+
+    def forget_watch(self, wd, mask):
+        """
+        Forgets the watch `wd`, after its directory was removed or
+        moved; its files are watched again at the next check.
+        """
+        directory = self.watch_dirs.pop(wd, None)
+        if directory is None:
+            return
+        if mask & IN_MOVE_SELF:
+            # The watch follows the directory to its new name
+            self.libc.inotify_rm_watch(self.fd, wd)
+        del self.watches[directory]
+        for path, filenames in self.watched_paths.items():
+            if os.path.dirname(path) == directory:
+                self.rewatch.update(filenames)
+
+    def read_events(self):
+        """
+        Returns the files with events since this was last called, or
+        None if events were lost.
+        """
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return changed
+                raise
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = _inotify_event.unpack_from(data, pos)
+                pos += _inotify_event.size
+                name = data[pos:pos+length].rstrip(b'\0')
+                pos += length
+                if mask & IN_Q_OVERFLOW:
+                    changed = None
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    self.forget_watch(wd, mask)
+                    continue
+                directory = self.watch_dirs.get(wd)
+                if directory is None or changed is None:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                changed.update(self.watched_paths.get(path, ()))
+
+    def wait(self):
+        select.select([self.fd], [], [], self.poll_interval)
+
+    def check_reload(self):
+        changed = self.read_events()
+        if changed is None:
+            # Events were lost, so look at everything
+            return Monitor.check_reload(self)
+        if self.rewatch:
+            rewatch, self.rewatch = self.rewatch, set()
+            for filename in rewatch:
+                self.watch(filename)
+            changed.update(rewatch)
+        # Looking through sys.modules is only worth it when modules
+        # were imported (or removed) since the last time; the same
+        # number of modules can still be different modules, so look
+        # every so often anyway
+        module_count = len(sys.modules)
+        self.checks_since_rescan += 1
+        modules = (module_count != self.module_count
+                   or self.checks_since_rescan >= self.module_rescan)
+        if modules:
+            self.module_count = module_count
+            self.checks_since_rescan = 0
+        for filename in self.find_files(modules=modules):
+            if filename not in self.module_mtimes:
+                # Watch before stat'ing, so no change is missed
+                self.watch(filename)
+                if not self.check_file(filename):
+                    return False
+        for filename in changed | self.unwatched:
+            if not self.check_file(filename):
+                return False
+        return True
+
 if sys.platform.startswith('java'):
     try:
         from _systemrestart import SystemRestart
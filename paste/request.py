@@ -10,6 +10,8 @@ environment to solve common requirements.
    * get_cookies(environ)
    * parse_querystring(environ)
    * parse_formvars(environ, include_get_vars=True)
+   * parse_urlencoded(data, max_fields=None)
+   * parse_multipart(input, boundary, length)
    * construct_url(environ, with_query_string=True, with_path_info=True,
                    script_name=None, path_info=None, querystring=None)
    * path_info_split(path_info)
@@ -17,9 +19,10 @@ environment to solve common requirements.
    * resolve_relative_url(url, environ)
 
 """
-import cgi
+import re
+import tempfile
 from http.cookies import SimpleCookie, CookieError
-from io import StringIO
+from urllib.parse import unquote
 import urllib.parse
 import urllib.request, urllib.parse, urllib.error
 try:
@@ -32,8 +35,26 @@ except ImportError:
 from paste.util.multidict import MultiDict
 
 __all__ = ['get_cookies', 'get_cookie_dict', 'parse_querystring',
-           'parse_formvars', 'construct_url', 'path_info_split',
-           'path_info_pop', 'resolve_relative_url', 'EnvironHeaders']
+           'parse_formvars', 'parse_urlencoded', 'parse_multipart',
+           'UploadedFile', 'construct_url',
+           'path_info_split', 'path_info_pop', 'resolve_relative_url',
+           'EnvironHeaders']
+
+# Limits on form data (urlencoded request bodies and query strings);
+# exceeding them raises HTTPRequestEntityTooLarge.  These can be
+# overridden per call to parse_formvars.
+max_form_fields = 10000
+max_form_size = 10 * 1024 * 1024
+
+# Limits for multipart/form-data bodies: the whole body, and each file
+# in it (None for no limit).  Files bigger than upload_spool_size are
+# kept in a temporary file on disk rather than in memory.  Fields that
+# aren't files are always kept in memory, and limited to
+# max_form_size.
+max_upload_size = None
+max_upload_part_size = None
+upload_spool_size = 1024 * 1024
+upload_block_size = 64 * 1024
 
 def get_cookies(environ):
     """
@@ -81,6 +102,74 @@ def get_cookie_dict(environ):
     environ['paste.cookies.dict'] = (result, header)
     return result
 
+def _too_large(message):
+    # paste.httpexceptions imports this module
+    from paste.httpexceptions import HTTPRequestEntityTooLarge
+    return HTTPRequestEntityTooLarge(message)
+
+def _bad_request(message):
+    from paste.httpexceptions import HTTPBadRequest
+    return HTTPBadRequest(message)
+
+_hex_digits = '0123456789abcdefABCDEF'
+_hex_to_byte = dict(
+    (a + b, bytes([int(a + b, 16)]))
+    for a in _hex_digits for b in _hex_digits)
+
+def _unquote(s, encoding, errors):
+    """
+    Decodes %XX escapes in ``s`` (like ``urllib.parse.unquote``, but
+    quicker).
+    """
+    parts = s.split('%')
+    result = [parts[0].encode(encoding)]
+    append = result.append
+    for part in parts[1:]:
+        byte = _hex_to_byte.get(part[:2])
+        if byte is None:
+            append(b'%')
+            append(part.encode(encoding))
+        else:
+            append(byte)
+            append(part[2:].encode(encoding))
+    return b''.join(result).decode(encoding, errors)
+
+def parse_urlencoded(data, max_fields=None, encoding='utf8',
+                     errors='replace'):
+    """
+    Parses ``application/x-www-form-urlencoded`` data (as in a query
+    string) into a MultiDict, in one pass.  Blank values are kept.
+    Raises ``HTTPRequestEntityTooLarge`` if there are more than
+    ``max_fields`` fields.
+
+        >>> parse_urlencoded('a=1&b=x+y&a=%C3%A9&c')
+        MultiDict([('a', '1'), ('b', 'x y'), ('a', '\\xe9'), ('c', '')])
+    """
+    if isinstance(data, bytes):
+        data = data.decode(encoding, errors)
+    if '+' in data:
+        # An encoded + is %2B, so this can be done all at once
+        data = data.replace('+', ' ')
+    fields = data.split('&')
+    if max_fields is not None and len(fields) > max_fields:
+        fields = [field for field in fields if field]
+        if len(fields) > max_fields:
+            raise _too_large(
+                'Too many form fields (more than %s)' % max_fields)
+    multi = MultiDict()
+    add = multi.add
+    for field in fields:
+        if not field:
+            continue
+        name, sep, value = field.partition('=')
+        # Most names and values need no decoding at all
+        if '%' in name:
+            name = _unquote(name, encoding, errors)
+        if '%' in value:
+            value = _unquote(value, encoding, errors)
+        add(name, value)
+    return multi
+
 def parse_querystring(environ):
     """
     Parses a query string into a list like ``[(name, value)]``.
@@ -99,8 +188,7 @@ def parse_querystring(environ):
         parsed, check_source = environ['paste.parsed_querystring']
         if check_source == source:
             return parsed
-    parsed = cgi.parse_qsl(source, keep_blank_values=True,
-                           strict_parsing=False)
+    parsed = parse_urlencoded(source, max_form_fields).items()
     environ['paste.parsed_querystring'] = (parsed, source)
     return parsed
 
@@ -130,23 +218,28 @@ def parse_dict_querystring(environ):
         parsed, check_source = environ['paste.parsed_dict_querystring']
         if check_source == source:
             return parsed
-    parsed = cgi.parse_qsl(source, keep_blank_values=True,
-                           strict_parsing=False)
-    multi = MultiDict(parsed)
+    multi = parse_urlencoded(source, max_form_fields)
     environ['paste.parsed_dict_querystring'] = (multi, source)
     return multi
 
-def parse_formvars(environ, include_get_vars=True):
+def parse_formvars(environ, include_get_vars=True, max_fields=None,
+                   max_size=None):
     """Parses the request, returning a MultiDict of form variables.
 
     If ``include_get_vars`` is true then GET (query string) variables
     will also be folded into the MultiDict.
 
     All values should be strings, except for file uploads which are
-    left as ``FieldStorage`` instances.
+    `UploadedFile` instances (with the same attributes as
+    ``cgi.FieldStorage``).
 
     If the request was not a normal form request (e.g., a POST with an
     XML body) then ``environ['wsgi.input']`` won't be read.
+
+    A body with more than ``max_fields`` fields, or longer than
+    ``max_size`` bytes, raises ``HTTPRequestEntityTooLarge``.  The
+    defaults are ``max_form_fields``, and ``max_form_size`` for
+    urlencoded bodies or ``max_upload_size`` for multipart bodies.
     """
     source = environ['wsgi.input']
     if 'paste.parsed_formvars' in environ:
@@ -155,51 +248,299 @@ def parse_formvars(environ, include_get_vars=True):
             if include_get_vars:
                 parsed.update(parse_querystring(environ))
             return parsed
-    # @@: Shouldn't bother FieldStorage parsing during GET/HEAD and
-    # fake_out_cgi requests
     type = environ.get('CONTENT_TYPE', '').lower()
     if ';' in type:
         type = type.split(';', 1)[0]
-    fake_out_cgi = type not in ('', 'application/x-www-form-urlencoded',
-                                'multipart/form-data')
-    # FieldStorage assumes a default CONTENT_LENGTH of -1, but a
-    # default of 0 is better:
-    if not environ.get('CONTENT_LENGTH'):
-        environ['CONTENT_LENGTH'] = '0'
-    # Prevent FieldStorage from parsing QUERY_STRING during GET/HEAD
-    # requests
-    old_query_string = environ.get('QUERY_STRING','')
-    environ['QUERY_STRING'] = ''
-    if fake_out_cgi:
-        input = StringIO('')
-        old_content_type = environ.get('CONTENT_TYPE')
-        old_content_length = environ.get('CONTENT_LENGTH')
-        environ['CONTENT_LENGTH'] = '0'
-        environ['CONTENT_TYPE'] = ''    
+    if type in ('', 'application/x-www-form-urlencoded'):
+        formvars = _parse_urlencoded_body(environ, max_fields, max_size)
+        environ['paste.parsed_formvars'] = (formvars, source)
+        if include_get_vars:
+            formvars.update(parse_querystring(environ))
+        return formvars
+    elif type == 'multipart/form-data':
+        formvars = _parse_multipart_body(environ, max_fields, max_size)
     else:
-        input = environ['wsgi.input']
-    fs = cgi.FieldStorage(fp=input,
-                          environ=environ,
-                          keep_blank_values=1)
-    environ['QUERY_STRING'] = old_query_string
-    if fake_out_cgi:
-        environ['CONTENT_TYPE'] = old_content_type
-        environ['CONTENT_LENGTH'] = old_content_length
-    formvars = MultiDict()
-    if isinstance(fs.value, list):
-        for name in list(fs.keys()):
-            values = fs[name]
-            if not isinstance(values, list):
-                values = [values]
-            for value in values:
-                if not value.filename:
-                    value = value.value
-                formvars.add(name, value)
+        formvars = MultiDict()
     environ['paste.parsed_formvars'] = (formvars, source)
     if include_get_vars:
         formvars.update(parse_querystring(environ))
     return formvars
 
+def _parse_urlencoded_body(environ, max_fields=None, max_size=None):
+    """
+    Parses a urlencoded request body, without going through
+    FieldStorage.
+    """
+    if max_fields is None:
+        max_fields = max_form_fields
+    if max_size is None:
+        max_size = max_form_size
+    if environ.get('REQUEST_METHOD', 'GET').upper() in ('GET', 'HEAD'):
+        return MultiDict()
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length <= 0:
+        return MultiDict()
+    if max_size is not None and length > max_size:
+        raise _too_large(
+            'Form data too large (%s bytes, more than %s)'
+            % (length, max_size))
+    body = environ['wsgi.input'].read(length)
+    return parse_urlencoded(body, max_fields)
+
+def _parse_multipart_body(environ, max_fields=None, max_size=None):
+    if max_size is None:
+        max_size = max_upload_size
+    params = _parse_header_params(environ['CONTENT_TYPE'])[1]
+    boundary = params.get('boundary')
+    if not boundary:
+        raise _bad_request('No boundary given for multipart/form-data')
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length <= 0:
+        return MultiDict()
+    return parse_multipart(environ['wsgi.input'], boundary, length,
+                           max_fields=max_fields, max_size=max_size)
+
+_header_param_re = re.compile(
+    r';\s*([^\s=;]+)\s*(?:=\s*("(?:[^"\\]|\\.)*"|[^;]*))?')
+
+def _parse_header_params(value):
+    """
+    Parses a header like ``Content-Disposition`` into its main value
+    and a dictionary of parameters (with lower-case names).
+    """
+    main, sep, rest = value.partition(';')
+    params = {}
+    for match in _header_param_re.finditer(sep + rest):
+        name, param = match.group(1).lower(), match.group(2) or ''
+        param = param.strip()
+        if len(param) >= 2 and param[0] == param[-1] == '"':
+            param = re.sub(r'\\(.)', r'\1', param[1:-1])
+        if name.endswith('*'):
+            # RFC 2231/5987 extended value, like UTF-8''file%20name
+            charset, sep, param = param.partition("'")
+            lang, sep, param = param.partition("'")
+            param = unquote(param, charset or 'utf8', 'replace')
+            name = name[:-1]
+        elif name in params:
+            # An extended value takes precedence
+            continue
+        params[name] = param
+    return main.strip().lower(), params
+
+class UploadedFile(object):
+    """
+    A file uploaded in a ``multipart/form-data`` request.
+
+    This has the attributes of the ``cgi.FieldStorage`` instances that
+    were used for uploads before: ``name``, ``filename``, ``type``,
+    ``type_options``, ``disposition``, ``disposition_options``,
+    ``headers`` (a dictionary with lower-case keys), ``file`` and
+    ``value`` (the whole content, as bytes).
+    """
+
+    def __init__(self, name, filename, headers, file):
+        self.name = name
+        self.filename = filename
+        self.headers = headers
+        self.disposition, self.disposition_options = _parse_header_params(
+            headers.get('content-disposition', ''))
+        self.type, self.type_options = _parse_header_params(
+            headers.get('content-type', 'application/octet-stream'))
+        self.file = file
+
+    @property
+    def value(self):
+        self.file.seek(0)
+        value = self.file.read()
+        self.file.seek(0)
+        return value
+
+    def __repr__(self):
+        return '<%s %r filename=%r>' % (
+            self.__class__.__name__, self.name, self.filename)
+
+def parse_multipart(input, boundary, length=None, max_fields=None,
+                    max_size=None, max_part_size=None, spool_size=None,
+                    encoding='utf8', errors='replace'):
+    """
+    Parses a ``multipart/form-data`` body from the file-like object
+    ``input`` into a MultiDict, reading at most ``length`` bytes (or up
+    to the end), ``upload_block_size`` bytes at a time.
+
+    Fields are decoded to strings; file uploads are returned as
+    `UploadedFile` instances, with the content in memory or, past
+    ``spool_size`` bytes, in a temporary file.  The module-level
+    ``max_form_fields``, ``max_upload_size``, ``max_upload_part_size``
+    and ``upload_spool_size`` are the defaults for the limits.
+    """
+    if max_fields is None:
+        max_fields = max_form_fields
+    if max_part_size is None:
+        max_part_size = max_upload_part_size
+    if spool_size is None:
+        spool_size = upload_spool_size
+    if isinstance(boundary, str):
+        boundary = boundary.encode('latin-1')
+    if max_size is not None and length is not None and length > max_size:
+        raise _too_large(
+            'Upload too large (%s bytes, more than %s)' % (length, max_size))
+    parser = _MultipartParser(input, boundary, length, max_fields,
+                              max_size, max_part_size, spool_size,
+                              encoding, errors)
+    return parser.parse()
+
+class _MultipartParser(object):
+
+    # Longest allowed header section of a single part
+    max_header_size = 16 * 1024
+
+    def __init__(self, input, boundary, length, max_fields, max_size,
+                 max_part_size, spool_size, encoding, errors):
+        self.input = input
+        self.boundary = boundary
+        self.remaining = length
+        self.max_fields = max_fields
+        self.max_size = max_size
+        self.max_part_size = max_part_size
+        self.spool_size = spool_size
+        self.encoding = encoding
+        self.errors = errors
+        self.read_size = 0
+        self.buffer = bytearray()
+
+    def fill(self):
+        """
+        Reads the next block into the buffer; returns false at the end
+        of the input.
+        """
+        size = upload_block_size
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+            if size <= 0:
+                return False
+        data = self.input.read(size)
+        if not data:
+            return False
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        self.read_size += len(data)
+        if self.max_size is not None and self.read_size > self.max_size:
+            raise _too_large(
+                'Upload too large (more than %s bytes)' % self.max_size)
+        self.buffer.extend(data)
+        return True
+
+    def parse(self):
+        buffer = self.buffer
+        formvars = MultiDict()
+        # Skip the preamble
+        first = b'--' + self.boundary
+        while True:
+            i = buffer.find(first)
+            if i >= 0:
+                del buffer[:i + len(first)]
+                break
+            del buffer[:max(0, len(buffer) - len(first))]
+            if not self.fill():
+                return formvars
+        delimiter = b'\r\n--' + self.boundary
+        fields = 0
+        while True:
+            # After a delimiter comes -- for the last one, or (possibly
+            # after some whitespace) the CRLF before the next part
+            while len(buffer) < 2:
+                if not self.fill():
+                    raise _bad_request('Incomplete multipart body')
+            if buffer[:2] == b'--':
+                break
+            headers = self.read_headers()
+            fields += 1
+            if self.max_fields is not None and fields > self.max_fields:
+                raise _too_large(
+                    'Too many form fields (more than %s)' % self.max_fields)
+            disposition, options = _parse_header_params(
+                headers.get('content-disposition', ''))
+            name = options.get('name', '')
+            filename = options.get('filename')
+            if filename:
+                limit = self.max_part_size
+                output = tempfile.SpooledTemporaryFile(
+                    max_size=self.spool_size, mode='w+b')
+            else:
+                limit = max_form_size
+                output = _BytesOutput()
+            self.read_body(delimiter, output, limit)
+            if filename:
+                output.seek(0)
+                value = UploadedFile(name, filename, headers, output)
+            else:
+                value = output.getvalue().decode(self.encoding, self.errors)
+            formvars.add(name, value)
+        return formvars
+
+    def read_headers(self):
+        buffer = self.buffer
+        while True:
+            # The rest of the delimiter line, then headers up to a
+            # blank line (which can follow the delimiter line directly)
+            start = buffer.find(b'\r\n')
+            end = buffer.find(b'\r\n\r\n', max(start, 0))
+            if start >= 0 and end >= 0:
+                break
+            if len(buffer) > self.max_header_size:
+                raise _bad_request('Multipart headers too long')
+            if not self.fill():
+                raise _bad_request('Incomplete multipart body')
+        lines = bytes(buffer[start + 2:end]).split(b'\r\n')
+        del buffer[:end + 4]
+        headers = {}
+        for line in lines:
+            name, sep, value = line.decode(self.encoding, self.errors).partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def read_body(self, delimiter, output, limit):
+        buffer = self.buffer
+        # Hold back enough to find a delimiter split between blocks
+        keep = len(delimiter) - 1
+        size = 0
+        while True:
+            i = buffer.find(delimiter)
+            if i >= 0:
+                end = i
+            else:
+                end = len(buffer) - keep
+            if end > 0:
+                size += end
+                if limit is not None and size > limit:
+                    raise _too_large(
+                        'Form field too large (more than %s bytes)' % limit)
+                output.write(buffer[:end])
+                del buffer[:end]
+            if i >= 0:
+                del buffer[:len(delimiter)]
+                return
+            if not self.fill():
+                raise _bad_request('Incomplete multipart body')
+
+class _BytesOutput(bytearray):
+    # Collects a field that isn't a file
+
+    def write(self, data):
+        self.extend(data)
+
+    def getvalue(self):
+        return bytes(self)
+
 def construct_url(environ, with_query_string=True, with_path_info=True,
                   script_name=None, path_info=None, querystring=None):
     """Reconstructs the URL from the WSGI environment.
@@ -394,20 +735,6 @@ class EnvironHeaders(DictMixin):
     def __contains__(self, item):
         return self._trans_name(item) in self.environ
 
-def _cgi_FieldStorage__repr__patch(self):
-    """ monkey patch for FieldStorage.__repr__
-
-    Unbelievely, the default __repr__ on FieldStorage reads
-    the entire file content instead of being sane about it.
-    This is a simple replacement that doesn't do that
-    """
-    if self.file:
-        return "FieldStorage(%r, %r)" % (
-                self.name, self.filename)
-    return "FieldStorage(%r, %r, %r)" % (
-             self.name, self.filename, self.value)
-
-cgi.FieldStorage.__repr__ = _cgi_FieldStorage__repr__patch
 
 if __name__ == '__main__':
     import doctest
@@ -17,10 +17,14 @@ be sent in that case.  There's current no way to use sessions without
 cookies, and there's no way to delete a session except to clear its
 data.
 
+Sessions are kept in files by default (``FileSession``).  Other
+stores can be used through ``StoreSession``: ``MemoryStore`` keeps
+sessions in the process, and ``SQLiteStore`` in a database that
+several processes can share.  A session is only written back when its
+data has changed.
+
 @@: This doesn't do any locking, and may cause problems when a single
-session is accessed concurrently.  Also, it loads and saves the
-session for each request, with no caching.  Also, sessions aren't
-expired.
+session is accessed concurrently.
 """
 
 from http.cookies import SimpleCookie
@@ -30,6 +34,7 @@ import os
 import datetime
 import threading
 import tempfile
+from collections import OrderedDict
 
 try:
     import pickle
@@ -142,7 +147,7 @@ class SessionFactory(object):
             r.append(os.times())
         if for_object is not None:
             r.append(id(for_object))
-        md5_hash = md5(str(r))
+        md5_hash = md5(str(r).encode('ascii'))
         try:
             return md5_hash.hexdigest()
         except AttributeError:
@@ -173,76 +178,285 @@ last_cleanup = None
 cleaning_up = False
 cleanup_cycle = datetime.timedelta(seconds=15*60) #15 min
 
-class FileSession(object):
 
-    def __init__(self, sid, create=False, session_file_path=tempfile.gettempdir(),
-                 chmod=None,
-                 expiration=2880, # in minutes: 48 hours
-                 ):
-        if chmod and isinstance(chmod, str):
-            chmod = int(chmod, 8)
-        self.chmod = chmod
+class SessionStore(object):
+
+    """
+    Where sessions are kept, for ``StoreSession``.  Stores keep the
+    pickled session data (as bytes) by session id, and should be safe
+    to use from several threads at once.
+
+    Subclasses implement:
+
+    ``load(sid)``:
+        Return the data saved for `sid`, or None if there is no such
+        session (or it has expired).
+
+    ``save(sid, data)``:
+        Save `data` for `sid`.
+
+    ``delete(sid)``:
+        Remove the session, if it exists.
+
+    ``clean_up()``:
+        Called on every request that uses a session; remove expired
+        sessions from time to time.
+    """
+
+    def load(self, sid):
+        raise NotImplementedError
+
+    def save(self, sid, data):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def clean_up(self):
+        pass
+
+
+class StoreSession(object):
+
+    """
+    A session kept in `store` (a ``SessionStore``).  The data is only
+    saved again when it has changed since it was loaded.
+
+    Use with ``SessionMiddleware(app, session_class=StoreSession,
+    store=MemoryStore())``; the same store should be used for every
+    request.
+    """
+
+    def __init__(self, sid, create=False, store=None):
         if not sid:
             # Invalid...
             raise KeyError
-        self.session_file_path = session_file_path
         self.sid = sid
+        self.store = store
+        # The pickled data as it is in the store (None if it isn't):
+        self._saved = None
         if not create:
-            if not os.path.exists(self.filename()):
+            self._saved = store.load(sid)
+            if self._saved is None:
                 raise KeyError
         self._data = None
 
-        self.expiration = expiration
+    def data(self):
+        if self._data is None:
+            if self._saved is None:
+                self._data = {}
+            else:
+                self._data = pickle.loads(self._saved)
+        return self._data
 
+    def close(self):
+        if self._data is None:
+            return
+        if not self._data:
+            if self._saved is not None:
+                self.store.delete(self.sid)
+            return
+        data = pickle.dumps(self._data)
+        if data != self._saved:
+            self.store.save(self.sid, data)
+            self._saved = data
 
-    def filename(self):
-        return os.path.join(self.session_file_path, self.sid)
+    def clean_up(self):
+        self.store.clean_up()
 
-    def data(self):
-        if self._data is not None:
-            return self._data
-        if os.path.exists(self.filename()):
-            f = open(self.filename(), 'rb')
-            self._data = pickle.load(f)
+
+class FileStore(SessionStore):
+
+    """
+    Keeps each session in a file named after the session id in
+    `session_file_path`.  Files are written to a temporary file and
+    renamed into place, so readers never see a partial session.
+
+    A session expires `expiration` minutes after it was last used; the
+    file's modification time is the time it was last used, updated at
+    most every `touch_interval` seconds.  Each time it is updated the
+    session id is added to an index file for that `touch_interval`
+    (in a directory named after the interval, in the
+    ``.paste_session_expiry`` directory), so cleaning up only reads the
+    index files that have expired, and looks only at the sessions
+    listed there.  Stores with different intervals each keep their own
+    index, so they can share a directory.  Expired sessions are
+    deleted in batches of `cleanup_batch`, pausing `cleanup_pause`
+    seconds between batches.
+    """
+
+    index_dir = '.paste_session_expiry'
+
+    def __init__(self, session_file_path=tempfile.gettempdir(),
+                 chmod=None,
+                 expiration=2880, # in minutes: 48 hours
+                 touch_interval=600, cleanup_batch=1000,
+                 cleanup_pause=0.1):
+        if chmod and isinstance(chmod, str):
+            chmod = int(chmod, 8)
+        self.chmod = chmod
+        self.session_file_path = session_file_path
+        self.expiration = expiration
+        self.touch_interval = touch_interval
+        self.cleanup_batch = cleanup_batch
+        self.cleanup_pause = cleanup_pause
+        # Index file names are periods of touch_interval, so they only
+        # mean something for that interval
+        self.index_path = os.path.join(
+            session_file_path, self.index_dir, str(touch_interval))
+
+    def filename(self, sid):
+        if (os.path.sep in sid or (os.path.altsep and os.path.altsep in sid)
+            or sid.startswith('.') or '\0' in sid):
+            # Not a session id we created; don't let it name another file
+            raise KeyError(sid)
+        return os.path.join(self.session_file_path, sid)
+
+    def _period(self, t):
+        return int(t // self.touch_interval)
+
+    def _index(self, sid, t):
+        """
+        Record in the index that `sid` was used at time `t`.
+        """
+        filename = os.path.join(self.index_path, str(self._period(t)))
+        try:
+            f = open(filename, 'a')
+        except (IOError, OSError):
+            if os.path.isdir(self.index_path):
+                raise
+            try:
+                os.makedirs(self.index_path)
+            except OSError:
+                # Probably created at the same time by someone else
+                pass
+            f = open(filename, 'a')
+        try:
+            f.write(sid + '\n')
+        finally:
             f.close()
-        else:
-            self._data = {}
-        return self._data
 
-    def close(self):
-        if self._data is not None:
-            filename = self.filename()
-            exists = os.path.exists(filename)
-            if not self._data:
-                if exists:
-                    os.unlink(filename)
-            else:
-                f = open(filename, 'wb')
-                pickle.dump(self._data, f)
+    def load(self, sid):
+        try:
+            filename = self.filename(sid)
+            f = open(filename, 'rb')
+        except (KeyError, IOError, OSError):
+            return None
+        try:
+            data = f.read()
+            last_used = os.fstat(f.fileno()).st_mtime
+        finally:
+            f.close()
+        now = time.time()
+        if last_used + self.expiration*60 < now:
+            return None
+        if self._period(last_used) != self._period(now):
+            try:
+                os.utime(filename, None)
+            except OSError:
+                # Probably deleted meanwhile
+                return None
+            self._index(sid, now)
+        return data
+
+    def save(self, sid, data):
+        filename = self.filename(sid)
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=self.session_file_path, prefix='.' + sid + '.')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(data)
+            finally:
                 f.close()
-                if not exists and self.chmod:
-                    os.chmod(filename, self.chmod)
+            if self.chmod:
+                os.chmod(tmp_filename, self.chmod)
+            os.replace(tmp_filename, filename)
+        except:
+            try:
+                os.unlink(tmp_filename)
+            except OSError:
+                pass
+            raise
+        self._index(sid, time.time())
+
+    def delete(self, sid):
+        try:
+            os.unlink(self.filename(sid))
+        except OSError:
+            pass
 
     def _clean_up(self):
         global cleaning_up
         try:
-            exp_time = datetime.timedelta(seconds=self.expiration*60)
-            now = datetime.datetime.now()
-
-            #Open every session and check that it isn't too old
-            for root, dirs, files in os.walk(self.session_file_path):
-                for f in files:
-                    self._clean_up_file(f, exp_time=exp_time, now=now)
+            if not os.path.exists(os.path.join(self.index_path, 'indexed')):
+                self._index_existing()
+            now = time.time()
+            # Every session in an index file before this one has expired
+            # (unless it was used again, and so is in a later file too):
+            expired = self._period(now - self.expiration*60)
+            periods = []
+            for name in os.listdir(self.index_path):
+                try:
+                    period = int(name)
+                except ValueError:
+                    continue
+                if period < expired:
+                    periods.append(period)
+            periods.sort()
+            for period in periods:
+                self._clean_up_index(
+                    os.path.join(self.index_path, str(period)), now)
         finally:
             cleaning_up = False
 
-    def _clean_up_file(self, f, exp_time, now):
+    def _clean_up_index(self, index_filename, now):
+        exp_time = self.expiration*60
+        try:
+            f = open(index_filename)
+        except (IOError, OSError):
+            # Another process is cleaning up too
+            return
+        try:
+            deleted = 0
+            for sid in f:
+                try:
+                    filename = self.filename(sid.strip())
+                    if os.stat(filename).st_mtime + exp_time < now:
+                        os.unlink(filename)
+                        deleted += 1
+                except (KeyError, OSError):
+                    # Already gone
+                    continue
+                if deleted >= self.cleanup_batch:
+                    time.sleep(self.cleanup_pause)
+                    deleted = 0
+        finally:
+            f.close()
+        try:
+            os.unlink(index_filename)
+        except OSError:
+            pass
+
+    def _index_existing(self):
+        """
+        Add the sessions saved before there was an index to the index.
+        """
+        if not os.path.isdir(self.index_path):
+            os.makedirs(self.index_path)
+        for entry in os.scandir(self.session_file_path):
+            if self._is_session_name(entry.name) and entry.is_file():
+                self._index(entry.name, entry.stat().st_mtime)
+        f = open(os.path.join(self.index_path, 'indexed'), 'w')
+        f.close()
+
+    def _is_session_name(self, f):
         t = f.split("-")
         if len(t) != 2:
-            return
+            return False
         t = t[0]
         try:
-            sess_time = datetime.datetime(
+            datetime.datetime(
                     int(t[0:4]),
                     int(t[4:6]),
                     int(t[6:8]),
@@ -251,10 +465,8 @@ class FileSession(object):
                     int(t[12:14]))
         except ValueError:
             # Probably not a session file at all
-            return
-
-        if sess_time + exp_time < now:
-            os.remove(os.path.join(self.session_file_path, f))
+            return False
+        return True
 
     def clean_up(self):
         global last_cleanup, cleanup_cycle, cleaning_up
@@ -277,6 +489,192 @@ class FileSession(object):
                     cleaning_up = False
                     raise
 
+
+class FileSession(StoreSession):
+
+    """
+    A session kept in a file (see ``FileStore``); this is the default
+    session class.
+    """
+
+    def __init__(self, sid, create=False, session_file_path=tempfile.gettempdir(),
+                 chmod=None,
+                 expiration=2880, # in minutes: 48 hours
+                 ):
+        store = FileStore(session_file_path, chmod=chmod,
+                          expiration=expiration)
+        self.session_file_path = session_file_path
+        self.chmod = store.chmod
+        self.expiration = expiration
+        StoreSession.__init__(self, sid, create=create, store=store)
+
+    def filename(self):
+        return self.store.filename(self.sid)
+
+
+class MemoryStore(SessionStore):
+
+    """
+    Keeps sessions in memory, in this process only.  Sessions expire
+    `expiration` minutes after they were last used, and at most
+    `max_sessions` are kept (the least recently used are dropped
+    first).  The sessions are split over `shards` separately locked
+    dictionaries, so requests don't all wait on one lock.
+    """
+
+    def __init__(self, expiration=2880, max_sessions=100000, shards=16,
+                 cleanup_interval=60):
+        self.expiration = expiration
+        self.max_sessions = max_sessions
+        self.cleanup_interval = cleanup_interval
+        # Each shard is [lock, {sid: (data, expires)}], least recently
+        # used first:
+        self.shards = [[threading.Lock(), OrderedDict()]
+                       for i in range(shards)]
+        self.shard_size = max(1, max_sessions // shards)
+        self.next_cleanup = time.time() + cleanup_interval
+        self.next_shard = 0
+
+    def _shard(self, sid):
+        return self.shards[hash(sid) % len(self.shards)]
+
+    def load(self, sid):
+        lock, sessions = self._shard(sid)
+        now = time.time()
+        lock.acquire()
+        try:
+            try:
+                data, expires = sessions[sid]
+            except KeyError:
+                return None
+            if expires < now:
+                del sessions[sid]
+                return None
+            sessions[sid] = (data, now + self.expiration*60)
+            sessions.move_to_end(sid)
+            return data
+        finally:
+            lock.release()
+
+    def save(self, sid, data):
+        lock, sessions = self._shard(sid)
+        lock.acquire()
+        try:
+            sessions.pop(sid, None)
+            sessions[sid] = (data, time.time() + self.expiration*60)
+            while len(sessions) > self.shard_size:
+                sessions.popitem(last=False)
+        finally:
+            lock.release()
+
+    def delete(self, sid):
+        lock, sessions = self._shard(sid)
+        lock.acquire()
+        try:
+            sessions.pop(sid, None)
+        finally:
+            lock.release()
+
+    def clean_up(self):
+        """
+        Every `cleanup_interval` seconds, remove the expired sessions
+        from one shard.
+        """
+        now = time.time()
+        if now < self.next_cleanup:
+            return
+        self.next_cleanup = now + self.cleanup_interval
+        self.next_shard = (self.next_shard + 1) % len(self.shards)
+        lock, sessions = self.shards[self.next_shard]
+        lock.acquire()
+        try:
+            expired = [sid for sid, (data, expires) in sessions.items()
+                       if expires < now]
+            for sid in expired:
+                del sessions[sid]
+        finally:
+            lock.release()
+
+
+class SQLiteStore(SessionStore):
+
+    """
+    Keeps sessions in an SQLite database at `filename`, which can be
+    shared by several processes.  The database uses write-ahead
+    logging, so reads don't wait for writes.  Sessions expire
+    `expiration` minutes after they were last used (reads update that
+    at most every `touch_interval` seconds); expired sessions are
+    deleted, at most `cleanup_batch` at a time, every
+    `cleanup_interval` seconds.
+    """
+
+    def __init__(self, filename, expiration=2880, timeout=30,
+                 touch_interval=600, cleanup_interval=60,
+                 cleanup_batch=1000):
+        self.filename = filename
+        self.expiration = expiration
+        self.touch_interval = touch_interval
+        self.timeout = timeout
+        self.cleanup_interval = cleanup_interval
+        self.cleanup_batch = cleanup_batch
+        self.next_cleanup = time.time() + cleanup_interval
+        # sqlite3 connections can't be shared between threads:
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'connection', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS paste_session ('
+                'sid TEXT PRIMARY KEY, data BLOB NOT NULL, '
+                'expires REAL NOT NULL)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS paste_session_expires '
+                'ON paste_session (expires)')
+            self.local.connection = conn
+        return conn
+
+    def load(self, sid):
+        conn = self.connection()
+        now = time.time()
+        row = conn.execute(
+            'SELECT data, expires FROM paste_session '
+            'WHERE sid = ? AND expires >= ?',
+            (sid, now)).fetchone()
+        if row is None:
+            return None
+        expires = now + self.expiration*60
+        if row[1] < expires - self.touch_interval:
+            conn.execute(
+                'UPDATE paste_session SET expires = ? WHERE sid = ?',
+                (expires, sid))
+        return bytes(row[0])
+
+    def save(self, sid, data):
+        self.connection().execute(
+            'INSERT OR REPLACE INTO paste_session (sid, data, expires) '
+            'VALUES (?, ?, ?)',
+            (sid, data, time.time() + self.expiration*60))
+
+    def delete(self, sid):
+        self.connection().execute(
+            'DELETE FROM paste_session WHERE sid = ?', (sid,))
+
+    def clean_up(self):
+        now = time.time()
+        if now < self.next_cleanup:
+            return
+        self.next_cleanup = now + self.cleanup_interval
+        self.connection().execute(
+            'DELETE FROM paste_session WHERE sid IN '
+            '(SELECT sid FROM paste_session WHERE expires < ? LIMIT ?)',
+            (now, self.cleanup_batch))
+
 class _NoDefault(object):
     def __repr__(self):
         return '<dynamic default>'
@@ -288,7 +686,9 @@ def make_session_middleware(
     expiration=NoDefault,
     cookie_name=NoDefault,
     session_file_path=NoDefault,
-    chmod=NoDefault):
+    chmod=NoDefault,
+    session_store=NoDefault,
+    session_db=NoDefault):
     """
     Adds a middleware that handles sessions for your applications.
     The session is a peristent dictionary.  To get this dictionary
@@ -316,6 +716,15 @@ def make_session_middleware(
           The octal chmod you want to apply to new sessions (e.g., 660
           to make the sessions group readable/writable)
 
+      session_store:
+          Where sessions are kept: ``file`` (the default; one file per
+          session in session_file_path), ``memory`` (in this process
+          only) or ``sqlite`` (in the database session_db).
+
+      session_db:
+          The SQLite database file for the ``sqlite`` store; default
+          ``paste_session.db`` in session_file_path.
+
     Each of these also takes from the global configuration.  cookie_name
     and chmod take from session_cookie_name and session_chmod
     """
@@ -331,7 +740,25 @@ def make_session_middleware(
         session_file_path = global_conf.get('session_file_path', '/tmp')
     if chmod is NoDefault:
         chmod = global_conf.get('session_chmod', None)
+    if session_store is NoDefault:
+        session_store = global_conf.get('session_store', 'file')
+    if session_db is NoDefault:
+        session_db = global_conf.get('session_db', None)
+    if session_store == 'file':
+        return SessionMiddleware(
+            app, session_expiration=session_expiration,
+            expiration=expiration, cookie_name=cookie_name,
+            session_file_path=session_file_path, chmod=chmod)
+    if session_store == 'memory':
+        store = MemoryStore(expiration=expiration)
+    elif session_store == 'sqlite':
+        if not session_db:
+            session_db = os.path.join(session_file_path, 'paste_session.db')
+        store = SQLiteStore(session_db, expiration=expiration)
+    else:
+        raise ValueError(
+            "session_store must be one of file, memory or sqlite (not %r)"
+            % session_store)
     return SessionMiddleware(
         app, session_expiration=session_expiration,
-        expiration=expiration, cookie_name=cookie_name,
-        session_file_path=session_file_path, chmod=chmod)
+        cookie_name=cookie_name, session_class=StoreSession, store=store)
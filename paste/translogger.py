@@ -4,7 +4,11 @@
 Middleware for logging requests, using Apache combined log format
 """
 
+import atexit
 import logging
+import os
+import queue
+import threading
 import time
 import urllib.request, urllib.parse, urllib.error
 
@@ -16,6 +20,20 @@ class TransLogger(object):
 
     If ``setup_console_handler`` is true, then messages for the named
     logger will be sent to the console.
+
+    With ``async_logging``, requests only put their log record on a
+    queue (of at most ``queue_size`` records); a background thread
+    formats the records and sends them to the logger, up to
+    ``batch_size`` at a time.  When the queue is full, ``queue_full``
+    says whether to ``'drop'`` the record or ``'block'`` until there is
+    room; ``dropped`` and ``blocked`` count how often that happened.
+
+    With ``log_on_close``, the response is logged when it is finished
+    (when its app_iter is closed) instead of at ``start_response``:
+    ``bytes`` is then the number of bytes actually sent, and the
+    format can use ``%(duration_ms)s`` (time until the response was
+    finished) and ``%(ttfb_ms)s`` (time until the first byte of the
+    body), both in milliseconds.  Otherwise those fields are ``-``.
     """
 
     format = ('%(REMOTE_ADDR)s - %(REMOTE_USER)s [%(time)s] '
@@ -28,7 +46,12 @@ class TransLogger(object):
                  logging_level=logging.INFO,
                  logger_name='wsgi',
                  setup_console_handler=True,
-                 set_logger_level=logging.DEBUG):
+                 set_logger_level=logging.DEBUG,
+                 async_logging=False,
+                 queue_size=10000,
+                 queue_full='drop',
+                 batch_size=100,
+                 log_on_close=False):
         if format is not None:
             self.format = format
         self.application = application
@@ -47,14 +70,34 @@ class TransLogger(object):
                 self.logger.setLevel(set_logger_level)
         else:
             self.logger = logger
+        if queue_full not in ('drop', 'block'):
+            raise ValueError(
+                "queue_full must be 'drop' or 'block' (not %r)" % queue_full)
+        self.log_on_close = log_on_close
+        self.async_logging = async_logging
+        self.queue_size = queue_size
+        self.queue_full = queue_full
+        self.batch_size = batch_size
+        self.dropped = self.blocked = 0
+        self.queue = None
+        self.writer = None
+        self.writer_pid = None
+        self.lock = threading.Lock()
+        # (second, formatted time) of the last time formatted:
+        self._time_cache = (None, None)
 
     def __call__(self, environ, start_response):
-        start = time.localtime()
+        start = time.time()
         req_uri = urllib.parse.quote(environ.get('SCRIPT_NAME', '')
                                + environ.get('PATH_INFO', ''))
         if environ.get('QUERY_STRING'):
             req_uri += '?'+environ['QUERY_STRING']
         method = environ['REQUEST_METHOD']
+        if self.log_on_close:
+            response = _LoggedResponse(self, environ, method, req_uri, start)
+            response.app_iter = self.application(
+                environ, response.start_response(start_response))
+            return response
         def replacement_start_response(status, headers, exc_info=None):
             # @@: Ideally we would count the bytes going by if no
             # content-length header was provided; but that does add
@@ -64,20 +107,21 @@ class TransLogger(object):
                 if name.lower() == 'content-length':
                     bytes = value
             self.write_log(environ, method, req_uri, start, status, bytes)
-            return start_response(status, headers)
+            return start_response(status, headers, exc_info)
         return self.application(environ, replacement_start_response)
 
-    def write_log(self, environ, method, req_uri, start, status, bytes):
+    def write_log(self, environ, method, req_uri, start, status, bytes,
+                  duration=None, ttfb=None):
         if bytes is None:
             bytes = '-'
-        if time.daylight:
-                offset = time.altzone / 60 / 60 * -100
+        if duration is None:
+            duration = '-'
+        else:
+            duration = '%d' % (duration * 1000)
+        if ttfb is None:
+            ttfb = '-'
         else:
-                offset = time.timezone / 60 / 60 * -100
-        if offset >= 0:
-                offset = "+%0.4d" % (offset)
-        elif offset < 0:
-                offset = "%0.4d" % (offset)
+            ttfb = '%d' % (ttfb * 1000)
         remote_addr = '-'
         if environ.get('HTTP_X_FORWARDED_FOR'):
             remote_addr = environ['HTTP_X_FORWARDED_FOR']
@@ -89,14 +133,174 @@ class TransLogger(object):
             'REQUEST_METHOD': method,
             'REQUEST_URI': req_uri,
             'HTTP_VERSION': environ.get('SERVER_PROTOCOL'),
-            'time': time.strftime('%d/%b/%Y:%H:%M:%S ', start) + offset,
+            'time': start,
             'status': status.split(None, 1)[0],
             'bytes': bytes,
             'HTTP_REFERER': environ.get('HTTP_REFERER', '-'),
             'HTTP_USER_AGENT': environ.get('HTTP_USER_AGENT', '-'),
+            'duration_ms': duration,
+            'ttfb_ms': ttfb,
             }
-        message = self.format % d
-        self.logger.log(self.logging_level, message)
+        if self.async_logging:
+            self.enqueue(d)
+        else:
+            self.logger.log(self.logging_level, self.format_log(d))
+
+    def format_log(self, d):
+        """
+        Format the log record `d` (as created by ``write_log``, with
+        the request start time in ``d['time']``).
+        """
+        d['time'] = self.format_time(d['time'])
+        return self.format % d
+
+    def format_time(self, start):
+        if isinstance(start, time.struct_time):
+            start = time.mktime(start)
+        second = int(start)
+        cached_second, formatted = self._time_cache
+        if second != cached_second:
+            local = time.localtime(second)
+            offset = local.tm_gmtoff // 60
+            if offset >= 0:
+                offset = "+%02d%02d" % divmod(offset, 60)
+            else:
+                offset = "-%02d%02d" % divmod(-offset, 60)
+            formatted = time.strftime('%d/%b/%Y:%H:%M:%S ', local) + offset
+            self._time_cache = (second, formatted)
+        return formatted
+
+    def enqueue(self, d):
+        """
+        Put a record on the queue for the background writer (starting
+        it if needed).
+        """
+        if self.writer_pid != os.getpid():
+            self.start_writer()
+        try:
+            self.queue.put_nowait(d)
+        except queue.Full:
+            # Many request threads get here at once, so count under
+            # the lock
+            self.lock.acquire()
+            try:
+                if self.queue_full == 'drop':
+                    self.dropped += 1
+                else:
+                    self.blocked += 1
+            finally:
+                self.lock.release()
+            if self.queue_full == 'block':
+                self.queue.put(d)
+
+    def start_writer(self):
+        # The writer thread doesn't survive a fork, so each process
+        # starts its own
+        self.lock.acquire()
+        try:
+            if self.writer_pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue_size)
+            self.writer = threading.Thread(
+                target=self.write_queue, args=(self.queue,),
+                name='TransLogger writer')
+            self.writer.daemon = True
+            self.writer.start()
+            if self.writer_pid is None:
+                atexit.register(self.stop_writer)
+            self.writer_pid = os.getpid()
+        finally:
+            self.lock.release()
+
+    def stop_writer(self):
+        """
+        Log everything that is queued, and stop the writer thread.
+        """
+        self.lock.acquire()
+        try:
+            if self.writer_pid != os.getpid():
+                return
+            self.queue.put(None)
+            self.writer.join()
+            self.writer_pid = None
+        finally:
+            self.lock.release()
+
+    def write_queue(self, records):
+        while True:
+            batch = [records.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(records.get_nowait())
+            except queue.Empty:
+                pass
+            for d in batch:
+                if d is None:
+                    return
+                try:
+                    self.logger.log(self.logging_level, self.format_log(d))
+                except Exception:
+                    # Like logging itself, don't let one bad record
+                    # stop the writer
+                    logging.getLogger(__name__).exception(
+                        'Error writing log record %r', d)
+
+class _LoggedResponse(object):
+
+    """
+    Wraps the app_iter of a request for ``TransLogger`` with
+    ``log_on_close``; counts the bytes sent and logs the request when
+    closed.
+    """
+
+    def __init__(self, translogger, environ, method, req_uri, start):
+        self.translogger = translogger
+        self.environ = environ
+        self.method = method
+        self.req_uri = req_uri
+        self.start = start
+        self.app_iter = None
+        self.status = None
+        self.bytes = 0
+        self.first_byte = None
+        self.logged = False
+
+    def start_response(self, start_response):
+        def replacement_start_response(status, headers, exc_info=None):
+            self.status = status
+            write = start_response(status, headers, exc_info)
+            def counting_write(data):
+                self.sent(data)
+                return write(data)
+            return counting_write
+        return replacement_start_response
+
+    def sent(self, data):
+        if data:
+            if self.first_byte is None:
+                self.first_byte = time.time()
+            self.bytes += len(data)
+
+    def __iter__(self):
+        for data in self.app_iter:
+            self.sent(data)
+            yield data
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            if not self.logged and self.status is not None:
+                self.logged = True
+                end = time.time()
+                ttfb = None
+                if self.first_byte is not None:
+                    ttfb = self.first_byte - self.start
+                self.translogger.write_log(
+                    self.environ, self.method, self.req_uri, self.start,
+                    self.status, self.bytes, duration=end - self.start,
+                    ttfb=ttfb)
 
 def make_filter(
     app, global_conf,
@@ -104,18 +308,28 @@ def make_filter(
     format=None,
     logging_level=logging.INFO,
     setup_console_handler=True,
-    set_logger_level=logging.DEBUG):
+    set_logger_level=logging.DEBUG,
+    async_logging=False,
+    queue_size=10000,
+    queue_full='drop',
+    batch_size=100,
+    log_on_close=False):
     from paste.util.converters import asbool
     if isinstance(logging_level, str):
-        logging_level = logging._levelNames[logging_level]
+        logging_level = logging.getLevelName(logging_level)
     if isinstance(set_logger_level, str):
-        set_logger_level = logging._levelNames[set_logger_level]
+        set_logger_level = logging.getLevelName(set_logger_level)
     return TransLogger(
         app,
         format=format or None,
         logging_level=logging_level,
         logger_name=logger_name,
         setup_console_handler=asbool(setup_console_handler),
-        set_logger_level=set_logger_level)
+        set_logger_level=set_logger_level,
+        async_logging=asbool(async_logging),
+        queue_size=int(queue_size),
+        queue_full=queue_full,
+        batch_size=int(batch_size),
+        log_on_close=asbool(log_on_close))
 
 make_filter.__doc__ = TransLogger.__doc__
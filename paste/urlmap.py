@@ -4,10 +4,10 @@
 Map URL prefixes to WSGI applications.  See ``URLMap``
 """
 
-from collections import MutableMapping, KeysView
+from collections.abc import MutableMapping, KeysView
 import re
 import os
-import cgi
+import html
 from paste import httpexceptions
 
 __all__ = ['URLMap', 'PathProxyURLMap']
@@ -86,6 +86,10 @@ class URLMap(MutableMapping, KeysView):
 
     def __init__(self, not_found_app=None):
         self.applications = []
+        # Compiled dispatch table, {domain: {url: app}}; built by
+        # _compile() on first use and kept up to date by
+        # __setitem__/__delitem__
+        self._table = None
         if not not_found_app:
             not_found_app = self.not_found_app
         self.not_found_application = not_found_app
@@ -106,7 +110,7 @@ class URLMap(MutableMapping, KeysView):
         extra += '\nHTTP_HOST: %r' % environ.get('HTTP_HOST')
         app = httpexceptions.HTTPNotFound(
             environ['PATH_INFO'],
-            comment=cgi.escape(extra)).wsgi_application
+            comment=html.escape(extra, quote=False)).wsgi_application
         return app(environ, start_response)
 
     def normalize_url(self, url, trim=True):
@@ -132,20 +136,36 @@ class URLMap(MutableMapping, KeysView):
             url = url.rstrip('/')
         return domain, url
 
+    def _sort_key(self, app_desc):
+        (domain, url), app = app_desc
+        if not domain:
+            # Make sure empty domains sort last:
+            return '\xff', -len(url)
+        else:
+            return domain, -len(url)
+
     def sort_apps(self):
         """
-        Make sure applications are sorted with longest URLs first
+        Make sure applications are sorted with longest URLs first.
+
+        If you change ``self.applications`` directly, call this
+        afterward so the dispatch table is rebuilt.
         """
-        def key(app_desc):
-            (domain, url), app = app_desc
-            if not domain:
-                # Make sure empty domains sort last:
-                return '\xff', -len(url)
-            else:
-                return domain, -len(url)
-        apps = [(key(desc), desc) for desc in self.applications]
-        apps.sort()
-        self.applications = [desc for (sortable, desc) in apps]
+        self.applications.sort(key=self._sort_key)
+        self._table = None
+
+    def _compile(self):
+        """
+        Build the dispatch table: for each domain, a dictionary of
+        mounted URLs.  A request then looks up each prefix of its path
+        (ending at a ``/``), longest first, instead of checking every
+        mounted application in turn.
+        """
+        table = {}
+        for (domain, url), app in self.applications:
+            table.setdefault(domain, {}).setdefault(url, app)
+        self._table = table
+        return table
 
     def __setitem__(self, url, app):
         if app is None:
@@ -157,23 +177,43 @@ class URLMap(MutableMapping, KeysView):
         dom_url = self.normalize_url(url)
         if dom_url in self:
             del self[dom_url]
-        self.applications.append((dom_url, app))
-        self.sort_apps()
+        app_desc = (dom_url, app)
+        key = self._sort_key(app_desc)
+        apps = self.applications
+        # Insert in place (after any equal keys), rather than re-sorting:
+        lo, hi = 0, len(apps)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < self._sort_key(apps[mid]):
+                hi = mid
+            else:
+                lo = mid + 1
+        apps.insert(lo, app_desc)
+        if self._table is not None:
+            self._table.setdefault(dom_url[0], {})[dom_url[1]] = app
 
     def __getitem__(self, url):
         dom_url = self.normalize_url(url)
-        for app_url, app in self.applications:
-            if app_url == dom_url:
-                return app
-        raise KeyError(
-            "No application with the url %r (domain: %r; existing: %s)"
-            % (url[1], url[0] or '*', self.applications))
+        table = self._table
+        if table is None:
+            table = self._compile()
+        try:
+            return table[dom_url[0]][dom_url[1]]
+        except KeyError:
+            raise KeyError(
+                "No application with the url %r (domain: %r; existing: %s)"
+                % (url[1], url[0] or '*', self.applications))
 
     def __delitem__(self, url):
         url = self.normalize_url(url)
         for app_url, app in self.applications:
             if app_url == url:
                 self.applications.remove((app_url, app))
+                if self._table is not None:
+                    urls = self._table[app_url[0]]
+                    del urls[app_url[1]]
+                    if not urls:
+                        del self._table[app_url[0]]
                 break
         else:
             raise KeyError(
@@ -182,6 +222,12 @@ class URLMap(MutableMapping, KeysView):
     def keys(self):
         return [app_url for app_url, app in self.applications]
 
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.applications)
+
     def __call__(self, environ, start_response):
         host = environ.get('HTTP_HOST', environ.get('SERVER_NAME')).lower()
         if ':' in host:
@@ -193,11 +239,23 @@ class URLMap(MutableMapping, KeysView):
                 port = '443'
         path_info = environ.get('PATH_INFO')
         path_info = self.normalize_url(path_info, False)[1]
-        for (domain, app_url), app in self.applications:
-            if domain and domain != host and domain != host+':'+port:
+        table = self._table
+        if table is None:
+            table = self._compile()
+        # Same order as self.applications: the host (which sorts before
+        # host:port), then host:port, then mounts for any domain
+        for domain in (host, host + ':' + port, None, ''):
+            urls = table.get(domain)
+            if not urls:
                 continue
-            if (path_info == app_url
-                or path_info.startswith(app_url + '/')):
+            app_url = path_info
+            while app_url not in urls:
+                pos = app_url.rfind('/')
+                if pos == -1:
+                    break
+                app_url = app_url[:pos]
+            else:
+                app = urls[app_url]
                 environ['SCRIPT_NAME'] += app_url
                 environ['PATH_INFO'] = path_info[len(app_url):]
                 return app(environ, start_response)
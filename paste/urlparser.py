@@ -7,6 +7,8 @@ WSGI applications that parse the URL and dispatch to on-disk resources
 import os
 import sys
 import imp
+import stat
+import time
 import mimetypes
 try:
     import pkg_resources
@@ -74,10 +76,16 @@ class URLParser(object):
         application is used for all requests.  ``urlparser_wrap`` and
         ``urlparser_hook`` are still called, but the filesystem isn't
         searched in any way.
+
+    The directory listing is kept between requests, and is only read
+    again when the directory's modification time changes; that is
+    checked at most every ``check_interval`` seconds.
     """
 
     parsers_by_directory = {}
 
+    check_interval = 1
+
     # This is lazily initialized
     init_module = NoDefault
 
@@ -89,6 +97,7 @@ class URLParser(object):
                  hide_extensions=NoDefault,
                  ignore_extensions=NoDefault,
                  constructors=None,
+                 check_interval=None,
                  **constructor_conf):
         """
         Create a URLParser object that looks at `directory`.
@@ -122,6 +131,10 @@ class URLParser(object):
             ignore_extensions = global_conf.get(
                 'ignore_extensions', ())
         self.ignore_extensions = converters.aslist(ignore_extensions)
+        if check_interval is not None:
+            self.check_interval = check_interval
+        # (directory mtime, time checked, listing); see _get_listing
+        self._listing = None
         self.constructors = self.global_constructors.copy()
         if constructors:
             self.constructors.update(constructors)
@@ -233,22 +246,51 @@ class URLParser(object):
             headers=[('location', url)])
         return exc.wsgi_application(environ, start_response)
 
-    def find_file(self, environ, base_filename):
-        possible = []
-        """Cache a few values to reduce function call overhead"""
-        for filename in os.listdir(self.directory):
+    def _get_listing(self):
+        """
+        Returns ``(by_name, by_base, types)`` for the files in the
+        directory: full filenames by filename, full filenames by base
+        name (leaving out ``ignore_extensions``), and the constructor
+        type (``'dir'`` or the extension) of each full filename.
+
+        The listing is read again if the directory's mtime has
+        changed, which is checked at most every ``check_interval``
+        seconds.
+        """
+        now = time.time()
+        listing = self._listing
+        if listing is not None and now - listing[1] < self.check_interval:
+            return listing[2]
+        mtime = os.stat(self.directory).st_mtime_ns
+        if listing is not None and listing[0] == mtime:
+            self._listing = (mtime, now, listing[2])
+            return listing[2]
+        by_name = {}
+        by_base = {}
+        types = {}
+        for entry in os.scandir(self.directory):
+            filename = entry.name
             base, ext = os.path.splitext(filename)
-            full_filename = os.path.join(self.directory, filename)
-            if (ext in self.hide_extensions
-                or not base):
-                continue
-            if filename == base_filename:
-                possible.append(full_filename)
+            if ext in self.hide_extensions or not base:
                 continue
-            if ext in self.ignore_extensions:
-                continue
-            if base == base_filename:
-                possible.append(full_filename)
+            full_filename = os.path.join(self.directory, filename)
+            by_name[filename] = full_filename
+            if entry.is_dir():
+                types[full_filename] = 'dir'
+            else:
+                types[full_filename] = ext
+            if ext not in self.ignore_extensions:
+                by_base.setdefault(base, []).append(full_filename)
+        self._listing = (mtime, now, (by_name, by_base, types))
+        return self._listing[2]
+
+    def find_file(self, environ, base_filename):
+        by_name, by_base, types = self._get_listing()
+        exact = by_name.get(base_filename)
+        possible = [filename for filename in by_base.get(base_filename, ())
+                    if filename != exact]
+        if exact:
+            possible.insert(0, exact)
         if not possible:
             #environ['wsgi.errors'].write(
             #    'No file found matching %r in %s\n'
@@ -258,8 +300,8 @@ class URLParser(object):
             # If there is an exact match, this isn't 'ambiguous'
             # per se; it might mean foo.gif and foo.gif.back for
             # instance
-            if full_filename in possible:
-                return full_filename
+            if exact:
+                return exact
             else:
                 environ['wsgi.errors'].write(
                     'Ambiguous URL: %s; matches files %s\n'
@@ -269,10 +311,12 @@ class URLParser(object):
         return possible[0]
 
     def get_application(self, environ, filename):
-        if os.path.isdir(filename):
-            t = 'dir'
-        else:
-            t = os.path.splitext(filename)[1]
+        t = self._get_listing()[2].get(filename)
+        if t is None:
+            if os.path.isdir(filename):
+                t = 'dir'
+            else:
+                t = os.path.splitext(filename)[1]
         constructor = self.constructors.get(t, self.constructors.get('*'))
         if constructor is None:
             #environ['wsgi.errors'].write(
@@ -322,6 +366,7 @@ class URLParser(object):
                 hide_extensions=self.hide_extensions,
                 ignore_extensions=self.ignore_extensions,
                 constructors=self.constructors)
+            parser.check_interval = self.check_interval
             self.parsers_by_directory[(directory, base_python_name)] = parser
             return parser
 
@@ -422,19 +467,51 @@ class StaticURLParser(object):
 
     ``cache_max_age``:
       integer specifies Cache-Control max_age in seconds
+
+    ``check_interval``:
+      how long (in seconds) to trust what was found on disk for a
+      path before looking again; 0 looks on every request
     """
     # @@: Should URLParser subclass from this?
 
+    check_interval = 1
+
     def __init__(self, directory, root_directory=None,
-                 cache_max_age=None):
+                 cache_max_age=None, check_interval=None):
         self.directory = self.normpath(directory)
         self.root_directory = self.normpath(root_directory or directory)
         self.cache_max_age = cache_max_age
+        if check_interval is not None:
+            self.check_interval = check_interval
+        # {full filename: (is_dir, mtime, time checked)}, only for
+        # files that exist:
+        self._found = {}
+        # Parsers for subdirectories, by full filename:
+        self._children = {}
 
     def normpath(path):
         return os.path.normcase(os.path.abspath(path))
     normpath = staticmethod(normpath)
 
+    def _stat(self, full):
+        """
+        Returns ``(is_dir, mtime)`` for the file, or None if it doesn't
+        exist.  Files that were found are not looked at again for
+        ``check_interval`` seconds.
+        """
+        now = time.time()
+        found = self._found.get(full)
+        if found is not None and now - found[2] < self.check_interval:
+            return found[:2]
+        try:
+            st = os.stat(full)
+        except OSError:
+            self._found.pop(full, None)
+            return None
+        found = (stat.S_ISDIR(st.st_mode), st.st_mtime, now)
+        self._found[full] = found
+        return found[:2]
+
     def __call__(self, environ, start_response):
         path_info = environ.get('PATH_INFO', '')
         if not path_info:
@@ -448,30 +525,46 @@ class StaticURLParser(object):
         if not full.startswith(self.root_directory):
             # Out of bounds
             return self.not_found(environ, start_response)
-        if not os.path.exists(full):
+        found = self._stat(full)
+        if found is None:
             return self.not_found(environ, start_response)
-        if os.path.isdir(full):
-            # @@: Cache?
-            return self.__class__(full, root_directory=self.root_directory,
-                                  cache_max_age=self.cache_max_age)(environ,
-                                                                   start_response)
+        is_dir, mytime = found
+        if is_dir:
+            child = self._children.get(full)
+            if child is None:
+                child = self.__class__(full, root_directory=self.root_directory,
+                                       cache_max_age=self.cache_max_age)
+                child.check_interval = self.check_interval
+                self._children[full] = child
+            return child(environ, start_response)
         if environ.get('PATH_INFO') and environ.get('PATH_INFO') != '/':
             return self.error_extra_path(environ, start_response)
         if_none_match = environ.get('HTTP_IF_NONE_MATCH')
         if if_none_match:
-            mytime = os.stat(full).st_mtime
+            # The cached mtime may be up to check_interval old, which
+            # would answer 304 for a file that just changed
+            try:
+                mytime = os.stat(full).st_mtime
+            except OSError:
+                self._found.pop(full, None)
+                return self.not_found(environ, start_response)
             if str(mytime) == if_none_match:
                 headers = []
                 ## FIXME: probably should be
                 ## ETAG.update(headers, '"%s"' % mytime)
                 ETAG.update(headers, mytime)
                 start_response('304 Not Modified', headers)
-                return [''] # empty body
+                return [b''] # empty body
 
         fa = self.make_app(full)
         if self.cache_max_age:
             fa.cache_control(max_age=self.cache_max_age)
-        return fa(environ, start_response)
+        try:
+            return fa(environ, start_response)
+        except OSError:
+            # The file was removed since it was found
+            self._found.pop(full, None)
+            return self.not_found(environ, start_response)
 
     def make_app(self, filename):
         return fileapp.FileApp(filename)
@@ -508,17 +601,24 @@ class StaticURLParser(object):
     def __repr__(self):
         return '<%s %r>' % (self.__class__.__name__, self.directory)
 
-def make_static(global_conf, document_root, cache_max_age=None):
+def make_static(global_conf, document_root, cache_max_age=None,
+                check_interval=None):
     """
     Return a WSGI application that serves a directory (configured
     with document_root)
 
     cache_max_age - integer specifies CACHE_CONTROL max_age in seconds
+
+    check_interval - seconds to trust a lookup on disk before looking
+    again (default 1)
     """
     if cache_max_age is not None:
         cache_max_age = int(cache_max_age)
+    if check_interval is not None:
+        check_interval = float(check_interval)
     return StaticURLParser(
-        document_root, cache_max_age=cache_max_age)
+        document_root, cache_max_age=cache_max_age,
+        check_interval=check_interval)
 
 class PkgResourcesParser(StaticURLParser):
 
@@ -604,7 +704,7 @@ def make_pkg_resources(global_conf, egg, resource_name=''):
 
 def make_url_parser(global_conf, directory, base_python_name,
                     index_names=None, hide_extensions=None,
-                    ignore_extensions=None,
+                    ignore_extensions=None, check_interval=None,
                     **constructor_conf):
     """
     Create a URLParser application that looks in ``directory``, which
@@ -613,7 +713,8 @@ def make_url_parser(global_conf, directory, base_python_name,
     directory (like ``'index'`` for ``'index.html'``).
     ``hide_extensions`` are extensions that are not viewable (like
     ``'.pyc'``) and ``ignore_extensions`` are viewable but only if an
-    explicit extension is given.
+    explicit extension is given.  The directory listing is checked
+    for changes at most every ``check_interval`` seconds.
     """
     if index_names is None:
         index_names = global_conf.get(
@@ -631,8 +732,14 @@ def make_url_parser(global_conf, directory, base_python_name,
     ignore_extensions = converters.aslist(ignore_extensions)
     # There's no real way to set constructors currently...
 
+    if check_interval is None:
+        check_interval = global_conf.get('check_interval')
+    if check_interval is not None:
+        check_interval = float(check_interval)
+
     return URLParser({}, directory, base_python_name,
                      index_names=index_names,
                      hide_extensions=hide_extensions,
                      ignore_extensions=ignore_extensions,
+                     check_interval=check_interval,
                      **constructor_conf)
@@ -0,0 +1,138 @@
+# (c) 2005 Ian Bicking and contributors; written for Paste (http://pythonpaste.org)
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+"""
+A bounded, thread-safe cache that discards the least recently used
+items first.  See ``LRUCache``
+"""
+
+import threading
+from collections import OrderedDict
+
+__all__ = ['LRUCache']
+
+
+class LRUCache(object):
+
+    """
+    A dictionary-like cache holding at most ``max_entries`` items and
+    ``max_bytes`` bytes (either limit can be None, for no limit).
+    When a limit is passed the least recently used items are
+    discarded.
+
+    Each item has a size in bytes, given when it is stored (for
+    instance the length of the content an application holds); items
+    stored without a size count as 0 bytes.  An item larger than
+    ``max_bytes`` is not stored at all.
+
+    ``hits``, ``misses`` and ``evictions`` count lookups that found an
+    item, lookups that didn't, and items discarded to stay under the
+    limits.  ``size`` is the total size of the items held.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key: (value, size), least recently used first
+        self._items = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Return the item for `key` (marking it as recently used), or
+        `default`.
+        """
+        self.lock.acquire()
+        try:
+            try:
+                value, size = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+        finally:
+            self.lock.release()
+
+    def peek(self, key, default=None):
+        """
+        Return the item for `key` or `default`, without counting the
+        lookup or marking the item as used.
+        """
+        item = self._items.get(key)
+        if item is None:
+            return default
+        return item[0]
+
+    def set(self, key, value, size=0):
+        """
+        Store `value` under `key`, discarding other items as needed.
+        Returns False (and removes any old item under `key`) if the
+        value is too large to ever fit.
+        """
+        self.lock.acquire()
+        try:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return False
+            self._items[key] = (value, size)
+            self.size += size
+            items = self._items
+            while ((self.max_entries is not None
+                    and len(items) > self.max_entries)
+                   or (self.max_bytes is not None
+                       and self.size > self.max_bytes)):
+                discarded_key, (discarded, discarded_size) = (
+                    items.popitem(last=False))
+                self.size -= discarded_size
+                self.evictions += 1
+            return True
+        finally:
+            self.lock.release()
+
+    def pop(self, key, default=None):
+        self.lock.acquire()
+        try:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            self.size -= item[1]
+            return item[0]
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self._items.clear()
+            self.size = 0
+        finally:
+            self.lock.release()
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, self) is self:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return '<%s %i items, %i bytes; hits=%i misses=%i evictions=%i>' % (
+            self.__class__.__name__, len(self._items), self.size,
+            self.hits, self.misses, self.evictions)
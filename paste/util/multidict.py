@@ -1,10 +1,9 @@
 # (c) 2005 Ian Bicking and contributors; written for Paste (http://pythonpaste.org)
 # Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
-import cgi
 import copy
 import sys
 try:
-    from collections import MutableMapping as DictMixin
+    from collections.abc import MutableMapping as DictMixin
 except ImportError:
     from UserDict import DictMixin
 
@@ -15,12 +14,21 @@ class MultiDict(DictMixin):
     An ordered dictionary that can have multiple values for each key.
     Adds the methods getall, getone, mixed, and add to the normal
     dictionary interface.
+
+    Keys are indexed, so looking up a key doesn't scan the items;
+    keys must be hashable.
     """
 
     def __init__(self, *args, **kw):
         if len(args) > 1:
             raise TypeError(
                 "MultiDict can only be called with one positional argument")
+        # (key, value) pairs in order, with None in the place of
+        # deleted items until the list is compacted
+        self._items = []
+        # key: positions of its items in self._items, in order
+        self._index = {}
+        self._deleted = 0
         if args:
             if hasattr(args[0], 'iteritems'):
                 items = list(args[0].items())
@@ -28,39 +36,53 @@ class MultiDict(DictMixin):
                 items = list(args[0].items())
             else:
                 items = list(args[0])
-            self._items = items
-        else:
+            for key, value in items:
+                self._append(key, value)
+        for key, value in kw.items():
+            self._append(key, value)
+
+    def _append(self, key, value):
+        self._index.setdefault(key, []).append(len(self._items))
+        self._items.append((key, value))
+
+    def _remove(self, positions):
+        for i in positions:
+            self._items[i] = None
+        self._deleted += len(positions)
+        # Compact once most of the list is deleted items; this keeps
+        # deletes cheap while iteration stays proportional to len()
+        if self._deleted > 16 and self._deleted * 2 > len(self._items):
+            items = [item for item in self._items if item is not None]
             self._items = []
-        self._items.extend(iter(kw.items()))
+            self._index = {}
+            self._deleted = 0
+            for key, value in items:
+                self._append(key, value)
 
     def __getitem__(self, key):
-        for k, v in self._items:
-            if k == key:
-                return v
-        raise KeyError(repr(key))
+        positions = self._index.get(key)
+        if not positions:
+            raise KeyError(repr(key))
+        return self._items[positions[0]][1]
 
     def __setitem__(self, key, value):
-        try:
-            del self[key]
-        except KeyError:
-            pass
-        self._items.append((key, value))
+        positions = self._index.pop(key, None)
+        if positions:
+            self._remove(positions)
+        self._append(key, value)
 
     def add(self, key, value):
         """
         Add the key and value, not overwriting any previous value.
         """
-        self._items.append((key, value))
+        self._append(key, value)
 
     def getall(self, key):
         """
         Return a list of all values matching the key (may be an empty list)
         """
-        result = []
-        for k, v in self._items:
-            if key == k:
-                result.append(v)
-        return result
+        items = self._items
+        return [items[i][1] for i in self._index.get(key, ())]
 
     def getone(self, key):
         """
@@ -83,18 +105,12 @@ class MultiDict(DictMixin):
         request.
         """
         result = {}
-        multi = {}
-        for key, value in self._items:
-            if key in result:
-                # We do this to not clobber any lists that are
-                # *actual* values in this dictionary:
-                if key in multi:
-                    result[key].append(value)
-                else:
-                    result[key] = [result[key], value]
-                    multi[key] = None
+        items = self._items
+        for key, positions in self._index.items():
+            if len(positions) == 1:
+                result[key] = items[positions[0]][1]
             else:
-                result[key] = value
+                result[key] = [items[i][1] for i in positions]
         return result
 
     def dict_of_lists(self):
@@ -102,108 +118,116 @@ class MultiDict(DictMixin):
         Returns a dictionary where each key is associated with a
         list of values.
         """
-        result = {}
-        for key, value in self._items:
-            if key in result:
-                result[key].append(value)
-            else:
-                result[key] = [value]
-        return result
+        items = self._items
+        return dict((key, [items[i][1] for i in positions])
+                    for key, positions in self._index.items())
 
     def __delitem__(self, key):
-        items = self._items
-        found = False
-        for i in range(len(items)-1, -1, -1):
-            if items[i][0] == key:
-                del items[i]
-                found = True
-        if not found:
+        positions = self._index.pop(key, None)
+        if not positions:
             raise KeyError(repr(key))
+        self._remove(positions)
 
     def __contains__(self, key):
-        for k, v in self._items:
-            if k == key:
-                return True
-        return False
+        return key in self._index
 
     has_key = __contains__
 
     def clear(self):
         self._items = []
+        self._index = {}
+        self._deleted = 0
 
     def copy(self):
         return MultiDict(self)
 
     def setdefault(self, key, default=None):
-        for k, v in self._items:
-            if key == k:
-                return v
-        self._items.append((key, default))
+        positions = self._index.get(key)
+        if positions:
+            return self._items[positions[0]][1]
+        self._append(key, default)
         return default
 
     def pop(self, key, *args):
         if len(args) > 1:
             raise TypeError("pop expected at most 2 arguments, got "\
                               + repr(1 + len(args)))
-        for i in range(len(self._items)):
-            if self._items[i][0] == key:
-                v = self._items[i][1]
-                del self._items[i]
-                return v
+        positions = self._index.get(key)
+        if positions:
+            i = positions.pop(0)
+            if not positions:
+                del self._index[key]
+            v = self._items[i][1]
+            self._remove([i])
+            return v
         if args:
             return args[0]
         else:
             raise KeyError(repr(key))
 
     def popitem(self):
-        return self._items.pop()
+        items = self._items
+        while items and items[-1] is None:
+            items.pop()
+            self._deleted -= 1
+        key, value = items.pop()
+        positions = self._index[key]
+        positions.pop()
+        if not positions:
+            del self._index[key]
+        return key, value
 
     def update(self, other=None, **kwargs):
         if other is None:
             pass
         elif hasattr(other, 'items'):
-            self._items.extend(list(other.items()))
+            for k, v in list(other.items()):
+                self._append(k, v)
         elif hasattr(other, 'keys'):
             for k in list(other.keys()):
-                self._items.append((k, other[k]))
+                self._append(k, other[k])
         else:
             for k, v in other:
-                self._items.append((k, v))
+                self._append(k, v)
         if kwargs:
             self.update(kwargs)
 
     def __repr__(self):
-        items = ', '.join(['(%r, %r)' % v for v in self._items])
+        items = ', '.join(['(%r, %r)' % v for v in self.iteritems()])
         return '%s([%s])' % (self.__class__.__name__, items)
 
     def __len__(self):
-        return len(self._items)
+        return len(self._items) - self._deleted
 
     ##
     ## All the iteration:
     ##
 
     def keys(self):
-        return [k for k, v in self._items]
+        return [item[0] for item in self._items if item is not None]
 
     def iterkeys(self):
-        for k, v in self._items:
-            yield k
+        for item in self._items:
+            if item is not None:
+                yield item[0]
 
     __iter__ = iterkeys
 
     def items(self):
-        return self._items[:]
+        return [item for item in self._items if item is not None]
 
     def iteritems(self):
-        return iter(self._items)
+        for item in self._items:
+            if item is not None:
+                yield item
 
     def values(self):
-        return [v for k, v in self._items]
+        return [item[1] for item in self._items if item is not None]
 
     def itervalues(self):
-        for k, v in self._items:
-            yield v
+        for item in self._items:
+            if item is not None:
+                yield item[1]
 
 
 class UnicodeMultiDict(DictMixin):
@@ -247,12 +271,16 @@ class UnicodeMultiDict(DictMixin):
 
         ``FieldStorage`` objects are specially handled.
         """
-        if isinstance(value, cgi.FieldStorage):
-            # decode FieldStorage's field name and filename
+        if hasattr(value, 'filename'):
+            # decode a FieldStorage's (or UploadedFile's) field name
+            # and filename
             value = copy.copy(value)
-            if self.decode_keys:
-                value.name = value.name.decode(self.encoding, self.errors)
-            value.filename = value.filename.decode(self.encoding, self.errors)
+            value.name = self._decode_key(value.name)
+            try:
+                value.filename = value.filename.decode(self.encoding,
+                                                       self.errors)
+            except AttributeError:
+                pass
         else:
             try:
                 value = value.decode(self.encoding, self.errors)
@@ -1,7 +1,7 @@
 # (c) 2005 Ian Bicking and contributors; written for Paste (http://pythonpaste.org)
 # Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
 
-import cgi
+import html
 import html.entities
 import urllib.request, urllib.parse, urllib.error
 import re
@@ -30,11 +30,9 @@ def html_quote(v, encoding=None):
     if v is None:
         return ''
     elif isinstance(v, str):
-        return cgi.escape(v, 1)
-    elif isinstance(v, str):
-        return cgi.escape(v.encode(encoding), 1)
+        return html.escape(v, 1)
     else:
-        return cgi.escape(str(v).encode(encoding), 1)
+        return html.escape(str(v), 1)
 
 _unquote_re = re.compile(r'&([a-zA-Z]+);')
 def _entity_subber(match, name2c=html.entities.name2codepoint):
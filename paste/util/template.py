@@ -28,16 +28,32 @@ method to make a substitution (or ``tmpl.substitute(a_dict)``).
 can use ``__name='tmpl.html'`` to set the name of the template.
 
 If there are syntax errors ``TemplateError`` will be raised.
+
+``tmpl.generate(**kw)`` and ``tmpl.iter_substitute(a_dict, chunk_size,
+encoding)`` return an iterator over the output in chunks instead,
+which can be returned directly from a WSGI application.
+
+Templates are compiled to a Python function when the ``Template`` is
+created, so substituting a template doesn't parse or compile anything.
+Errors raised while substituting still give the line and column in the
+template.
 """
 
+import os
 import re
 import sys
-import cgi
+import time
+import types
+import marshal
+import hashlib
+import threading
+from collections import OrderedDict
+from html import escape as _html_escape
 import urllib.request, urllib.parse, urllib.error
 from paste.util.looper import looper
 
 __all__ = ['TemplateError', 'Template', 'sub', 'HTMLTemplate',
-           'sub_html', 'html', 'bunch']
+           'sub_html', 'html', 'bunch', 'TemplateLoader']
 
 token_re = re.compile(r'\{\{|\}\}')
 in_re = re.compile(r'\s+in\s+')
@@ -59,12 +75,6 @@ class TemplateError(Exception):
             msg += ' in %s' % self.name
         return msg
 
-class _TemplateContinue(Exception):
-    pass
-
-class _TemplateBreak(Exception):
-    pass
-
 class Template(object):
 
     default_namespace = {
@@ -75,6 +85,9 @@ class Template(object):
 
     default_encoding = 'utf8'
 
+    # The size of the chunks produced by generate()
+    chunk_size = 4096
+
     def __init__(self, content, name=None, namespace=None):
         self.content = content
         self._unicode = isinstance(content, str)
@@ -83,6 +96,8 @@ class Template(object):
         if namespace is None:
             namespace = {}
         self.namespace = namespace
+        (self._code, self._positions, self._py_codes,
+         self._syntax_errors) = self._compile()
 
     def from_filename(cls, filename, namespace=None, encoding=None):
         f = open(filename, 'rb')
@@ -94,12 +109,62 @@ class Template(object):
 
     from_filename = classmethod(from_filename)
 
+    def _get_compiled(self):
+        """
+        Returns everything needed to rebuild the template without
+        parsing or compiling it, in a form ``marshal`` can store.
+        """
+        return (self.content, self._parsed, self._code,
+                tuple(self._py_codes), self._positions,
+                tuple(self._syntax_errors))
+
+    def _from_compiled(cls, compiled, name=None, namespace=None):
+        self = cls.__new__(cls)
+        (self.content, self._parsed, self._code, py_codes,
+         self._positions, syntax_errors) = compiled
+        self._py_codes = list(py_codes)
+        self._syntax_errors = list(syntax_errors)
+        self._unicode = isinstance(self.content, str)
+        self.name = name
+        if namespace is None:
+            namespace = {}
+        self.namespace = namespace
+        return self
+
+    _from_compiled = classmethod(_from_compiled)
+
     def __repr__(self):
         return '<%s %s name=%r>' % (
             self.__class__.__name__,
             hex(id(self))[2:], self.name)
 
     def substitute(self, *args, **kw):
+        ns = self._namespace(args, kw)
+        result = self._interpret(ns)
+        return result
+
+    def generate(self, *args, **kw):
+        """
+        Like ``substitute()``, but returns an iterator that produces
+        the output in chunks of about ``chunk_size`` characters as it
+        is generated.
+        """
+        return self.iter_substitute(self._namespace(args, kw))
+
+    def iter_substitute(self, vars, chunk_size=None, encoding=None):
+        """
+        Substitutes the dictionary ``vars``, yielding the output in
+        chunks of about ``chunk_size`` characters (default
+        ``self.chunk_size``).  With ``encoding`` the chunks are
+        encoded, so the result can be returned as a WSGI app_iter.
+        """
+        ns = self.default_namespace.copy()
+        ns.update(self.namespace)
+        ns.update(vars)
+        return self._interpret_iter(ns, chunk_size or self.chunk_size,
+                                    encoding)
+
+    def _namespace(self, args, kw):
         if args:
             if kw:
                 raise TypeError(
@@ -111,153 +176,260 @@ class Template(object):
         ns = self.default_namespace.copy()
         ns.update(self.namespace)
         ns.update(kw)
-        result = self._interpret(ns)
-        return result
+        return ns
 
     def _interpret(self, ns):
         __traceback_hide__ = True
         parts = []
-        self._interpret_codes(self._parsed, ns, out=parts)
+        func = types.FunctionType(self._code, ns)
+        try:
+            func(parts.append, self._repr, ns, self._py_codes,
+                 self._syntax_error)
+        except:
+            self._reraise(sys.exc_info(), self._code, self._positions)
         return ''.join(parts)
 
-    def _interpret_codes(self, codes, ns, out):
+    def _interpret_iter(self, ns, chunk_size, encoding):
+        __traceback_hide__ = True
+        code, positions = self._get_generator()
+        func = types.FunctionType(code, ns)
+        parts = []
+        size = 0
+        output = func(None, self._repr, ns, self._py_codes,
+                      self._syntax_error)
+        try:
+            try:
+                for part in output:
+                    parts.append(part)
+                    size += len(part)
+                    if size >= chunk_size:
+                        chunk = ''.join(parts)
+                        parts = []
+                        size = 0
+                        if encoding:
+                            chunk = chunk.encode(encoding)
+                        yield chunk
+            except Exception:
+                self._reraise(sys.exc_info(), code, positions)
+            if parts:
+                chunk = ''.join(parts)
+                if encoding:
+                    chunk = chunk.encode(encoding)
+                yield chunk
+        finally:
+            output.close()
+
+    def _get_generator(self):
+        """
+        Returns the code and position map of the template compiled as
+        a generator, compiling it the first time it's needed.
+        """
+        compiled = getattr(self, '_generator', None)
+        if compiled is None:
+            code, positions = self._compile(generator=True)[:2]
+            compiled = self._generator = (code, positions)
+        return compiled
+
+    def _reraise(self, exc_info, code, positions):
+        """
+        Re-raises an exception from the compiled template, adding the
+        position in the template that it came from.
+        """
+        __traceback_hide__ = True
+        e, tb = exc_info[1], exc_info[2]
+        lineno = None
+        while tb is not None:
+            if tb.tb_frame.f_code is code:
+                lineno = tb.tb_lineno
+            tb = tb.tb_next
+        pos = positions.get(lineno)
+        if pos is not None:
+            if e.args:
+                arg0 = e.args[0]
+            else:
+                arg0 = str(e)
+            e.args = (self._add_line_info(arg0, pos),)
+            if isinstance(e, SyntaxError):
+                # str() of a SyntaxError doesn't use args
+                e.msg = e.args[0]
+        raise e.with_traceback(exc_info[2])
+
+    ############################################################
+    ## Compiling
+    ############################################################
+
+    def _compile(self, generator=False):
+        """
+        Returns ``(code, positions, py_codes, syntax_errors)``; see
+        `_TemplateCompiler`.
+        """
+        compiler = _TemplateCompiler(self._code_name(), self.name, generator)
+        return compiler.compile(self._parsed)
+
+    def _code_name(self):
+        if self.name:
+            return '<template %s>' % self.name
+        return '<template>'
+
+    def _syntax_error(self, index):
+        __traceback_hide__ = True
+        raise SyntaxError(self._syntax_errors[index])
+
+    def _repr(self, value, pos):
         __traceback_hide__ = True
+        if value is None:
+            return ''
+        if isinstance(value, bytes):
+            return value.decode(self.default_encoding)
+        return str(value)
+
+    def _add_line_info(self, msg, pos):
+        msg = "%s at line %s column %s" % (
+            msg, pos[0], pos[1])
+        if self.name:
+            msg += " in file %s" % self.name
+        return msg
+
+class _TemplateCompiler(object):
+
+    """
+    Compiles a parsed template into the source of a single function
+    that is run with the substitution namespace as its globals, so
+    expressions see the namespace just as they would with eval().
+
+    The source is generated so each line belongs to exactly one
+    template directive; the returned positions map line numbers back
+    to template positions for error messages.  Output is passed to
+    ``__tmpl_append``, or yielded if ``generator`` is true.
+    """
+
+    def __init__(self, code_name, name=None, generator=False):
+        self.code_name = code_name
+        self.name = name
+        if generator:
+            self.emit = 'yield %s'
+        else:
+            self.emit = '__tmpl_append(%s)'
+        self.generator = generator
+        self.lines = []
+        # Variables assigned by {{for}} and {{default}} go in the
+        # namespace, like those assigned in {{py:}} blocks
+        self.assigned = set()
+        self.py_codes = []
+        self.syntax_errors = []
+
+    def compile(self, parsed):
+        self.compile_codes(parsed, 1)
+        header = ['def __template(__tmpl_append, __tmpl_repr, __tmpl_ns, '
+                  '__tmpl_py, __tmpl_syntax_error):']
+        if self.assigned:
+            header.append('    global %s' % ', '.join(sorted(self.assigned)))
+        if self.generator:
+            # Make sure it's a generator even if there's no output
+            header.append('    if 0: yield')
+        header.append('    pass')
+        source = '\n'.join(header + [line for line, pos in self.lines])
+        offset = len(header)
+        positions = dict(
+            (offset + i + 1, pos) for i, (line, pos) in enumerate(self.lines))
+        module = compile(source, self.code_name, 'exec')
+        for const in module.co_consts:
+            if isinstance(const, types.CodeType):
+                code = const
+                break
+        return code, positions, self.py_codes, self.syntax_errors
+
+    def compile_codes(self, codes, depth):
+        indent = '    ' * depth
+        start = len(self.lines)
         for item in codes:
             if isinstance(item, str):
-                out.append(item)
+                self.lines.append((indent + self.emit % repr(item), None))
             else:
-                self._interpret_code(item, ns, out)
+                self.compile_code(item, depth)
+        if len(self.lines) == start:
+            self.lines.append((indent + 'pass', None))
 
-    def _interpret_code(self, code, ns, out):
-        __traceback_hide__ = True
+    def compile_code(self, code, depth):
+        indent = '    ' * depth
+        lines = self.lines
         name, pos = code[0], code[1]
         if name == 'py':
-            self._exec(code[2], ns, pos)
-        elif name == 'continue':
-            raise _TemplateContinue()
-        elif name == 'break':
-            raise _TemplateBreak()
+            index = self.check_code(code[2], 'exec')
+            if index is None:
+                self.py_codes.append(
+                    compile(code[2], self.code_name, 'exec'))
+                lines.append((indent + 'exec(__tmpl_py[%i], __tmpl_ns)'
+                              % (len(self.py_codes) - 1), pos))
+            else:
+                lines.append((indent + '__tmpl_syntax_error(%i)' % index, pos))
+        elif name in ('continue', 'break'):
+            lines.append((indent + name, pos))
         elif name == 'for':
             vars, expr, content = code[2], code[3], code[4]
-            expr = self._eval(expr, ns, pos)
-            self._interpret_for(vars, expr, content, ns, out)
+            for var in vars:
+                if not var_re.search(var):
+                    raise TemplateError(
+                        'Not a valid variable name for {{for}}: %r' % var,
+                        position=pos, name=self.name)
+            self.assigned.update(vars)
+            self.compile_expr(
+                indent + 'for %s in (' % ', '.join(vars), expr, '):', pos)
+            self.compile_codes(content, depth+1)
         elif name == 'cond':
-            parts = code[2:]
-            self._interpret_if(parts, ns, out)
+            for part in code[2:]:
+                assert not isinstance(part, str)
+                if part[0] == 'else':
+                    lines.append((indent + 'else:', part[1]))
+                else:
+                    self.compile_expr(
+                        indent + '%s (' % part[0], part[2], '):', part[1])
+                self.compile_codes(part[3], depth+1)
         elif name == 'expr':
             parts = code[2].split('|')
-            base = self._eval(parts[0], ns, pos)
+            self.compile_expr(
+                indent + '__tmpl_value = (', parts[0], ')', pos)
             for part in parts[1:]:
-                func = self._eval(part, ns, pos)
-                base = func(base)
-            out.append(self._repr(base, pos))
+                self.compile_expr(
+                    indent + '__tmpl_value = (', part, ')(__tmpl_value)', pos)
+            lines.append((indent + self.emit % (
+                '__tmpl_repr(__tmpl_value, %r)' % (pos,)), pos))
         elif name == 'default':
             var, expr = code[2], code[3]
-            if var not in ns:
-                result = self._eval(expr, ns, pos)
-                ns[var] = result
+            self.assigned.add(var)
+            lines.append((indent + 'if %r not in __tmpl_ns:' % var, pos))
+            self.compile_expr(indent + '    %s = (' % var, expr, ')', pos)
         elif name == 'comment':
             return
         else:
             assert 0, "Unknown code: %r" % name
 
-    def _interpret_for(self, vars, expr, content, ns, out):
-        __traceback_hide__ = True
-        for item in expr:
-            if len(vars) == 1:
-                ns[vars[0]] = item
-            else:
-                if len(vars) != len(item):
-                    raise ValueError(
-                        'Need %i items to unpack (got %i items)'
-                        % (len(vars), len(item)))
-                for name, value in zip(vars, item):
-                    ns[name] = value
-            try:
-                self._interpret_codes(content, ns, out)
-            except _TemplateContinue:
-                continue
-            except _TemplateBreak:
-                break
-
-    def _interpret_if(self, parts, ns, out):
-        __traceback_hide__ = True
-        # @@: if/else/else gets through
-        for part in parts:
-            assert not isinstance(part, str)
-            name, pos = part[0], part[1]
-            if name == 'else':
-                result = True
-            else:
-                result = self._eval(part[2], ns, pos)
-            if result:
-                self._interpret_codes(part[3], ns, out)
-                break
-
-    def _eval(self, code, ns, pos):
-        __traceback_hide__ = True
+    def compile_expr(self, before, expr, after, pos):
+        """
+        Adds the lines for ``before + expr + after``.  The expression
+        goes on lines of its own, so it can contain newlines or
+        comments as it could with eval().  An expression that isn't
+        valid raises its SyntaxError when it is reached.
+        """
+        index = self.check_code(expr, 'eval')
+        if index is not None:
+            expr = '__tmpl_syntax_error(%i)' % index
+        self.lines.append((before, pos))
+        for line in expr.splitlines() or ['']:
+            self.lines.append((line, pos))
+        self.lines.append((' ' * len(before) + after, pos))
+
+    def check_code(self, code, mode):
+        """
+        Returns None if ``code`` compiles, or the index of the saved
+        SyntaxError.
+        """
         try:
-            value = eval(code, ns)
-            return value
-        except:
-            exc_info = sys.exc_info()
-            e = exc_info[1]
-            if getattr(e, 'args'):
-                arg0 = e.args[0]
-            else:
-                arg0 = str(e)
-            e.args = (self._add_line_info(arg0, pos),)
-            raise exc_info[0](e).with_traceback(exc_info[2])
-
-    def _exec(self, code, ns, pos):
-        __traceback_hide__ = True
-        try:
-            exec code in ns
-        except:
-            exc_info = sys.exc_info()
-            e = exc_info[1]
-            e.args = (self._add_line_info(e.args[0], pos),)
-            raise exc_info[0](e).with_traceback(exc_info[2])
-
-    def _repr(self, value, pos):
-        __traceback_hide__ = True
-        try:
-            if value is None:
-                return ''
-            if self._unicode:
-                try:
-                    value = str(value)
-                except UnicodeDecodeError:
-                    value = str(value)
-            else:
-                value = str(value)
-        except:
-            exc_info = sys.exc_info()
-            e = exc_info[1]
-            e.args = (self._add_line_info(e.args[0], pos),)
-            raise exc_info[0](e).with_traceback(exc_info[2])
-        else:
-            if self._unicode and isinstance(value, str):
-                if not self.decode_encoding:
-                    raise UnicodeDecodeError(
-                        'Cannot decode str value %r into unicode '
-                        '(no default_encoding provided)' % value)
-                value = value.decode(self.default_encoding)
-            elif not self._unicode and isinstance(value, str):
-                if not self.decode_encoding:
-                    raise UnicodeEncodeError(
-                        'Cannot encode unicode value %r into str '
-                        '(no default_encoding provided)' % value)
-                value = value.encode(self.default_encoding)
-            return value
-        
-
-    def _add_line_info(self, msg, pos):
-        msg = "%s at line %s column %s" % (
-            msg, pos[0], pos[1])
-        if self.name:
-            msg += " in file %s" % self.name
-        return msg
+            compile(code, self.code_name, mode)
+        except SyntaxError as e:
+            self.syntax_errors.append(e.msg)
+            return len(self.syntax_errors) - 1
+        return None
 
 def sub(content, **kw):
     name = kw.get('__name')
@@ -322,10 +494,8 @@ def html_quote(value):
             value = str(value)
         else:
             value = str(value)
-    value = cgi.escape(value, 1)
-    if isinstance(value, str):
-        value = value.encode('ascii', 'xmlcharrefreplace')
-    return value
+    value = _html_escape(value, True)
+    return value.encode('ascii', 'xmlcharrefreplace').decode('ascii')
 
 def url(v):
     if not isinstance(v, str):
@@ -372,6 +542,141 @@ def sub_html(content, **kw):
     return result
 
 
+############################################################
+## Loading templates from files
+############################################################
+
+class TemplateLoader(object):
+    """
+    Loads templates from files, keeping the most recently used ones.
+
+    ``load(filename)`` returns a template of ``template_class``
+    (``Template`` by default).  Up to ``cache_size`` templates are
+    kept, keyed by path and encoding.  A file is checked for changes
+    at most once every ``check_interval`` seconds (every time, if 0;
+    never, if None), and reloaded if its modification time or size
+    has changed.
+
+    If ``cache_dir`` is given the compiled templates are also written
+    there, so a new process can load them without parsing or compiling
+    them again.  Each entry records the modification time and size of
+    its file, and is ignored once they no longer match.
+    """
+
+    # Bump this when the compiled form of templates changes
+    cache_version = 1
+
+    def __init__(self, template_class=None, namespace=None,
+                 encoding='utf8', cache_size=200, check_interval=1,
+                 cache_dir=None):
+        if template_class is None:
+            template_class = Template
+        self.template_class = template_class
+        self.namespace = namespace
+        self.encoding = encoding
+        self.cache_size = cache_size
+        self.check_interval = check_interval
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        # (path, encoding): (template, (mtime, size), time checked)
+        self.cache = OrderedDict()
+
+    def load(self, filename, encoding=None):
+        if encoding is None:
+            encoding = self.encoding
+        path = os.path.abspath(filename)
+        key = (path, encoding)
+        now = time.time()
+        self.lock.acquire()
+        try:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+        finally:
+            self.lock.release()
+        if entry is not None:
+            template, stamp, checked = entry
+            if (self.check_interval is None
+                or now - checked < self.check_interval):
+                return template
+            if self._stamp(path) == stamp:
+                self._store(key, (template, stamp, now))
+                return template
+        stamp = self._stamp(path)
+        template = self._load_cached(path, encoding, stamp)
+        if template is None:
+            template = self.template_class.from_filename(
+                path, namespace=self.namespace, encoding=encoding)
+            self._save_cached(path, encoding, stamp, template)
+        self._store(key, (template, stamp, now))
+        return template
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.cache.clear()
+        finally:
+            self.lock.release()
+
+    def _store(self, key, entry):
+        self.lock.acquire()
+        try:
+            self.cache[key] = entry
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        finally:
+            self.lock.release()
+
+    def _stamp(self, path):
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size)
+
+    def _cache_filename(self, path, encoding):
+        key = '%s\0%s\0%s' % (path, encoding, sys.implementation.cache_tag)
+        digest = hashlib.sha1(key.encode('utf8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.tmplc')
+
+    def _load_cached(self, path, encoding, stamp):
+        if not self.cache_dir:
+            return None
+        try:
+            f = open(self._cache_filename(path, encoding), 'rb')
+            try:
+                data = marshal.load(f)
+            finally:
+                f.close()
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if (not isinstance(data, tuple) or len(data) != 4
+            or data[0] != self.cache_version or data[1] != path
+            or tuple(data[2]) != stamp):
+            return None
+        return self.template_class._from_compiled(
+            data[3], name=path, namespace=self.namespace)
+
+    def _save_cached(self, path, encoding, stamp, template):
+        if not self.cache_dir:
+            return
+        filename = self._cache_filename(path, encoding)
+        tmp_filename = '%s.%s.tmp' % (filename, os.getpid())
+        data = (self.cache_version, path, stamp, template._get_compiled())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            f = open(tmp_filename, 'wb')
+            try:
+                marshal.dump(data, f)
+            finally:
+                f.close()
+            os.replace(tmp_filename, filename)
+        except (OSError, ValueError):
+            # The cache is only an optimization
+            try:
+                os.unlink(tmp_filename)
+            except OSError:
+                pass
+
 ############################################################
 ## Lexing and Parsing
 ############################################################
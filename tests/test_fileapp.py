@@ -92,7 +92,7 @@ def test_file():
     file.close()
     try:
         from paste import fileapp
-        app = fileapp.FileApp(tempfile)
+        app = fileapp.FileApp(tempfile, cache_size=fileapp.CACHE_SIZE)
         res = TestApp(app).get("/")
         assert len(content) == int(res.header('content-length'))
         assert 'text/plain' == res.header('content-type')
@@ -189,7 +189,7 @@ def test_file_range():
     file.close()
     try:
         def build(range, status=200):
-            app = fileapp.FileApp(tempfile)
+            app = fileapp.FileApp(tempfile, cache_size=fileapp.CACHE_SIZE)
             return TestApp(app).get("/",headers={'Range': range},
                                         status=status)
         _excercize_range(build,content)
@@ -0,0 +1,185 @@
+"""
+Tests of the caches in paste.fileapp.
+"""
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from paste import fileapp
+
+def setup_module(module):
+    module.tmpdir = tempfile.mkdtemp()
+
+def teardown_module(module):
+    shutil.rmtree(module.tmpdir)
+
+def setup_function(function):
+    fileapp.content_cache.clear()
+
+def teardown_function(function):
+    fileapp.content_cache.max_bytes = fileapp.CONTENT_CACHE_BYTES
+    fileapp.content_cache.clear()
+
+def write(name, content):
+    filename = os.path.join(tmpdir, name)
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    f = open(filename, 'wb')
+    f.write(content)
+    f.close()
+    return filename
+
+def get(app, path, status=200, **extra_environ):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+        }
+    environ.update(extra_environ)
+    response = []
+    def start_response(response_status, headers, exc_info=None):
+        response[:] = [response_status, headers]
+    app_iter = app(environ, start_response)
+    try:
+        body = b''.join(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    assert int(response[0].split()[0]) == status, (
+        "Got %s for %s, not %s" % (response[0], path, status))
+    return body, dict(response[1])
+
+def test_content_cache():
+    for name in 'abc':
+        write('content/' + name, name.encode('ascii') * 100)
+    fileapp.content_cache.max_bytes = 250
+    app = fileapp.DirectoryApp(
+        os.path.join(tmpdir, 'content'),
+        cache=fileapp.LRUCache(max_entries=2))
+    for name in 'abc':
+        assert get(app, '/' + name)[0] == name.encode('ascii') * 100
+    assert len(app.cached_apps) == 2
+    assert app.cached_apps.evictions == 1
+    # Only two files fit in the content cache
+    assert fileapp.content_cache.size == 200
+    assert fileapp.content_cache.evictions == 1
+    # Dropped content is read from disk again
+    assert get(app, '/a')[0] == b'a' * 100
+    assert fileapp.content_cache.size == 200
+
+def test_cache_size():
+    # Files much larger than a block are kept in memory by default
+    content = b'x' * (fileapp.BLOCK_SIZE * 4)
+    filename = write('large.txt', content)
+    app = fileapp.FileApp(filename)
+    assert get(app, '/')[0] == content
+    assert app.content == content
+    assert fileapp.content_cache.size == len(content)
+    # ... unless the cache size says otherwise
+    app = fileapp.FileApp(filename, cache_size=len(content))
+    assert get(app, '/')[0] == content
+    assert app.content is None
+    assert fileapp.content_cache.size == len(content)
+    assert 'Cache-Size' not in dict(app.headers)
+
+def check_archive(store, names, content):
+    assert get(store, '/small.txt')[0] == b'small'
+    for name in names:
+        body, headers = get(store, '/' + name)
+        assert body == content
+        assert headers['Content-Length'] == str(len(content))
+        body, headers = get(store, '/' + name, status=206,
+                            HTTP_RANGE='bytes=3-17')
+        assert body == content[3:18]
+        get(store, '/' + name, status=304,
+            HTTP_IF_NONE_MATCH=headers['ETag'])
+    get(store, '/missing.txt', status=404)
+
+archive_content = b'abcdefghijklmnopqrstuvwxyz' * (
+    1 + fileapp.CACHE_SIZE // 26)
+
+def test_archive():
+    filename = os.path.join(tmpdir, 'archive.zip')
+    archive = zipfile.ZipFile(filename, 'w')
+    archive.writestr('small.txt', b'small')
+    archive.writestr('stored.txt', archive_content, zipfile.ZIP_STORED)
+    archive.writestr('deflated.txt', archive_content, zipfile.ZIP_DEFLATED)
+    archive.close()
+    check_archive(fileapp.ArchiveStore(filename),
+                  ['stored.txt', 'deflated.txt'], archive_content)
+
+def write_tar(name, mode):
+    filename = os.path.join(tmpdir, name)
+    archive = tarfile.open(filename, mode)
+    for member_name, content in [('small.txt', b'small'),
+                                 ('large.txt', archive_content)]:
+        info = tarfile.TarInfo(member_name)
+        info.size = len(content)
+        info.mtime = time.time()
+        archive.addfile(info, io.BytesIO(content))
+    archive.close()
+    return filename
+
+def test_tar():
+    filename = write_tar('archive.tar', 'w')
+    store = fileapp.ArchiveStore(filename)
+    check_archive(store, ['large.txt'], archive_content)
+    # Read from the archive for each request
+    assert store.cache.size == len(b'small')
+
+def test_compressed_tar():
+    filename = write_tar('archive.tar.gz', 'w:gz')
+    store = fileapp.ArchiveStore(filename)
+    check_archive(store, ['large.txt'], archive_content)
+    # Extracted once and kept
+    assert store.cache.size == len(b'small') + len(archive_content)
+    # Too large for the cache, so it's read for each request; the
+    # requests don't get in each other's way
+    store = fileapp.ArchiveStore(
+        filename, cache=fileapp.LRUCache(max_bytes=len(archive_content) - 1))
+    check_archive(store, ['large.txt'], archive_content)
+    assert store.cache.size == len(b'small')
+    first = store.open_member('large.txt')
+    second = store.open_member('large.txt', start=10)
+    try:
+        assert first.read(10) == archive_content[:10]
+        assert second.read(10) == archive_content[10:20]
+        assert first.read(10) == archive_content[10:20]
+    finally:
+        first.close()
+        second.close()
+
+def test_file_wrapper():
+    # With a file wrapper, which can use sendfile, only small files
+    # are kept in memory
+    content = b'x' * (fileapp.CACHE_SIZE * 4)
+    filename = write('wrapped.txt', content)
+    wrapped = []
+    def file_wrapper(file, block_size):
+        wrapped.append(file)
+        return iter(lambda: file.read(block_size), b'')
+    app = fileapp.FileApp(filename)
+    try:
+        assert get(app, '/', **{'wsgi.file_wrapper': file_wrapper}
+                   )[0] == content
+        assert len(wrapped) == 1
+        assert app.content is None
+    finally:
+        for file in wrapped:
+            file.close()
+    write('wrapped-small.txt', b'small')
+    app = fileapp.FileApp(os.path.join(tmpdir, 'wrapped-small.txt'))
+    assert get(app, '/', **{'wsgi.file_wrapper': file_wrapper})[0] == b'small'
+    assert app.content == b'small'
+    assert len(wrapped) == 1
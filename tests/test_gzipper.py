@@ -1,18 +1,164 @@
-from paste.fixture import TestApp
 from paste.gzipper import middleware
-import gzip, io
+import gzip, io, zlib
+
+body = b'this is a test' * 100
 
 def simple_app(environ, start_response):
     start_response('200 OK', [('content-type', 'text/plain')])
-    return 'this is a test'
+    return [body]
+
+def small_app(environ, start_response):
+    start_response('200 OK', [('content-type', 'text/plain')])
+    return [b'this is a test']
+
+def image_app(environ, start_response):
+    start_response('200 OK', [('content-type', 'image/png')])
+    return [body]
+
+def chunked_app(environ, start_response):
+    write = start_response('200 OK', [('content-type', 'text/html')])
+    write(body[:10])
+    return iter([body[10:100], body[100:]])
 
-wsgi_app = middleware(simple_app)
-app = TestApp(wsgi_app)
+def lazy_app(environ, start_response):
+    # A generator only calls start_response once it is iterated
+    start_response('200 OK', [('content-type', environ['test.type'])])
+    yield body[:100]
+    yield body[100:]
+
+def writing_app(environ, start_response):
+    write = start_response('200 OK', [('content-type', environ['test.type'])])
+    def app_iter():
+        write(body[:10])
+        yield body[10:100]
+        write(body[100:200])
+        write(body[200:300])
+        yield body[300:400]
+        write(body[400:])
+    return app_iter()
+
+def call(app, accept_gzip=True, **extra_environ):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    if accept_gzip:
+        environ['HTTP_ACCEPT_ENCODING'] = 'gzip'
+    environ.update(extra_environ)
+    response = []
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+    app_iter = app(environ, start_response)
+    try:
+        output = b''.join(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    headers = dict([(name.lower(), value) for name, value in response[1]])
+    return response[0], headers, output
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
 
 def test_gzip():
-    res = app.get(
-        '/', extra_environ=dict(HTTP_ACCEPT_ENCODING='gzip'))
-    assert int(res.header('content-length')) == len(res.body)
-    assert res.body != 'this is a test'
-    actual = gzip.GzipFile(fileobj=io.StringIO(res.body)).read()
-    assert actual == 'this is a test'
+    status, headers, output = call(middleware(simple_app))
+    assert headers['content-encoding'] == 'gzip'
+    assert headers['vary'] == 'Accept-Encoding'
+    assert output != body
+    assert gunzip(output) == body
+
+def test_no_gzip():
+    status, headers, output = call(middleware(simple_app), accept_gzip=False)
+    assert output == body
+    assert headers['vary'] == 'Accept-Encoding'
+    assert 'content-encoding' not in headers
+
+def test_streaming():
+    status, headers, output = call(middleware(chunked_app))
+    assert headers['content-encoding'] == 'gzip'
+    assert gunzip(output) == body
+
+def test_min_size():
+    status, headers, output = call(middleware(small_app))
+    assert output == b'this is a test'
+    assert int(headers['content-length']) == len(output)
+
+def test_content_types():
+    status, headers, output = call(middleware(image_app))
+    assert output == body
+    status, headers, output = call(
+        middleware(image_app, compress_types=['image/*']))
+    assert headers['content-encoding'] == 'gzip'
+
+def test_lazy_start_response():
+    status, headers, output = call(middleware(lazy_app),
+                                   **{'test.type': 'text/plain'})
+    assert status == '200 OK'
+    assert headers['content-encoding'] == 'gzip'
+    assert gunzip(output) == body
+    status, headers, output = call(middleware(lazy_app),
+                                   **{'test.type': 'image/png'})
+    assert 'content-encoding' not in headers
+    assert output == body
+
+def test_no_start_response():
+    def bad_app(environ, start_response):
+        return [body]
+    try:
+        call(middleware(bad_app))
+    except AssertionError as e:
+        assert 'start_response' in str(e)
+    else:
+        assert 0, "No error for an application without start_response"
+
+def test_write_while_iterating():
+    status, headers, output = call(middleware(writing_app),
+                                   **{'test.type': 'text/plain'})
+    assert headers['content-encoding'] == 'gzip'
+    assert gunzip(output) == body
+    status, headers, output = call(middleware(writing_app),
+                                   **{'test.type': 'image/png'})
+    assert 'content-encoding' not in headers
+    assert output == body
+
+def test_head():
+    def head_app(environ, start_response):
+        start_response('200 OK', [('content-type', 'text/html'),
+                                  ('content-length', '5000')])
+        return []
+    status, headers, output = call(middleware(head_app),
+                                   REQUEST_METHOD='HEAD')
+    assert headers['content-length'] == '5000'
+    assert 'content-encoding' not in headers
+    assert headers['vary'] == 'Accept-Encoding'
+    assert output == b''
+
+def test_content_length_kept():
+    def not_modified_app(environ, start_response):
+        start_response('304 Not Modified', [('content-type', 'text/html')])
+        return []
+    status, headers, output = call(middleware(not_modified_app))
+    assert 'content-length' not in headers
+    def sized_app(environ, start_response):
+        start_response('200 OK', [('content-type', 'text/html'),
+                                  ('content-length', '14')])
+        return [b'this is a test']
+    status, headers, output = call(middleware(sized_app))
+    assert list(headers) == ['content-type', 'content-length', 'vary']
+    assert headers['content-length'] == '14'
+
+def test_flush():
+    def streaming_app(environ, start_response):
+        start_response('200 OK', [('content-type', 'text/plain')])
+        for pos in range(0, len(body), 100):
+            yield body[pos:pos+100]
+    # Each chunk can be decompressed as soon as it is sent; the first
+    # holds what was needed to reach min_size
+    app_iter = middleware(streaming_app)(
+        {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'},
+        lambda status, headers, exc_info=None: None)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    sizes = []
+    output = b''
+    for chunk in app_iter:
+        output += decompressor.decompress(chunk)
+        sizes.append(len(output))
+    assert output == body
+    assert sizes == list(range(200, len(body) + 1, 100)) + [len(body)]
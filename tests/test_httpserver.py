@@ -0,0 +1,411 @@
+import io
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from paste import httpserver
+
+def setup_module(module):
+    module.tmpdir = tempfile.mkdtemp()
+
+def teardown_module(module):
+    shutil.rmtree(module.tmpdir)
+
+class Handler(httpserver.WSGIHandler):
+    protocol_version = 'HTTP/1.1'
+
+def echo_app(environ, start_response):
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    body = environ['PATH_INFO'].encode('ascii')
+    if length:
+        body += environ['wsgi.input'].read(length)
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+def start_server(app, server_class=httpserver.WSGIEventLoopServer,
+                 **kwargs):
+    server = server_class(app, ('127.0.0.1', 0), Handler,
+                          daemon_threads=True, request_queue_size=5,
+                          **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, thread
+
+def stop_server(server, thread):
+    server.server_close()
+    thread.join(5)
+    assert not thread.is_alive()
+
+def connect(server):
+    sock = socket.create_connection(server.server_address[:2])
+    sock.settimeout(5)
+    return sock, sock.makefile('rb')
+
+def read_response(f):
+    """
+    Reads one response, returning (status, headers, body); headers
+    are a dict with lower-case names.
+    """
+    status = f.readline().decode('ascii').split(None, 1)[1].strip()
+    headers = {}
+    while True:
+        line = f.readline().decode('ascii')
+        if line in ('\r\n', ''):
+            break
+        name, value = line.split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        body = f.read(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        body = b''
+        while True:
+            size = int(f.readline(), 16)
+            chunk = f.read(size + 2)
+            if not size:
+                break
+            body += chunk[:-2]
+    else:
+        body = f.read()
+    return status, headers, body
+
+def test_pipelining():
+    server, thread = start_server(echo_app)
+    try:
+        sock, f = connect(server)
+        sock.sendall(b'GET /a HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                     b'GET /b HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                     b'GET /c HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        for path in [b'/a', b'/b', b'/c']:
+            status, headers, body = read_response(f)
+            assert status == '200 OK'
+            assert body == path
+        sock.close()
+    finally:
+        stop_server(server, thread)
+
+def test_keepalive():
+    server, thread = start_server(echo_app)
+    try:
+        sock, f = connect(server)
+        for path in [b'/first', b'/second']:
+            sock.sendall(b'GET ' + path + b' HTTP/1.1\r\n'
+                         b'Host: localhost\r\n\r\n')
+            status, headers, body = read_response(f)
+            assert body == path
+            # The connection is back in the event loop between requests
+            time.sleep(0.2)
+            assert len(server.connections) == 1
+            assert not server.thread_pool.worker_tracker
+        sock.close()
+    finally:
+        stop_server(server, thread)
+
+def test_post_then_pipelined_get():
+    server, thread = start_server(echo_app)
+    try:
+        sock, f = connect(server)
+        sock.sendall(b'POST /post HTTP/1.1\r\nHost: localhost\r\n'
+                     b'Content-Length: 5\r\n\r\nhello'
+                     b'GET /get HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        status, headers, body = read_response(f)
+        assert body == b'/posthello'
+        status, headers, body = read_response(f)
+        assert body == b'/get'
+        sock.close()
+    finally:
+        stop_server(server, thread)
+
+def test_idle_timeout():
+    server, thread = start_server(echo_app, keepalive_timeout=1)
+    try:
+        sock, f = connect(server)
+        sock.sendall(b'GET /a HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        assert read_response(f)[2] == b'/a'
+        assert f.read() == b''
+        assert not server.connections
+        sock.close()
+    finally:
+        stop_server(server, thread)
+
+def unsized_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'hello', b'', b' world']
+
+def test_chunked():
+    server, thread = start_server(unsized_app)
+    try:
+        sock, f = connect(server)
+        for i in range(2):
+            sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            status, headers, body = read_response(f)
+            assert headers['transfer-encoding'] == 'chunked'
+            assert 'connection' not in headers
+            assert body == b'hello world'
+        sock.close()
+    finally:
+        stop_server(server, thread)
+
+def test_http10_close():
+    server, thread = start_server(
+        unsized_app, server_class=httpserver.WSGIThreadPoolServer)
+    try:
+        sock, f = connect(server)
+        sock.sendall(b'GET / HTTP/1.0\r\n\r\n')
+        status, headers, body = read_response(f)
+        assert 'transfer-encoding' not in headers
+        assert headers['connection'] == 'close'
+        # The body ends when the connection is closed
+        assert body == b'hello world'
+        sock.close()
+    finally:
+        stop_server(server, thread)
+
+def error_app(environ, start_response):
+    raise ValueError('application error')
+
+def test_error():
+    server, thread = start_server(error_app)
+    # The traceback goes to handle_error; keep the output quiet
+    server.handle_error = lambda request, client_address: None
+    try:
+        sock, f = connect(server)
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        status, headers, body = read_response(f)
+        assert status == '500 Internal Server Error'
+        assert body == b'Internal Server Error\n'
+        sock.close()
+    finally:
+        stop_server(server, thread)
+
+class ReadCountingFile(io.FileIO):
+
+    reads = 0
+
+    def read(self, *args):
+        self.reads += 1
+        return io.FileIO.read(self, *args)
+
+def test_sendfile_offset():
+    data = b''.join([b'%05i\n' % i for i in range(20000)])
+    filename = os.path.join(tmpdir, 'sendfile.txt')
+    f = open(filename, 'wb')
+    f.write(data)
+    f.close()
+    files = []
+    def file_app(environ, start_response):
+        f = ReadCountingFile(filename)
+        files.append(f)
+        f.seek(1000)
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', str(len(data) - 1000))])
+        return environ['wsgi.file_wrapper'](f)
+    server, thread = start_server(file_app)
+    try:
+        sock, f = connect(server)
+        for i in range(2):
+            sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            status, headers, body = read_response(f)
+            assert body == data[1000:]
+        sock.close()
+    finally:
+        stop_server(server, thread)
+    # The file was sent with sendfile, not read, and closed afterwards
+    for f in files:
+        assert not f.reads
+        assert f.closed
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            return False
+        time.sleep(0.05)
+    return True
+
+def test_autoscaling():
+    pool = httpserver.ThreadPool(
+        1, daemon=True, spawn_if_under=0, min_workers=1, max_workers=3,
+        scale_queue_depth=1, scale_idle_time=0.5)
+    release = threading.Event()
+    try:
+        assert wait_for(lambda: len(pool.workers) == 1)
+        for i in range(5):
+            pool.add_task(release.wait)
+            time.sleep(0.05)
+        assert wait_for(lambda: len(pool.workers) == 3)
+        # Never past max_workers:
+        pool.add_task(release.wait)
+        time.sleep(0.2)
+        assert len(pool.workers) == 3
+        release.set()
+        assert wait_for(lambda: len(pool.workers) == 1)
+        assert wait_for(lambda: pool.queue.qsize() == 0)
+        actions = [event['action']
+                   for event in pool.track_threads()['scaling']]
+        assert actions == ['grow', 'grow', 'shrink', 'shrink']
+    finally:
+        release.set()
+        pool.shutdown()
+
+def test_reject_autoscaling():
+    pool = httpserver.ThreadPool(
+        1, daemon=True, spawn_if_under=0, min_workers=1, max_workers=2,
+        scale_queue_depth=100, max_queue=1)
+    release = threading.Event()
+    rejected = []
+    try:
+        assert wait_for(lambda: len(pool.workers) == 1)
+        pool.add_task(release.wait, lambda: rejected.append(1))
+        assert wait_for(lambda: not pool.idle_workers)
+        pool.add_task(release.wait, lambda: rejected.append(2))
+        # The queue is full, so a worker is added instead of rejecting
+        pool.add_task(release.wait, lambda: rejected.append(3))
+        assert not rejected
+        assert wait_for(lambda: len(pool.workers) == 2)
+        # The new worker takes one of the two waiting tasks
+        assert wait_for(lambda: pool.queue.qsize() == 1)
+        # At max_workers with a full queue, tasks are rejected
+        pool.add_task(release.wait, lambda: rejected.append(4))
+        assert rejected == [4]
+        assert len(pool.workers) == 2
+    finally:
+        release.set()
+        pool.shutdown()
+
+def test_reject():
+    entered = threading.Event()
+    release = threading.Event()
+    def slow_app(environ, start_response):
+        entered.set()
+        release.wait()
+        return echo_app(environ, start_response)
+    server, thread = start_server(
+        slow_app, server_class=httpserver.WSGIThreadPoolServer,
+        nworkers=1, threadpool_options=dict(spawn_if_under=0, max_queue=1))
+    server.retry_after = 7
+    try:
+        sock1, f1 = connect(server)
+        sock1.sendall(b'GET /1 HTTP/1.0\r\n\r\n')
+        assert entered.wait(5)
+        # This one waits in the queue...
+        sock2, f2 = connect(server)
+        sock2.sendall(b'GET /2 HTTP/1.0\r\n\r\n')
+        assert wait_for(lambda: server.thread_pool.queue.qsize() == 1)
+        # ...and there is no room for this one
+        sock3, f3 = connect(server)
+        status, headers, body = read_response(f3)
+        assert status == '503 Service Unavailable'
+        assert headers['retry-after'] == '7'
+        assert f3.read() == b''
+        release.set()
+        assert read_response(f1)[2] == b'/1'
+        assert read_response(f2)[2] == b'/2'
+        assert server.thread_pool.rejected_tasks == 1
+        # Rejecting doesn't block, even if the client doesn't read
+        client, request = socket.socketpair()
+        request.setblocking(0)
+        try:
+            while True:
+                request.send(b'x' * 65536)
+        except BlockingIOError:
+            pass
+        start = time.time()
+        server.reject_request(request, None)
+        assert time.time() - start < 0.5
+        for sock in [sock1, sock2, sock3, client]:
+            sock.close()
+    finally:
+        release.set()
+        stop_server(server, thread)
+
+prefork_script = """
+import os
+import sys
+from paste import httpserver
+
+def pid_app(environ, start_response):
+    body = str(os.getpid()).encode('ascii')
+    start_response('200 OK', [('Content-Length', str(len(body)))])
+    return [body]
+
+def make_server(listen_socket):
+    return httpserver.WSGIThreadPoolServer(
+        pid_app, listen_socket.getsockname(), httpserver.WSGIHandler,
+        listen_socket=listen_socket)
+
+sock = httpserver._make_listen_socket(('127.0.0.1', 0))
+print(sock.getsockname()[1])
+sys.stdout.flush()
+httpserver.PreforkServer(make_server, sock, 1,
+                         shutdown_timeout=5).serve_forever()
+"""
+
+def test_listen_socket_family():
+    sock = httpserver._make_listen_socket(('', 0))
+    assert sock.family == socket.AF_INET
+    sock.close()
+    try:
+        probe = socket.socket(socket.AF_INET6)
+        try:
+            probe.bind(('::1', 0))
+        finally:
+            probe.close()
+    except (AttributeError, socket.error):
+        # No IPv6 loopback here
+        return
+    sock = httpserver._make_listen_socket(('::1', 0))
+    assert sock.family == socket.AF_INET6
+    server, thread = start_server(echo_app, listen_socket=sock)
+    try:
+        client, f = connect(server)
+        client.sendall(b'GET /ipv6 HTTP/1.0\r\n\r\n')
+        assert read_response(f)[2] == b'/ipv6'
+        client.close()
+    finally:
+        stop_server(server, thread)
+
+def get_pid(port):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.settimeout(5)
+    f = sock.makefile('rb')
+    sock.sendall(b'GET / HTTP/1.0\r\n\r\n')
+    status, headers, body = read_response(f)
+    f.close()
+    sock.close()
+    return int(body)
+
+def test_prefork():
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+        os.path.abspath(httpserver.__file__)))
+    proc = subprocess.Popen([sys.executable, '-c', prefork_script],
+                            stdout=subprocess.PIPE, env=env)
+    try:
+        port = int(proc.stdout.readline())
+        worker = get_pid(port)
+        assert worker != proc.pid
+        # A dead worker is replaced
+        os.kill(worker, signal.SIGKILL)
+        assert wait_for(lambda: get_pid(port) != worker)
+        worker = get_pid(port)
+        # SIGTERM stops the workers, then the supervisor
+        proc.send_signal(signal.SIGTERM)
+        assert proc.wait(15) == 0
+        try:
+            os.kill(worker, 0)
+        except ProcessLookupError:
+            pass
+        else:
+            assert 0, "Worker %s is still running" % worker
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
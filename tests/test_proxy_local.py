@@ -0,0 +1,251 @@
+"""
+Tests of paste.proxy against a local upstream server.
+"""
+
+import http.client
+import http.server
+import io
+import threading
+from paste import proxy
+
+class UpstreamHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        http.server.BaseHTTPRequestHandler.setup(self)
+        # Requests answered on this connection:
+        self.answered = 0
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline(), 16)
+                chunk = self.rfile.read(size + 2)
+                if not size:
+                    return body
+                body += chunk[:-2]
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def handle_request(self):
+        body = self.read_body()
+        self.server.requests.append(
+            (self.client_address, self.command, self.path,
+             self.headers, body))
+        if self.answered and self.server.drop_reused:
+            # Hang up instead of answering, as a server closing an idle
+            # connection just as a request arrives would
+            self.close_connection = True
+            return
+        self.answered += 1
+        if self.path == '/large':
+            self.send_large()
+            return
+        if self.path == '/slow':
+            self.send_slow()
+            return
+        body = ('%s %s ' % (self.command, self.path)).encode('ascii') + body
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_large(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(large_body)))
+        self.end_headers()
+        self.wfile.write(large_body)
+
+    def send_slow(self):
+        # The first chunk is sent right away, the rest only when the
+        # test says so
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.wfile.write(b'5\r\nfirst\r\n')
+        self.wfile.flush()
+        self.server.release.wait(5)
+        self.wfile.write(b'6\r\nsecond\r\n0\r\n\r\n')
+
+    do_GET = do_POST = do_PUT = handle_request
+
+large_body = b''.join([b'%07i\n' % i for i in range(100000)])
+
+def setup_module(module):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                             UpstreamHandler)
+    module.server = server
+    module.host = '127.0.0.1:%s' % server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+def teardown_module(module):
+    module.server.shutdown()
+    module.server.server_close()
+
+def setup_function(function):
+    server.requests = []
+    server.drop_reused = False
+    server.release = threading.Event()
+
+def call(app, method, path, body=None, headers=None):
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'SERVER_NAME': '127.0.0.1',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': host,
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body or b''),
+        }
+    if body is not None:
+        environ['CONTENT_LENGTH'] = str(len(body))
+    environ.update(headers or {})
+    response = []
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+    app_iter = app(environ, start_response)
+    try:
+        body = b''.join(app_iter)
+    finally:
+        app_iter.close()
+    return response[0], response[1], body
+
+def client_ports():
+    return [client_address[1]
+            for client_address, method, path, headers, body
+            in server.requests]
+
+def test_reuse():
+    pool = proxy.ConnectionPool()
+    app = proxy.Proxy('http://%s/base/' % host, connection_pool=pool)
+    for i in range(3):
+        status, headers, body = call(app, 'GET', '/path')
+        assert status == '200 OK'
+        assert ('Content-Type', 'text/plain') in headers
+        assert body == b'GET /base/path '
+    # All three went over the same connection
+    assert len(set(client_ports())) == 1
+    assert len(pool.idle[('http', host)]) == 1
+    pool.clear()
+    assert not pool.idle
+
+def test_transparent_reuse():
+    pool = proxy.ConnectionPool()
+    app = proxy.TransparentProxy(connection_pool=pool)
+    for i in range(2):
+        status, headers, body = call(app, 'GET', '/path',
+                                     headers={'HTTP_CONNECTION': 'close'})
+        assert body == b'GET /path '
+    # The client's Connection header is not passed on
+    assert len(set(client_ports())) == 1
+    for address, method, path, headers, body in server.requests:
+        assert headers['Connection'] is None
+    pool.clear()
+
+def test_retry():
+    pool = proxy.ConnectionPool()
+    app = proxy.Proxy('http://%s/' % host, connection_pool=pool)
+    call(app, 'GET', '/first')
+    server.drop_reused = True
+    # paste.httpserver gives a CONTENT_LENGTH of 0 for a GET
+    status, headers, body = call(app, 'GET', '/second', body=b'')
+    assert body == b'GET /second '
+    # The request was sent on the pooled connection, which broke, then
+    # again on a new one
+    paths = [path for address, method, path, headers, body
+             in server.requests]
+    assert paths == ['/first', '/second', '/second']
+    ports = client_ports()
+    assert ports[0] == ports[1] != ports[2]
+    pool.clear()
+
+def test_no_retry():
+    pool = proxy.ConnectionPool()
+    call(proxy.Proxy('http://%s/' % host, connection_pool=pool),
+         'GET', '/first')
+    server.drop_reused = True
+    # The server may have acted on a request it didn't answer, so it
+    # isn't sent again
+    try:
+        pool.request('http', host, 'POST', '/post', b'data',
+                     {'content-length': '4'})
+    except http.client.RemoteDisconnected:
+        pass
+    else:
+        assert 0, "The request should have failed"
+    assert [method for address, method, path, headers, body
+            in server.requests] == ['GET', 'POST']
+    pool.clear()
+
+class ShortReads(object):
+    """
+    A wsgi.input that returns a little at a time, as a socket would
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        size = min(size, 1000)
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+def test_chunked_request():
+    pool = proxy.ConnectionPool()
+    app = proxy.Proxy('http://%s/' % host, connection_pool=pool)
+    data = large_body[:200000]
+    status, headers, body = call(
+        app, 'POST', '/upload',
+        headers={'CONTENT_LENGTH': '-1', 'wsgi.input': ShortReads(data)})
+    assert body == b'POST /upload ' + data
+    address, method, path, headers, body = server.requests[0]
+    assert headers['Transfer-Encoding'] == 'chunked'
+    assert headers['Content-Length'] is None
+    assert body == data
+    pool.clear()
+
+def get(app, path):
+    return app({'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+                'wsgi.input': io.BytesIO()},
+               lambda status, headers, exc_info=None: None)
+
+def test_large_response():
+    pool = proxy.ConnectionPool()
+    app = proxy.Proxy('http://%s/' % host, connection_pool=pool)
+    app_iter = get(app, '/large')
+    blocks = list(app_iter)
+    app_iter.close()
+    assert b''.join(blocks) == large_body
+    # The body was passed on in blocks, not read whole
+    assert len(blocks) > 1
+    assert max(map(len, blocks)) <= proxy.BLOCK_SIZE
+    assert len(pool.idle[('http', host)]) == 1
+    # A client that goes away before the end doesn't return a half
+    # read connection to the pool
+    app_iter = get(app, '/large')
+    next(app_iter)
+    app_iter.close()
+    assert not pool.idle[('http', host)]
+    pool.clear()
+
+def test_streaming():
+    pool = proxy.ConnectionPool()
+    app = proxy.Proxy('http://%s/' % host, connection_pool=pool)
+    app_iter = get(app, '/slow')
+    try:
+        # The first chunk is passed on before the upstream response
+        # is finished
+        assert next(app_iter) == b'first'
+        server.release.set()
+        assert b''.join(app_iter) == b'second'
+    finally:
+        app_iter.close()
+    pool.clear()
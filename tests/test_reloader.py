@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import types
+from paste import reloader
+
+def setup_module(module):
+    module.tmpdir = tempfile.mkdtemp()
+
+def teardown_module(module):
+    shutil.rmtree(module.tmpdir)
+
+def write(name, content, mtime=None):
+    filename = os.path.join(tmpdir, name)
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    f = open(filename, 'w')
+    f.write(content)
+    f.close()
+    if mtime is not None:
+        os.utime(filename, (mtime, mtime))
+    return filename
+
+def make_inotify_monitor():
+    mon = reloader.InotifyMonitor(poll_interval=0)
+    reloader.Monitor.instances.remove(mon)
+    return mon
+
+def test_poll():
+    filename = write('poll/test.ini', 'x')
+    mon = reloader.Monitor(poll_interval=0)
+    reloader.Monitor.instances.remove(mon)
+    mon.extra_files.append(filename)
+    assert mon.check_reload()
+    assert mon.check_reload()
+    later = time.time() + 10
+    os.utime(filename, (later, later))
+    assert not mon.check_reload()
+
+def test_inotify():
+    if reloader._inotify() is None:
+        return
+    filename = write('inotify/test.ini', 'x')
+    mon = make_inotify_monitor()
+    try:
+        mon.extra_files.append(filename)
+        assert mon.check_reload()
+        assert os.path.dirname(filename) in mon.watches
+        assert not mon.unwatched
+        # Changing only the permissions isn't a change
+        os.chmod(filename, 0o600)
+        assert mon.check_reload()
+        # Editors often write a new file and rename it over the old one
+        write('inotify/test.ini.new', 'y', mtime=time.time() + 10)
+        os.rename(filename + '.new', filename)
+        assert not mon.check_reload()
+    finally:
+        mon.close()
+    assert mon.fd is None
+
+def test_inotify_new_modules():
+    if reloader._inotify() is None:
+        return
+    mon = make_inotify_monitor()
+    try:
+        assert mon.check_reload()
+        walks = []
+        find_files = mon.find_files
+        def counting_find_files(modules=True):
+            walks.append(modules)
+            return find_files(modules)
+        mon.find_files = counting_find_files
+        # Nothing was imported, so sys.modules isn't looked through
+        assert mon.check_reload()
+        assert walks == [False]
+        filename = write('modules/new_module.py', 'x = 1\n')
+        module = types.ModuleType('paste_test_new_module')
+        module.__file__ = filename
+        sys.modules[module.__name__] = module
+        try:
+            assert mon.check_reload()
+            assert walks == [False, True]
+            assert filename in mon.module_mtimes
+            write('modules/new_module.py', 'x = 2\n', mtime=time.time() + 10)
+            assert not mon.check_reload()
+        finally:
+            del sys.modules[module.__name__]
+    finally:
+        mon.close()
+
+def test_inotify_replaced_module():
+    if reloader._inotify() is None:
+        return
+    mon = make_inotify_monitor()
+    mon.module_rescan = 3
+    name = 'paste_test_replaced_module'
+    sys.modules[name] = types.ModuleType(name)
+    try:
+        assert mon.check_reload()
+        # Replaced under the same name, so there are as many modules
+        filename = write('replaced_module/replaced.py', 'x = 1\n')
+        module = types.ModuleType(name)
+        module.__file__ = filename
+        sys.modules[name] = module
+        assert mon.check_reload()
+        assert filename not in mon.module_mtimes
+        # ...but it's found by the next full look
+        assert mon.check_reload()
+        assert mon.check_reload()
+        assert filename in mon.module_mtimes
+    finally:
+        del sys.modules[name]
+        mon.close()
+
+def test_inotify_directory_removed():
+    if reloader._inotify() is None:
+        return
+    filename = write('removed/sub/test.ini', 'x')
+    directory = os.path.dirname(filename)
+    mon = make_inotify_monitor()
+    try:
+        mon.extra_files.append(filename)
+        assert mon.check_reload()
+        assert mon.watches[directory] is not None
+        shutil.rmtree(directory)
+        # The file is gone, which isn't a change (yet)
+        assert mon.check_reload()
+        assert filename in mon.unwatched
+        write('removed/sub/test.ini', 'y', mtime=time.time() + 10)
+        assert not mon.check_reload()
+    finally:
+        mon.close()
+
+def test_inotify_directory_replaced():
+    if reloader._inotify() is None:
+        return
+    filename = write('replaced/sub/test.ini', 'x')
+    directory = os.path.dirname(filename)
+    mon = make_inotify_monitor()
+    try:
+        mon.extra_files.append(filename)
+        assert mon.check_reload()
+        # The directory is replaced by renaming (by a copy of the file
+        # that looks the same)
+        write('replaced/new/test.ini', 'x', mtime=os.stat(filename).st_mtime)
+        os.rename(directory, directory + '.old')
+        os.rename(os.path.join(tmpdir, 'replaced', 'new'), directory)
+        assert mon.check_reload()
+        # The new directory is watched
+        assert mon.watches[directory] is not None
+        assert not mon.unwatched
+        write('replaced/sub/test.ini', 'y', mtime=time.time() + 10)
+        assert not mon.check_reload()
+    finally:
+        mon.close()
@@ -1,7 +1,10 @@
-import cgi
-from io import StringIO
+import os
+import subprocess
+import sys
+from io import StringIO, BytesIO
+import paste
 from paste.request import *
-from paste.util.multidict import MultiDict
+from paste.util.multidict import MultiDict, UnicodeMultiDict
 
 def test_parse_querystring():
     e = {'QUERY_STRING': 'a=1&b=2&c=3&b=4'}
@@ -34,3 +37,101 @@ def test_parsevars():
     #assert e['wsgi.input'] is not cur_input
     #cur_input.seek(0)
     #assert e['wsgi.input'].read() == cur_input.read()
+
+def test_parse_urlencoded():
+    d = parse_urlencoded('a=1&b=x+y&a=%C3%A9&&c&d=%2B%zz')
+    assert isinstance(d, MultiDict)
+    assert list(d.items()) == [
+        ('a', '1'), ('b', 'x y'), ('a', '\xe9'), ('c', ''), ('d', '+%zz')]
+    assert list(parse_urlencoded(b'x=%41').items()) == [('x', 'A')]
+
+def test_form_limits():
+    from paste.httpexceptions import HTTPRequestEntityTooLarge
+    e = make_post('a=1&b=2&c=3&b=4')
+    try:
+        parse_formvars(e, max_fields=3)
+    except HTTPRequestEntityTooLarge:
+        pass
+    else:
+        assert 0, "max_fields not enforced"
+    e = make_post('a=1&b=2&c=3&b=4')
+    try:
+        parse_formvars(e, max_size=10)
+    except HTTPRequestEntityTooLarge:
+        pass
+    else:
+        assert 0, "max_size not enforced"
+    d = parse_formvars(make_post('a=1&b=2&c=3&b=4'), max_fields=4,
+                       max_size=15)
+    assert d.getall('b') == ['2', '4']
+
+def make_multipart(parts, boundary='----paste-test'):
+    body = []
+    for name, filename, data in parts:
+        body.append('--%s\r\n' % boundary)
+        disposition = 'form-data; name="%s"' % name
+        if filename:
+            disposition += '; filename="%s"' % filename
+        body.append('Content-Disposition: %s\r\n\r\n%s\r\n'
+                    % (disposition, data))
+    body.append('--%s--\r\n' % boundary)
+    body = ''.join(body).encode('utf8')
+    return {
+        'CONTENT_TYPE': 'multipart/form-data; boundary=%s' % boundary,
+        'CONTENT_LENGTH': str(len(body)),
+        'REQUEST_METHOD': 'POST',
+        'wsgi.input': BytesIO(body),
+        }
+
+def test_multipart():
+    from paste import request
+    e = make_multipart([('a', None, '1'), ('f', 'test.txt', 'x' * 1000),
+                        ('a', None, 'two\r\nlines')])
+    old_block_size = request.upload_block_size
+    request.upload_block_size = 7
+    try:
+        d = parse_formvars(e)
+    finally:
+        request.upload_block_size = old_block_size
+    assert d.getall('a') == ['1', 'two\r\nlines']
+    upload = d['f']
+    assert isinstance(upload, UploadedFile)
+    assert upload.filename == 'test.txt'
+    assert upload.value == b'x' * 1000
+    assert upload.file.read() == b'x' * 1000
+
+def test_multipart_limits():
+    from paste.httpexceptions import HTTPRequestEntityTooLarge
+    e = make_multipart([('f', 'test.txt', 'x' * 1000)])
+    try:
+        parse_formvars(e, max_size=500)
+    except HTTPRequestEntityTooLarge:
+        pass
+    else:
+        assert 0, "max_size not enforced"
+    e = make_multipart([('f', 'test.txt', 'x' * 1000)])
+    input = e['wsgi.input']
+    try:
+        parse_multipart(input, '----paste-test', max_part_size=500)
+    except HTTPRequestEntityTooLarge:
+        pass
+    else:
+        assert 0, "max_part_size not enforced"
+
+def test_unicode_upload():
+    e = make_multipart([('f', 'test.txt', 'data')])
+    d = UnicodeMultiDict(parse_formvars(e), encoding='utf8')
+    upload = d['f']
+    assert isinstance(upload, UploadedFile)
+    assert upload.name == 'f'
+    assert upload.filename == 'test.txt'
+
+def test_no_cgi():
+    # The cgi module is gone in Python 3.13
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+        os.path.abspath(paste.__file__)))
+    subprocess.check_call(
+        [sys.executable, '-c',
+         'import sys; sys.modules["cgi"] = None; import paste.request'],
+        env=env)
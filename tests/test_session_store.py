@@ -0,0 +1,97 @@
+"""
+Tests of the stores paste.session keeps sessions in.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from paste.session import StoreSession, FileStore, MemoryStore, SQLiteStore
+
+def setup_module(module):
+    module.tmpdir = tempfile.mkdtemp()
+
+def teardown_module(module):
+    shutil.rmtree(module.tmpdir)
+
+def make_dir(name):
+    path = os.path.join(tmpdir, name)
+    os.mkdir(path)
+    return path
+
+def _check_store(store):
+    session = StoreSession('sid1', create=True, store=store)
+    session.data()['info'] = 'stored'
+    session.close()
+    session = StoreSession('sid1', store=store)
+    assert session.data() == {'info': 'stored'}
+    saved = []
+    store.save = lambda sid, data: saved.append(sid)
+    try:
+        # Unchanged sessions aren't saved again
+        session.close()
+        assert not saved
+        session.data()['other'] = 1
+        session.close()
+        assert saved == ['sid1']
+    finally:
+        del store.save
+    session = StoreSession('sid1', store=store)
+    session.data().clear()
+    session.close()
+    try:
+        StoreSession('sid1', store=store)
+    except KeyError:
+        pass
+    else:
+        assert 0, "Session should have been deleted"
+
+def test_stores():
+    path = make_dir('stores')
+    _check_store(FileStore(path))
+    assert os.listdir(path) == [FileStore.index_dir]
+    _check_store(MemoryStore())
+    _check_store(SQLiteStore(os.path.join(path, 'sessions.db')))
+    # Session ids from cookies can't name other files
+    assert FileStore(path).load('../passwd') is None
+
+def test_file_store_expiry():
+    path = make_dir('expiry')
+    store = FileStore(path, expiration=60, touch_interval=60)
+    for sid in ('old', 'used', 'new'):
+        store.save(sid, b'data')
+    # Pretend 'old' and 'used' were last used 90 minutes ago
+    long_ago = time.time() - 90*60
+    for sid in ('old', 'used'):
+        os.utime(store.filename(sid), (long_ago, long_ago))
+        store._index(sid, long_ago)
+    assert store.load('old') is None
+    store.save('used', b'more data')
+    store._clean_up()
+    assert sorted(os.listdir(path)) == [
+        store.index_dir, 'new', 'used']
+    assert store.load('used') == b'more data'
+
+def test_file_store_intervals():
+    path = make_dir('intervals')
+    hourly = FileStore(path, expiration=120, touch_interval=3600)
+    minutely = FileStore(path, expiration=120, touch_interval=60)
+    hourly.save('hourly', b'data')
+    minutely.save('minutely', b'data')
+    now = time.time()
+    # The stores keep separate indexes: the hourly store's index file,
+    # read as a period of a minute, would have expired long ago
+    assert hourly.index_path != minutely.index_path
+    minutely._clean_up()
+    hourly._clean_up()
+    assert str(hourly._period(now)) in os.listdir(hourly.index_path)
+    assert str(minutely._period(now)) in os.listdir(minutely.index_path)
+    assert sorted(os.listdir(path)) == [
+        FileStore.index_dir, 'hourly', 'minutely']
+    # Expired sessions are still deleted
+    long_ago = now - 180*60
+    os.utime(hourly.filename('hourly'), (long_ago, long_ago))
+    hourly._index('hourly', long_ago)
+    minutely._clean_up()
+    hourly._clean_up()
+    assert sorted(os.listdir(path)) == [FileStore.index_dir, 'minutely']
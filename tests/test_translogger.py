@@ -0,0 +1,112 @@
+import logging
+import sys
+import threading
+from paste.translogger import TransLogger
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+def simple_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', '5')])
+    return [b'hello']
+
+def make_logger(name):
+    logger = logging.getLogger('test_translogger.' + name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    return logger, handler
+
+def call(app, path):
+    environ = {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+               'PATH_INFO': path, 'SERVER_PROTOCOL': 'HTTP/1.0',
+               'REMOTE_ADDR': '127.0.0.1'}
+    return b''.join(app(environ,
+                        lambda status, headers, exc_info=None: None))
+
+def test_log():
+    logger, handler = make_logger('sync')
+    app = TransLogger(simple_app, logger=logger)
+    assert call(app, '/path') == b'hello'
+    assert len(handler.messages) == 1
+    message = handler.messages[0]
+    assert message.startswith('127.0.0.1 - - [')
+    assert message.endswith('] "GET /path HTTP/1.0" 200 5 "-" "-"')
+
+def test_async_log():
+    logger, handler = make_logger('async')
+    app = TransLogger(simple_app, logger=logger, async_logging=True)
+    for i in range(50):
+        call(app, '/path%s' % i)
+    app.stop_writer()
+    assert len(handler.messages) == 50
+    assert '"GET /path49 HTTP/1.0"' in handler.messages[-1]
+    assert app.dropped == 0
+
+def test_async_queue_full():
+    logger, handler = make_logger('drop')
+    app = TransLogger(simple_app, logger=logger, async_logging=True,
+                      queue_size=1)
+    # Hold up the writer so the queue fills up
+    logger.handlers[0].acquire()
+    try:
+        for i in range(20):
+            call(app, '/path%s' % i)
+    finally:
+        logger.handlers[0].release()
+    app.stop_writer()
+    assert app.dropped
+    assert len(handler.messages) + app.dropped == 20
+
+def test_async_queue_full_threads():
+    logger, handler = make_logger('drop-threads')
+    app = TransLogger(simple_app, logger=logger, async_logging=True,
+                      queue_size=1)
+    # Many threads dropping records at once don't lose counts
+    def make_requests():
+        for i in range(200):
+            call(app, '/path%s' % i)
+    threads = [threading.Thread(target=make_requests) for i in range(8)]
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    logger.handlers[0].acquire()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        logger.handlers[0].release()
+        sys.setswitchinterval(old_interval)
+    app.stop_writer()
+    assert len(handler.messages) + app.dropped == 1600
+
+def test_log_on_close():
+    logger, handler = make_logger('close')
+    def streaming_app(environ, start_response):
+        write = start_response('200 OK', [('Content-Type', 'text/plain')])
+        write(b'abc')
+        return [b'hello', b'', b'world']
+    app = TransLogger(
+        streaming_app, logger=logger, log_on_close=True,
+        format='%(status)s %(bytes)s %(ttfb_ms)s %(duration_ms)s')
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    written = []
+    app_iter = app(environ,
+                   lambda status, headers, exc_info=None: written.append)
+    assert b''.join(app_iter) == b'helloworld'
+    assert not handler.messages
+    app_iter.close()
+    status, bytes, ttfb, duration = handler.messages[0].split()
+    assert (status, bytes) == ('200', '13')
+    assert int(ttfb) <= int(duration)
+    app_iter.close()
+    assert len(handler.messages) == 1
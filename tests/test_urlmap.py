@@ -1,49 +1,90 @@
 from paste.urlmap import *
-from paste.fixture import *
 
 def make_app(response_text):
     def app(environ, start_response):
         headers = [('Content-type', 'text/html')]
         start_response('200 OK', headers)
-        return [response_text % environ]
+        return [(response_text % environ).encode('utf8')]
     return app
 
+def get(app, path, status=200, **extra_environ):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'wsgi.url_scheme': 'http',
+        }
+    environ.update(extra_environ)
+    response = []
+    def start_response(response_status, headers, exc_info=None):
+        response.append(response_status)
+    body = b''.join(app(environ, start_response)).decode('utf8')
+    assert int(response[0].split()[0]) == status, (
+        "Got %s for %s, not %s" % (response[0], path, status))
+    return body
+
 def test_map():
     mapper = URLMap({})
-    app = TestApp(mapper)
     text = '%s script_name="%%(SCRIPT_NAME)s" path_info="%%(PATH_INFO)s"'
     mapper[''] = make_app(text % 'root')
     mapper['/foo'] = make_app(text % 'foo-only')
     mapper['/foo/bar'] = make_app(text % 'foo:bar')
     mapper['/f'] = make_app(text % 'f-only')
-    res = app.get('/')
-    res.mustcontain('root')
-    res.mustcontain('script_name=""')
-    res.mustcontain('path_info="/"')
-    res = app.get('/blah')
-    res.mustcontain('root')
-    res.mustcontain('script_name=""')
-    res.mustcontain('path_info="/blah"')
-    res = app.get('/foo/and/more')
-    res.mustcontain('script_name="/foo"')
-    res.mustcontain('path_info="/and/more"')
-    res.mustcontain('foo-only')
-    res = app.get('/foo/bar/baz')
-    res.mustcontain('foo:bar')
-    res.mustcontain('script_name="/foo/bar"')
-    res.mustcontain('path_info="/baz"')
-    res = app.get('/fffzzz')
-    res.mustcontain('root')
-    res.mustcontain('path_info="/fffzzz"')
-    res = app.get('/f/z/y')
-    res.mustcontain('script_name="/f"')
-    res.mustcontain('path_info="/z/y"')
-    res.mustcontain('f-only')
+    res = get(mapper, '/')
+    assert 'root' in res
+    assert 'script_name=""' in res
+    assert 'path_info="/"' in res
+    res = get(mapper, '/blah')
+    assert 'root' in res
+    assert 'script_name=""' in res
+    assert 'path_info="/blah"' in res
+    res = get(mapper, '/foo/and/more')
+    assert 'script_name="/foo"' in res
+    assert 'path_info="/and/more"' in res
+    assert 'foo-only' in res
+    res = get(mapper, '/foo/bar/baz')
+    assert 'foo:bar' in res
+    assert 'script_name="/foo/bar"' in res
+    assert 'path_info="/baz"' in res
+    res = get(mapper, '/fffzzz')
+    assert 'root' in res
+    assert 'path_info="/fffzzz"' in res
+    res = get(mapper, '/f/z/y')
+    assert 'script_name="/f"' in res
+    assert 'path_info="/z/y"' in res
+    assert 'f-only' in res
 
 def test_404():
     mapper = URLMap({})
-    app = TestApp(mapper, extra_environ={'HTTP_ACCEPT': 'text/html'})
-    res = app.get("/-->%0D<script>alert('xss')</script>", status=404)
-    assert '--><script' not in res.body
-    res = app.get("/--%01><script>", status=404)
-    assert '--\x01><script>' not in res.body
+    res = get(mapper, "/--><script>alert('xss')</script>", status=404,
+              HTTP_ACCEPT='text/html')
+    assert '--><script' not in res
+    res = get(mapper, "/--\x01><script>", status=404,
+              HTTP_ACCEPT='text/html')
+    assert '--\x01><script>' not in res
+
+def test_domains():
+    mapper = URLMap({})
+    text = '%s script_name="%%(SCRIPT_NAME)s" path_info="%%(PATH_INFO)s"'
+    mapper['/foo'] = make_app(text % 'any-foo')
+    mapper['http://example.com/foo'] = make_app(text % 'example-foo')
+    mapper['http://example.com:8080/foo/bar'] = make_app(text % 'port-bar')
+    res = get(mapper, '/foo/bar', HTTP_HOST='other.com')
+    assert 'any-foo' in res
+    assert 'path_info="/bar"' in res
+    res = get(mapper, '/foo/bar', HTTP_HOST='example.com')
+    assert 'example-foo' in res
+    res = get(mapper, '/foo/bar/baz', HTTP_HOST='example.com:8080')
+    assert 'example-foo' in res
+    res = get(mapper, '/foo/baz', HTTP_HOST='example.com:8080')
+    assert 'example-foo' in res
+    del mapper['http://example.com/foo']
+    res = get(mapper, '/foo/bar/baz', HTTP_HOST='example.com:8080')
+    assert 'port-bar' in res
+    assert 'script_name="/foo/bar"' in res
+    res = get(mapper, '/foo', HTTP_HOST='example.com')
+    assert 'any-foo' in res
+    get(mapper, '/bar', HTTP_HOST='example.com', status=404)
@@ -0,0 +1,97 @@
+"""
+Tests of what paste.urlparser remembers about the files it serves.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+from paste.urlparser import URLParser, StaticURLParser
+
+def setup_module(module):
+    module.tmpdir = tempfile.mkdtemp()
+
+def teardown_module(module):
+    shutil.rmtree(module.tmpdir)
+
+def write(name, content):
+    filename = os.path.join(tmpdir, name)
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    f = open(filename, 'w')
+    f.write(content)
+    f.close()
+    return filename
+
+def get(app, path, status=200, **extra_environ):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+        }
+    environ.update(extra_environ)
+    response = []
+    def start_response(response_status, headers, exc_info=None):
+        response[:] = [response_status, headers]
+    app_iter = app(environ, start_response)
+    try:
+        body = b''.join(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    assert int(response[0].split()[0]) == status, (
+        "Got %s for %s, not %s" % (response[0], path, status))
+    return body, dict(response[1])
+
+def test_listing_cache():
+    root = os.path.join(tmpdir, 'listing')
+    write('listing/a.txt', 'file a')
+    app = URLParser({}, root, 'listing_cache', check_interval=0)
+    static = StaticURLParser(root, check_interval=0)
+    assert b'file a' in get(app, '/a')[0]
+    assert b'file a' in get(static, '/a.txt')[0]
+    get(app, '/b', status=404)
+    write('listing/sub/b.txt', 'file b')
+    assert b'file b' in get(app, '/sub/b')[0]
+    assert b'file b' in get(static, '/sub/b.txt')[0]
+    # The subdirectory parser is reused
+    child = static._children[static.normpath(os.path.join(root, 'sub'))]
+    get(static, '/sub/b.txt')
+    assert static._children[child.directory] is child
+    os.unlink(os.path.join(root, 'a.txt'))
+    get(app, '/a', status=404)
+    get(static, '/a.txt', status=404)
+
+def test_deleted_file():
+    root = os.path.join(tmpdir, 'deleted')
+    filename = write('deleted/a.txt', 'file a')
+    # Long enough that the file is still remembered after it's removed
+    static = StaticURLParser(root, check_interval=3600)
+    assert get(static, '/a.txt')[0] == b'file a'
+    os.unlink(filename)
+    get(static, '/a.txt', status=404)
+    assert not static._found
+    write('deleted/a.txt', 'file a again')
+    assert get(static, '/a.txt')[0] == b'file a again'
+
+def test_if_none_match():
+    root = os.path.join(tmpdir, 'etag')
+    filename = write('etag/a.txt', 'file a')
+    static = StaticURLParser(root, check_interval=3600)
+    get(static, '/a.txt')
+    mtime = str(os.stat(filename).st_mtime)
+    get(static, '/a.txt', status=304, HTTP_IF_NONE_MATCH=mtime)
+    # A change is seen even though the file was looked at recently
+    write('etag/a.txt', 'file a changed')
+    os.utime(filename, (1, 1))
+    body, headers = get(static, '/a.txt', HTTP_IF_NONE_MATCH=mtime)
+    assert body == b'file a changed'
+    os.unlink(filename)
+    get(static, '/a.txt', status=404, HTTP_IF_NONE_MATCH=mtime)
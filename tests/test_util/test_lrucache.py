@@ -0,0 +1,44 @@
+from paste.util.lrucache import LRUCache
+
+def test_entries():
+    cache = LRUCache(max_entries=3)
+    for key in 'abc':
+        cache[key] = key.upper()
+    assert cache['a'] == 'A'
+    cache['d'] = 'D'
+    # b was the least recently used:
+    assert 'b' not in cache
+    assert sorted(['a', 'c', 'd']) == sorted(k for k in 'abcd' if k in cache)
+    assert len(cache) == 3
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+    try:
+        cache['b']
+    except KeyError:
+        pass
+    else:
+        assert 0, "KeyError expected"
+    del cache['a']
+    assert len(cache) == 2
+    cache.clear()
+    assert len(cache) == 0
+
+def test_bytes():
+    cache = LRUCache(max_bytes=10)
+    assert cache.set('a', 'aaaa', 4)
+    assert cache.set('b', 'bbbb', 4)
+    assert cache.size == 8
+    assert cache.set('c', 'cccc', 4)
+    assert 'a' not in cache
+    assert cache.size == 8
+    # Too big to ever fit:
+    assert not cache.set('d', 'd' * 11, 11)
+    assert 'd' not in cache
+    assert cache.size == 8
+    # Replacing an item replaces its size
+    cache.set('b', 'bb', 2)
+    assert cache.size == 6
+    assert cache.pop('c') == 'cccc'
+    assert cache.size == 2
+    assert cache.peek('b') == 'bb'
+    assert cache.hits == 0
@@ -0,0 +1,34 @@
+from paste.util.multidict import MultiDict
+
+def test_dict_many_keys():
+    d = MultiDict()
+    for i in range(500):
+        d.add('field%s' % (i % 100), i)
+    assert len(d) == 500
+    assert d.getall('field7') == [7, 107, 207, 307, 407]
+    for i in range(0, 100, 2):
+        del d['field%s' % i]
+    assert len(d) == 250
+    assert 'field2' not in d
+    assert d['field3'] == 3
+    assert d.pop('field3') == 3
+    assert d.getall('field3') == [103, 203, 303, 403]
+    d['field1'] = 'x'
+    assert list(d.items())[:2] == [('field5', 5), ('field7', 7)]
+    assert list(d.items())[-1] == ('field1', 'x')
+    assert d.popitem() == ('field1', 'x')
+    assert 'field1' not in d
+
+def test_compaction():
+    d = MultiDict()
+    for i in range(100):
+        d.add('field%s' % (i % 10), i)
+    for i in range(6):
+        del d['field%s' % i]
+    # Deleted items are dropped once they are most of the list, and the
+    # index follows
+    assert len(d._items) == len(d) == 40
+    assert list(d.keys()) == ['field6', 'field7', 'field8', 'field9'] * 10
+    assert d.getall('field8') == list(range(8, 100, 10))
+    d.add('field0', 'new')
+    assert list(d.items())[-2:] == [('field9', 99), ('field0', 'new')]
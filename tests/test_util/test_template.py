@@ -0,0 +1,47 @@
+from paste.util.template import Template, sub
+
+def test_error_position():
+    # Errors in expressions give the position in the template, even
+    # inside blocks
+    try:
+        Template('{{if x}}\n{{y.z}}{{endif}}').substitute(x=1, y=None)
+    except AttributeError as e:
+        assert str(e) == (
+            "'NoneType' object has no attribute 'z' at line 2 column 3")
+    else:
+        assert 0, "AttributeError expected"
+    try:
+        Template('{{for i in x}}{{i + 1}}{{endfor}}', name='foo.html'
+                 ).substitute(x=[1, 'a'])
+    except TypeError as e:
+        assert str(e).endswith(' at line 1 column 17 in file foo.html'), str(e)
+    else:
+        assert 0, "TypeError expected"
+
+def test_multiline_expression():
+    assert sub('{{for i in range(2)}}{{i + (\n 1)}}{{endfor}}') == '12'
+    assert sub('{{dict(\n a=1)["a"]}}') == '1'
+
+def test_iter_substitute():
+    t = Template('{{for i in range(5)}}line {{i}}\n{{endfor}}')
+    assert list(t.iter_substitute({}, chunk_size=14)) == [
+        'line 0\nline 1\n', 'line 2\nline 3\n', 'line 4\n']
+    assert list(t.iter_substitute({}, chunk_size=1000, encoding='utf8')) == [
+        b'line 0\nline 1\nline 2\nline 3\nline 4\n']
+    assert ''.join(t.generate()) == t.substitute()
+
+def test_generate_lazily():
+    # The output is produced as it is asked for
+    produced = []
+    def item(i):
+        produced.append(i)
+        return i
+    t = Template('{{for i in range(4)}}{{item(i)}}{{endfor}}',
+                 namespace={'item': item})
+    t.chunk_size = 2
+    chunks = t.generate()
+    assert produced == []
+    assert next(chunks) == '01'
+    assert produced == [0, 1]
+    assert list(chunks) == ['23']
+    assert produced == [0, 1, 2, 3]
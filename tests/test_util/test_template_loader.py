@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+from paste.util.template import TemplateLoader, HTMLTemplate
+
+def setup_module(module):
+    module.tmpdir = tempfile.mkdtemp()
+
+def teardown_module(module):
+    shutil.rmtree(module.tmpdir)
+
+def write(name, content):
+    filename = os.path.join(tmpdir, name)
+    f = open(filename, 'w')
+    f.write(content)
+    f.close()
+    return filename
+
+def test_cache():
+    filename = write('cached.txt', 'Hi {{name}}')
+    loader = TemplateLoader(check_interval=0)
+    tmpl = loader.load(filename)
+    assert tmpl.substitute(name='Ian') == 'Hi Ian'
+    assert loader.load(filename) is tmpl
+    write('cached.txt', 'Bye {{name}}!')
+    assert loader.load(filename).substitute(name='Ian') == 'Bye Ian!'
+
+def test_check_interval():
+    filename = write('interval.txt', 'Hi {{name}}')
+    loader = TemplateLoader(check_interval=None)
+    tmpl = loader.load(filename)
+    write('interval.txt', 'Bye {{name}}!')
+    assert loader.load(filename) is tmpl
+
+def test_cache_size():
+    loader = TemplateLoader(cache_size=2)
+    for name in ['a.txt', 'b.txt', 'c.txt']:
+        loader.load(write(name, name))
+    assert [os.path.basename(path) for path, encoding in loader.cache] == [
+        'b.txt', 'c.txt']
+
+def test_cache_dir():
+    cache_dir = os.path.join(tmpdir, 'cache')
+    filename = write('disk.html', '{{for i in x}}{{i}}{{endfor}}')
+    loader = TemplateLoader(HTMLTemplate, cache_dir=cache_dir)
+    loader.load(filename)
+    assert len(os.listdir(cache_dir)) == 1
+    tmpl = TemplateLoader(HTMLTemplate, cache_dir=cache_dir).load(filename)
+    assert isinstance(tmpl, HTMLTemplate)
+    assert tmpl.substitute(x=['<', '>']) == '&lt;&gt;'